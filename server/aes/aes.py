@@ -1,20 +1,51 @@
+import io
 import os
+import math
+import zlib
+from collections import Counter
+from contextlib import contextmanager
 from pathlib import Path
 from Crypto.Cipher import AES
 from Crypto.Random import get_random_bytes
 from Crypto.Protocol.KDF import PBKDF2
 from Crypto.Hash import SHA256  # Import the hash module properly
+from core.jobs import report_progress
+from core.metrics import stage, BYTES_ENCRYPTED, BYTES_DECRYPTED
+from core.tracing import get_logger
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, zlib is always available
+    zstandard = None
 
 # Constants
 SALT_SIZE = 16       # Recommended salt size
 KEY_SIZE = 32        # 32 bytes = AES-256
 IV_SIZE = 12         # 12 bytes = GCM standard
+TAG_SIZE = 16        # GCM authentication tag
 PBKDF2_ITERATIONS = 200_000
+CHUNK_SIZE = 1024 * 1024
+
+# File header: MAGIC | version | flags | salt | tag | ciphertext
+# Files written before the header existed are plain salt | tag | ciphertext.
+MAGIC = b"OBSC"
+FORMAT_VERSION = 1
+
+# Compression flags (low bits of the flags byte)
+COMPRESS_NONE = 0
+COMPRESS_ZLIB = 1
+COMPRESS_ZSTD = 2
+COMPRESSION_MASK = 0x0F
+
+ENTROPY_SAMPLE_SIZE = 64 * 1024
+ENTROPY_THRESHOLD = 7.5  # bits per byte; above this the data is already compressed/random
 
 # Folder path
 BASE_DIR = Path(__file__).resolve().parent.parent
 FILES_FOLDER = os.path.join(BASE_DIR, "secured_files")
 
+logger = get_logger('aes')
+
 # Ensure folder exists
 def ensure_folder_exists(folder_path=None):
     """Ensures the target folder exists"""
@@ -23,10 +54,197 @@ def ensure_folder_exists(folder_path=None):
         os.makedirs(target_folder)
     return target_folder
 
+# Key derivation
+def derive_key_iv(encryption_key, salt):
+    """Derives the AES key and GCM nonce from the password and salt"""
+    # Convert encryption key to bytes if it's a string
+    if isinstance(encryption_key, str):
+        encryption_key = encryption_key.encode('utf-8')
+    
+    derived = PBKDF2(
+        password=encryption_key,
+        salt=salt,
+        dkLen=KEY_SIZE + IV_SIZE,
+        count=PBKDF2_ITERATIONS,
+        hmac_hash_module=SHA256  # Use the correct import
+    )
+    return derived[:KEY_SIZE], derived[KEY_SIZE:]
+
+# Compression helpers
+def default_compression():
+    """Returns the best compression algorithm available"""
+    return COMPRESS_ZSTD if zstandard is not None else COMPRESS_ZLIB
+
+def shannon_entropy(sample):
+    """Returns the Shannon entropy of a byte sample in bits per byte"""
+    if not sample:
+        return 0.0
+    total = len(sample)
+    return -sum((n / total) * math.log2(n / total) for n in Counter(sample).values())
+
+def is_compressible(sample):
+    """Quick check whether data is worth compressing, based on an entropy sample"""
+    return bool(sample) and shannon_entropy(sample) < ENTROPY_THRESHOLD
+
+def make_compressor(algorithm):
+    """Returns a streaming compressor object with compress()/flush(), or None"""
+    if algorithm == COMPRESS_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("zstandard is not installed")
+        return zstandard.ZstdCompressor(level=3).compressobj()
+    if algorithm == COMPRESS_ZLIB:
+        return zlib.compressobj(6)
+    return None
+
+def make_decompressor(algorithm):
+    """Returns a streaming decompressor object with decompress(), or None"""
+    if algorithm == COMPRESS_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("File is zstd compressed but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompressobj()
+    if algorithm == COMPRESS_ZLIB:
+        return zlib.decompressobj()
+    if algorithm != COMPRESS_NONE:
+        raise ValueError(f"Unknown compression flag: {algorithm}")
+    return None
+
+# Streaming encryptor
+class EncryptedWriter(io.RawIOBase):
+    """
+    File-like object that compresses (optionally) and encrypts everything written
+    to it into dst. The GCM tag is patched into the header on close(), so dst
+    must be seekable.
+    """
+
+    def __init__(self, dst, encryption_key, compression=COMPRESS_NONE):
+        super().__init__()
+        self._dst = dst
+        self._compressor = make_compressor(compression)
+        salt = get_random_bytes(SALT_SIZE)
+        key, iv = derive_key_iv(encryption_key, salt)
+        
+        # Header fields before the tag are authenticated as associated data
+        prefix = MAGIC + bytes([FORMAT_VERSION, compression & COMPRESSION_MASK]) + salt
+        self._cipher = AES.new(key, AES.MODE_GCM, nonce=iv)
+        self._cipher.update(prefix)
+        
+        self._tag_offset = dst.tell() + len(prefix)
+        dst.write(prefix + b"\0" * TAG_SIZE)
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        size = len(data)
+        self.bytes_in += size
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+        if data:
+            self._write_encrypted(data)
+        return size
+
+    def _write_encrypted(self, data):
+        chunk = self._cipher.encrypt(data)
+        self.bytes_out += len(chunk)
+        self._dst.write(chunk)
+
+    def close(self):
+        if self.closed:
+            return
+        if self._dst.closed:
+            # Abandoned writer (e.g. collected after an error); nothing to finalize
+            super().close()
+            return
+        if self._compressor is not None:
+            tail = self._compressor.flush()
+            if tail:
+                self._write_encrypted(tail)
+        tag = self._cipher.digest()
+        end = self._dst.tell()
+        self._dst.seek(self._tag_offset)
+        self._dst.write(tag)
+        self._dst.seek(end)
+        BYTES_ENCRYPTED.inc(self.bytes_in)
+        super().close()
+
+@contextmanager
+def encrypted_output(output_file_path, encryption_key, compress=False, compression=None):
+    """
+    Opens output_file_path for writing and yields a buffered binary stream whose
+    contents are encrypted on the fly, so plaintext never touches the disk.
+    compression names the algorithm outright; otherwise compress picks the default.
+    The partial file is removed if the block raises.
+    """
+    algorithm = compression if compression is not None else default_compression() if compress else COMPRESS_NONE
+    with open(output_file_path, 'wb') as dst:
+        writer = EncryptedWriter(dst, encryption_key, compression=algorithm)
+        stream = io.BufferedWriter(writer, CHUNK_SIZE)
+        try:
+            yield stream
+            stream.close()
+        except BaseException:
+            try:
+                stream.close()
+            except Exception:
+                pass
+            dst.close()
+            if os.path.exists(output_file_path):
+                os.remove(output_file_path)
+            raise
+
+# Streaming decryptor
+def decrypt_stream(src, dst, encryption_key):
+    """
+    Decrypts an encrypted stream from src into dst, decompressing if the header
+    says so. Raises ValueError if the password is wrong or the data was tampered with.
+    Returns the number of plaintext bytes written.
+    """
+    head = src.read(len(MAGIC))
+    if head == MAGIC:
+        version, flags = src.read(2)
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported encrypted file version: {version}")
+        salt = src.read(SALT_SIZE)
+        aad = MAGIC + bytes([version, flags]) + salt
+    else:
+        # Legacy layout without a header
+        flags = COMPRESS_NONE
+        salt = head + src.read(SALT_SIZE - len(head))
+        aad = None
+    tag = src.read(TAG_SIZE)
+    if len(salt) != SALT_SIZE or len(tag) != TAG_SIZE:
+        raise ValueError("Encrypted file is truncated")
+    
+    key, iv = derive_key_iv(encryption_key, salt)
+    cipher = AES.new(key, AES.MODE_GCM, nonce=iv)
+    if aad is not None:
+        cipher.update(aad)
+    decompressor = make_decompressor(flags & COMPRESSION_MASK)
+    
+    written = 0
+    for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+        plaintext = cipher.decrypt(chunk)
+        if decompressor is not None:
+            try:
+                plaintext = decompressor.decompress(plaintext)
+            except Exception:
+                # Corrupt ciphertext usually shows up here before the tag check
+                raise ValueError("Decompression failed")
+        dst.write(plaintext)
+        written += len(plaintext)
+    cipher.verify(tag)
+    BYTES_DECRYPTED.inc(written)
+    return written
+
 # ENCRYPT
-def encrypt_file(input_file_path, encryption_key, output_path=None):
+def encrypt_file(input_file_path, encryption_key, output_path=None, compress=False):
     """
     Encrypts a file using AES-GCM mode with password-based key derivation.
+    When compress is set, the plaintext is zstd/zlib compressed before encryption
+    unless a sample of the input shows it will not compress.
     """
     try:
         # Ensure input file exists
@@ -38,102 +256,68 @@ def encrypt_file(input_file_path, encryption_key, output_path=None):
         secure_filename = os.path.basename(input_file_path)
         output_file_path = os.path.join(output_folder, f"{secure_filename}.enc")
         
-        # Convert encryption key to bytes if it's a string
-        if isinstance(encryption_key, str):
-            encryption_key = encryption_key.encode('utf-8')
-        
-        # Perform encryption with correct hash module
-        salt = get_random_bytes(SALT_SIZE)
-        derived = PBKDF2(
-            password=encryption_key,
-            salt=salt,
-            dkLen=KEY_SIZE + IV_SIZE,
-            count=PBKDF2_ITERATIONS,
-            hmac_hash_module=SHA256  # Use the correct import
-        )
-        key = derived[:KEY_SIZE]
-        iv = derived[KEY_SIZE:]
-        
-        cipher = AES.new(key, AES.MODE_GCM, nonce=iv)
-        
-        # Read and encrypt file
-        with open(input_file_path, 'rb') as f:
-            plaintext = f.read()
-        
-        ciphertext, tag = cipher.encrypt_and_digest(plaintext)
+        # Decide on compression from a quick entropy sample of the input
+        algorithm = COMPRESS_NONE
+        if compress:
+            with open(input_file_path, 'rb') as f:
+                sample = f.read(ENTROPY_SAMPLE_SIZE)
+            if is_compressible(sample):
+                algorithm = default_compression()
+            else:
+                logger.info("Skipping compression, input looks incompressible: %s", secure_filename)
         
-        # Save encrypted file
-        with open(output_file_path, 'wb') as f:
-            f.write(salt + tag + ciphertext)
+        # Stream the file through the encryptor; a failure removes the truncated .enc file
+        total = os.path.getsize(input_file_path)
+        done = 0
+        with stage('aes_encrypt'), open(input_file_path, 'rb') as src, \
+                encrypted_output(output_file_path, encryption_key, compression=algorithm) as dst:
+            for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+                dst.write(chunk)
+                done += len(chunk)
+                report_progress(done, total, 'bytes')
         
-        print(f"✅ File encrypted successfully: {output_file_path}")
+        logger.info("File encrypted successfully: %s", output_file_path)
         return output_file_path
         
     except Exception as e:
-        print(f"❌ Encryption error: {str(e)}")
+        logger.error("Encryption error: %s", e)
         raise
 
 # 🔓 DECRYPT
 def decrypt_file(encrypted_file_path, encryption_key, output_path=None):
     """
     Decrypts a file using AES-GCM mode with password-based key derivation.
+    Compressed payloads are decompressed transparently.
     """
+    output_file_path = None
     try:
         # Setup output path
-        if output_path:
-            ensure_folder_exists(output_path)
-            filename = os.path.basename(encrypted_file_path)
-            if filename.endswith('.enc'):
-                output_filename = filename[:-4]
-            else:
-                output_filename = f"decrypted_{filename}"
-            output_file_path = os.path.join(output_path, output_filename)
+        target_folder = ensure_folder_exists(output_path)
+        filename = os.path.basename(encrypted_file_path)
+        if filename.endswith('.enc'):
+            output_filename = filename[:-4]
         else:
-            ensure_folder_exists()
-            filename = os.path.basename(encrypted_file_path)
-            if filename.endswith('.enc'):
-                output_filename = filename[:-4]
-            else:
-                output_filename = f"decrypted_{filename}"
-            output_file_path = os.path.join(FILES_FOLDER, output_filename)
+            output_filename = f"decrypted_{filename}"
+        output_file_path = os.path.join(target_folder, output_filename)
 
-        # Convert encryption key to bytes if it's a string
-        if isinstance(encryption_key, str):
-            encryption_key = encryption_key.encode('utf-8')
-        
-        with open(encrypted_file_path, 'rb') as f:
-            file_data = f.read()
-        
-        salt = file_data[:SALT_SIZE]
-        tag = file_data[SALT_SIZE:SALT_SIZE+16]
-        ciphertext = file_data[SALT_SIZE+16:]
-        
-        derived = PBKDF2(
-            password=encryption_key,
-            salt=salt,
-            dkLen=KEY_SIZE + IV_SIZE,
-            count=PBKDF2_ITERATIONS,
-            hmac_hash_module=SHA256  # Use the correct import
-        )
-        key = derived[:KEY_SIZE]
-        iv = derived[KEY_SIZE:]
-        
-        cipher = AES.new(key, AES.MODE_GCM, nonce=iv)
-        plaintext = cipher.decrypt_and_verify(ciphertext, tag)
-        
-        with open(output_file_path, 'wb') as f:
-            f.write(plaintext)
+        # Decrypt into a temporary file so a failed tag check never leaves plaintext behind
+        partial_path = f"{output_file_path}.part"
+        with stage('aes_decrypt'), open(encrypted_file_path, 'rb') as src, open(partial_path, 'wb') as dst:
+            decrypt_stream(src, dst, encryption_key)
+        os.replace(partial_path, output_file_path)
         
-        print("✅ File decrypted successfully!")
-        print(f"📁 Decrypted file saved to: {output_file_path}")
+        logger.info("File decrypted successfully: %s", output_file_path)
         return output_file_path
         
     except ValueError as e:
-        print("❌ Incorrect password or file tampered.")
+        logger.warning("Incorrect password or file tampered: %s", os.path.basename(encrypted_file_path))
         raise ValueError("Decryption failed: Invalid password or corrupted file")
     except Exception as e:
-        print(f"❌ Error during decryption: {str(e)}")
+        logger.error("Error during decryption: %s", e)
         raise
+    finally:
+        if output_file_path and os.path.exists(f"{output_file_path}.part"):
+            os.remove(f"{output_file_path}.part")
 
 # # Example usage
 # if __name__ == "__main__":
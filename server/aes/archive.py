@@ -0,0 +1,260 @@
+import os
+import json
+import struct
+from Crypto.Cipher import AES
+from Crypto.Random import get_random_bytes
+
+from aes.aes import (
+    SALT_SIZE, IV_SIZE, TAG_SIZE, CHUNK_SIZE, ENTROPY_SAMPLE_SIZE,
+    COMPRESS_NONE, derive_key_iv, default_compression, is_compressible,
+    make_compressor, make_decompressor, ensure_folder_exists,
+)
+from core.metrics import stage, BYTES_ENCRYPTED, BYTES_DECRYPTED
+from core.tracing import get_logger
+
+# Archive layout:
+#   header : ARCHIVE_MAGIC | version | salt
+#   members: AES-GCM ciphertext of each member, back to back
+#   index  : nonce | tag | AES-GCM ciphertext of the JSON member index
+#   footer : index offset (u64) | index length (u64) | ARCHIVE_MAGIC
+# One PBKDF2 run per archive; every member and the index get their own random nonce,
+# so a single member can be decrypted without touching the others.
+ARCHIVE_MAGIC = b"OBSA"
+ARCHIVE_VERSION = 1
+ARCHIVE_EXTENSION = ".obsa"
+FOOTER = struct.Struct(">QQ4s")
+
+logger = get_logger('archive')
+
+
+def is_archive(file_path):
+    """Returns True if the file is an encrypted archive"""
+    with open(file_path, 'rb') as f:
+        return f.read(len(ARCHIVE_MAGIC)) == ARCHIVE_MAGIC
+
+
+def _archive_key(encryption_key, salt):
+    key, _ = derive_key_iv(encryption_key, salt)
+    return key
+
+
+def _open_source(source):
+    """Accepts a path or a readable binary file object"""
+    if isinstance(source, (str, os.PathLike)):
+        return open(source, 'rb'), True
+    return source, False
+
+
+def create_archive(members, encryption_key, archive_name, output_path=None, compress=False):
+    """
+    Packs several files into one encrypted archive with an encrypted member index.
+
+    Args:
+        members: iterable of (member_name, source) where source is a path or binary file object
+        encryption_key (str|bytes): password
+        archive_name (str): archive file name (extension added if missing)
+        output_path (str): target folder, defaults to secured_files
+        compress (bool): compress members that look compressible
+
+    Returns:
+        str: Path to the archive
+    """
+    output_folder = ensure_folder_exists(output_path)
+    if not archive_name.endswith(ARCHIVE_EXTENSION):
+        archive_name += ARCHIVE_EXTENSION
+    archive_path = os.path.join(output_folder, archive_name)
+
+    salt = get_random_bytes(SALT_SIZE)
+    key = _archive_key(encryption_key, salt)
+    header = ARCHIVE_MAGIC + bytes([ARCHIVE_VERSION]) + salt
+
+    index = []
+    seen = set()
+    try:
+        with stage('archive_create'), open(archive_path, 'wb') as dst:
+            dst.write(header)
+            for name, source in members:
+                if name in seen:
+                    raise ValueError(f"Duplicate archive member: {name}")
+                seen.add(name)
+
+                src, should_close = _open_source(source)
+                try:
+                    index.append(_write_member(dst, src, name, key, header, compress))
+                finally:
+                    if should_close:
+                        src.close()
+
+            # Encrypt and append the index, then the footer pointing at it
+            nonce = get_random_bytes(IV_SIZE)
+            cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
+            cipher.update(header)
+            ciphertext, tag = cipher.encrypt_and_digest(json.dumps(index).encode('utf-8'))
+            index_offset = dst.tell()
+            dst.write(nonce + tag + ciphertext)
+            dst.write(FOOTER.pack(index_offset, IV_SIZE + TAG_SIZE + len(ciphertext), ARCHIVE_MAGIC))
+    except Exception:
+        if os.path.exists(archive_path):
+            os.remove(archive_path)
+        raise
+
+    logger.info("Archive created with %d members: %s", len(index), archive_path)
+    return archive_path
+
+
+def _write_member(dst, src, name, key, header, compress):
+    """Encrypts one member into dst and returns its index entry"""
+    first = src.read(ENTROPY_SAMPLE_SIZE)
+    algorithm = default_compression() if compress and is_compressible(first) else COMPRESS_NONE
+    compressor = make_compressor(algorithm)
+
+    nonce = get_random_bytes(IV_SIZE)
+    cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
+    # Bind the ciphertext to this archive and member name
+    cipher.update(header + name.encode('utf-8'))
+
+    offset = dst.tell()
+    size = 0
+    chunk = first
+    while chunk:
+        size += len(chunk)
+        if compressor is not None:
+            chunk = compressor.compress(chunk)
+        if chunk:
+            dst.write(cipher.encrypt(chunk))
+        chunk = src.read(CHUNK_SIZE)
+    if compressor is not None:
+        tail = compressor.flush()
+        if tail:
+            dst.write(cipher.encrypt(tail))
+    BYTES_ENCRYPTED.inc(size)
+
+    return {
+        'name': name,
+        'offset': offset,
+        'length': dst.tell() - offset,
+        'size': size,
+        'compression': algorithm,
+        'nonce': nonce.hex(),
+        'tag': cipher.digest().hex(),
+    }
+
+
+class ArchiveReader:
+    """
+    Reads an encrypted archive. Only the footer and the index are decrypted on open;
+    members are decrypted on demand.
+    """
+
+    def __init__(self, archive_path, encryption_key):
+        self.archive_path = archive_path
+        self._file = open(archive_path, 'rb')
+        try:
+            self._load_index(encryption_key)
+        except Exception:
+            self._file.close()
+            raise
+
+    def _load_index(self, encryption_key):
+        f = self._file
+        header_size = len(ARCHIVE_MAGIC) + 1 + SALT_SIZE
+        header = f.read(header_size)
+        size = os.fstat(f.fileno()).st_size
+        # Anything shorter than a header and a footer cannot be an archive
+        if (len(header) < header_size or header[:len(ARCHIVE_MAGIC)] != ARCHIVE_MAGIC
+                or size < header_size + FOOTER.size):
+            raise ValueError("Not an encrypted archive")
+        if header[len(ARCHIVE_MAGIC)] != ARCHIVE_VERSION:
+            raise ValueError(f"Unsupported archive version: {header[len(ARCHIVE_MAGIC)]}")
+        self._header = header
+        self._key = _archive_key(encryption_key, header[len(ARCHIVE_MAGIC) + 1:])
+
+        f.seek(size - FOOTER.size)
+        index_offset, index_length, magic = FOOTER.unpack(f.read(FOOTER.size))
+        if magic != ARCHIVE_MAGIC:
+            raise ValueError("Archive is truncated")
+        f.seek(index_offset)
+        blob = f.read(index_length)
+        nonce, tag, ciphertext = blob[:IV_SIZE], blob[IV_SIZE:IV_SIZE + TAG_SIZE], blob[IV_SIZE + TAG_SIZE:]
+
+        cipher = AES.new(self._key, AES.MODE_GCM, nonce=nonce)
+        cipher.update(header)
+        try:
+            index = json.loads(cipher.decrypt_and_verify(ciphertext, tag))
+        except ValueError:
+            raise ValueError("Decryption failed: Invalid password or corrupted archive")
+        self._index = {entry['name']: entry for entry in index}
+
+    def members(self):
+        """Returns the member list as dicts with name and size"""
+        return [{'name': e['name'], 'size': e['size']} for e in self._index.values()]
+
+    def extract(self, member_name, dst):
+        """Decrypts a single member into the writable binary stream dst"""
+        entry = self._index.get(member_name)
+        if entry is None:
+            raise KeyError(f"Member not found in archive: {member_name}")
+
+        cipher = AES.new(self._key, AES.MODE_GCM, nonce=bytes.fromhex(entry['nonce']))
+        cipher.update(self._header + member_name.encode('utf-8'))
+        decompressor = make_decompressor(entry['compression'])
+
+        self._file.seek(entry['offset'])
+        remaining = entry['length']
+        while remaining > 0:
+            chunk = self._file.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                raise ValueError("Archive is truncated")
+            remaining -= len(chunk)
+            plaintext = cipher.decrypt(chunk)
+            if decompressor is not None:
+                try:
+                    plaintext = decompressor.decompress(plaintext)
+                except Exception:
+                    raise ValueError("Decompression failed")
+            dst.write(plaintext)
+        cipher.verify(bytes.fromhex(entry['tag']))
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def list_archive(archive_path, encryption_key):
+    """Lists archive members without decrypting any of them"""
+    with ArchiveReader(archive_path, encryption_key) as reader:
+        return reader.members()
+
+
+def extract_members(archive_path, encryption_key, member_names=None, output_path=None):
+    """
+    Decrypts the named members (all members if None) into output_path.
+
+    Returns:
+        list: Paths of the extracted files
+    """
+    output_folder = ensure_folder_exists(output_path)
+    extracted = []
+    with stage('archive_extract'), ArchiveReader(archive_path, encryption_key) as reader:
+        names = member_names or [m['name'] for m in reader.members()]
+        for name in names:
+            target = os.path.join(output_folder, os.path.basename(name))
+            partial = f"{target}.part"
+            try:
+                with open(partial, 'wb') as dst:
+                    reader.extract(name, dst)
+                os.replace(partial, target)
+                BYTES_DECRYPTED.inc(os.path.getsize(target))
+            except ValueError:
+                raise ValueError(f"Decryption failed for member {name}: corrupted archive")
+            finally:
+                if os.path.exists(partial):
+                    os.remove(partial)
+            extracted.append(target)
+    logger.info("Extracted %d members from %s", len(extracted), archive_path)
+    return extracted
@@ -0,0 +1,284 @@
+import os
+import time
+import asyncio
+from quart import Quart, Request, Response, request, jsonify, send_file, g
+
+import settings
+from core.pools import run_cpu
+from controller.csvhandler_controller import (mask_obfuscate_csv_async, mask_obfuscate_csv_batch_async,
+                                              getcsvheader_async)
+from controller.pdfhandler_controller import maskpdf_async, maskpdf_batch_async, getpdfheader_async
+from controller.aeshandler_controller import encrypt_route_async, decrypt_route_async, list_archive_route_async
+from controller.jobs_controller import job_status_async, cancel_job_async, job_result_async
+from controller.policy_controller import register_policy_async, list_policies_async, get_policy_async
+from core.jobs import get_job_manager
+from core.results import result_path, start_sweeper
+from core import metrics
+from core.tracing import TRACE_HEADER, start_trace, finish_span, export_chrome_trace, trace_export_enabled
+from core.profiling import (PROFILE_HEADER, PROFILE_PARAM, PROFILE_ID_HEADER, ProfileSession,
+                            profile_requested, profiling_enabled, find_profile)
+from core.uploads import (MAX_UPLOAD_BYTES, UploadRejected, reserve_upload, release_upload,
+                          spooled_stream_factory)
+from core.admission import (AdmissionRejected, api_key_header, endpoint_pool,
+                            get_admission_controller)
+
+# -----------------------------
+# ASGI entry point with the same routes as server.py. Handlers await the shared
+# controller coroutines directly on one event loop; blocking work runs on the
+# pools in core.pools. Run with:  hypercorn asgi:app  (or python asgi.py)
+# -----------------------------
+
+settings.ensure_folders()
+
+
+class SpooledRequest(Request):
+    """Spools uploads to memory up to UPLOAD_SPOOL_BYTES, then to a temp file"""
+
+    def make_form_data_parser(self):
+        return self.form_data_parser_class(
+            max_content_length=self.max_content_length,
+            max_form_memory_size=self.max_form_memory_size,
+            max_form_parts=self.max_form_parts,
+            cls=self.parameter_storage_class,
+            stream_factory=spooled_stream_factory,
+        )
+
+
+app = Quart(__name__)
+app.request_class = SpooledRequest
+app.config['UPLOAD_FOLDER'] = settings.UPLOAD_FOLDER
+app.config['SECURED_FILES_FOLDER'] = settings.SECURED_FILES_FOLDER
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
+
+
+@app.before_request
+async def start_request_timer():
+    g.request_start = time.perf_counter()
+    # Each request is a trace; clients may pass their own id to correlate logs
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.trace_span, g.trace_token = start_trace(f"{request.method} {endpoint}", request.headers.get(TRACE_HEADER))
+
+@app.after_request
+async def record_request_metrics(response):
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - g.get('request_start', time.perf_counter()),
+                                         endpoint=endpoint, method=request.method,
+                                         status=str(response.status_code))
+    if 'trace_span' in g:
+        response.headers[TRACE_HEADER] = g.trace_span.trace_id
+    return response
+
+
+# Upload endpoints wait for a slot in the interactive or batch pool, fairly per
+# client; full queues answer 429 with Retry-After before the body is read
+@app.before_request
+async def admit_request():
+    controller = get_admission_controller()
+    pool = endpoint_pool(request.url_rule.rule) if request.url_rule else None
+    if controller is None or pool is None or request.method != 'POST':
+        return None
+    try:
+        ticket = await controller.admit_async(pool, request.headers.get(api_key_header()), request.remote_addr)
+    except AdmissionRejected as e:
+        response = jsonify({'error': str(e)})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, e.status
+    g.admission = (controller, ticket)
+
+@app.teardown_request
+async def release_admission(exc):
+    if 'admission' in g:
+        controller, ticket = g.pop('admission')
+        controller.release(ticket)
+
+
+# Upload budgets are checked from Content-Length before the body is read
+@app.before_request
+async def reserve_upload_budget():
+    try:
+        g.upload_reserved = reserve_upload(request.content_length if request.method == 'POST' else 0)
+    except UploadRejected as e:
+        response = jsonify({'error': str(e)})
+        if e.retry_after:
+            response.headers['Retry-After'] = str(e.retry_after)
+        return response, e.status
+
+@app.teardown_request
+async def release_upload_budget(exc):
+    release_upload(g.pop('upload_reserved', 0))
+
+@app.teardown_request
+async def finish_request_trace(exc):
+    if 'trace_span' in g:
+        finish_span(g.pop('trace_span'), g.pop('trace_token'))
+
+
+# Opt-in profiling (PROFILING=1): X-Profile: 1 or ?profile=1 profiles one request
+@app.before_request
+async def start_profile():
+    if profile_requested(request.headers.get(PROFILE_HEADER) or request.args.get(PROFILE_PARAM)):
+        g.profile = ProfileSession(g.trace_span.name, g.trace_span.trace_id).start()
+
+@app.after_request
+async def finish_profile(response):
+    if 'profile' in g:
+        session = g.pop('profile')
+        session.finish(response.status_code)
+        response.headers[PROFILE_ID_HEADER] = session.profile_id
+    return response
+
+@app.teardown_request
+async def abandon_profile(exc):
+    # Requests that never reached after_request still release tracemalloc
+    if 'profile' in g:
+        g.pop('profile').finish()
+
+
+@app.after_request
+async def add_cors_headers(response):
+    origin = request.headers.get('Origin')
+    if origin in settings.CORS_ORIGINS:
+        response.headers['Access-Control-Allow-Origin'] = origin
+        response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
+        response.headers['Access-Control-Allow-Headers'] = f'Content-Type, {api_key_header()}'
+    return response
+
+
+@app.before_serving
+async def warm_up():
+    # Pick up jobs that were queued or running when the server last stopped
+    await run_cpu(get_job_manager)
+    start_sweeper()
+
+    # Optionally load the LLM backend (e.g. the local model) in the background
+    if os.getenv("LLM_WARMUP", "").lower() in ("1", "true", "yes"):
+        from obfuscate.llmclient import get_client
+        asyncio.get_running_loop().run_in_executor(None, get_client().backend.warmup)
+
+
+async def handle(controller):
+    """Runs a shared controller coroutine against the current request"""
+    payload, status = await controller(await request.form, await request.files)
+    return jsonify(payload), status
+
+
+# csv routes
+@app.route("/getcsvheader", methods=['POST'])
+async def get_csv_header_route():
+    return await handle(getcsvheader_async)
+
+@app.route("/maskobfcsv", methods=['POST'])
+async def mask_csv_route():
+    return await handle(mask_obfuscate_csv_async)
+
+@app.route("/maskobfcsv/batch", methods=['POST'])
+async def mask_csv_batch_route():
+    return await handle(mask_obfuscate_csv_batch_async)
+
+
+# pdf routes
+@app.route("/getpdfheader", methods=['POST'])
+async def get_pdf_header_route():
+    return await handle(getpdfheader_async)
+
+@app.route("/maskobfpdf", methods=['POST'])
+async def mask_pdf_route():
+    return await handle(maskpdf_async)
+
+@app.route("/maskobfpdf/batch", methods=['POST'])
+async def mask_pdf_batch_route():
+    return await handle(maskpdf_batch_async)
+
+
+# encryption routes
+@app.route("/encryptfile", methods=['POST'])
+async def encrypt_file_route():
+    return await handle(encrypt_route_async)
+
+@app.route("/decryptfile", methods=['POST'])
+async def decrypt_file_route():
+    return await handle(decrypt_route_async)
+
+@app.route("/listarchive", methods=['POST'])
+async def list_archive_file_route():
+    return await handle(list_archive_route_async)
+
+
+# masking policy routes
+@app.route("/policies", methods=['GET'])
+async def list_policies_route():
+    return await handle(list_policies_async)
+
+@app.route("/policies", methods=['POST'])
+async def register_policy_route():
+    return await handle(register_policy_async)
+
+@app.route("/policies/<name>", methods=['GET'])
+async def get_policy_route(name):
+    payload, status = await get_policy_async(name)
+    return jsonify(payload), status
+
+
+# background job routes
+@app.route("/jobs/<job_id>", methods=['GET'])
+async def job_status_route(job_id):
+    payload, status = await job_status_async(job_id)
+    return jsonify(payload), status
+
+@app.route("/jobs/<job_id>/cancel", methods=['POST'])
+async def cancel_job_route(job_id):
+    payload, status = await cancel_job_async(job_id)
+    return jsonify(payload), status
+
+@app.route("/jobs/<job_id>/result", methods=['GET'])
+async def job_result_route(job_id):
+    payload, status, path = await job_result_async(job_id)
+    if path is not None:
+        return await send_file(path, as_attachment=True, attachment_filename=os.path.basename(path), conditional=True)
+    return jsonify(payload), status
+
+
+# Prometheus metrics
+@app.route("/metrics", methods=['GET'])
+async def metrics_route():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+# Recent spans in the Chrome trace event format (chrome://tracing, Perfetto)
+@app.route("/traces", methods=['GET'])
+async def traces_route():
+    if not trace_export_enabled():
+        return jsonify({'error': 'Trace export is disabled'}), 404
+    return jsonify(export_chrome_trace(request.args.get('traceId')))
+
+
+# Profile artifacts: the JSON summary, or the merged cProfile stats for pstats/snakeviz
+@app.route("/profiles/<profile_id>", methods=['GET'])
+async def profile_summary_route(profile_id):
+    path = find_profile(profile_id) if profiling_enabled() else None
+    if path is None:
+        return jsonify({'error': 'Profile not found'}), 404
+    return await send_file(path, mimetype='application/json')
+
+@app.route("/profiles/<profile_id>/pstats", methods=['GET'])
+async def profile_stats_route(profile_id):
+    path = find_profile(profile_id, 'pstats') if profiling_enabled() else None
+    if path is None:
+        return jsonify({'error': 'Profile not found'}), 404
+    return await send_file(path, as_attachment=True, attachment_filename=f'{profile_id}.prof')
+
+
+# File Download route
+@app.route("/api/files/download/<filename>", methods=['GET'])
+async def download_file(filename):
+    file_path = result_path(filename)
+    if file_path is None:
+        return jsonify({'error': 'File not found'}), 404
+
+    # Results stay until the sweeper expires them, so interrupted downloads can
+    # resume with Range requests; ETag/Last-Modified answer conditional requests
+    return await send_file(file_path, as_attachment=True, conditional=True)
+
+
+if __name__ == "__main__":
+    app.run(debug=True)
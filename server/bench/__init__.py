@@ -0,0 +1,10 @@
+import subprocess
+
+
+def git_revision():
+    """Short commit id of the checkout, recorded with benchmark results"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
@@ -0,0 +1,99 @@
+import io
+import csv
+import random
+
+# -----------------------------
+# Seeded synthetic inputs for the benchmarks and the load tester. The same
+# seed always produces the same bytes, so results are comparable across runs.
+# Values are made up; formats match what the PII detectors look for.
+# -----------------------------
+
+FIRST_NAMES = ["James", "Mary", "Robert", "Patricia", "John", "Jennifer", "Michael", "Linda",
+               "David", "Elizabeth", "William", "Barbara", "Richard", "Susan", "Joseph", "Jessica"]
+LAST_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis",
+              "Rodriguez", "Martinez", "Hernandez", "Lopez", "Wilson", "Anderson", "Taylor", "Moore"]
+STREETS = ["Main St", "Oak Ave", "Pine Rd", "Maple Dr", "Cedar Ln", "Elm Street", "Lake Blvd"]
+DOMAINS = ["example.com", "mail.test", "corp.example.org"]
+FILLER = ("The quarterly review covered staffing, budget and delivery milestones. "
+          "No further action is required until the next planning cycle. ")
+
+# Column name -> value generator; the first entries are the usual PII columns
+PII_COLUMNS = {
+    "Name": lambda r: f"{r.choice(FIRST_NAMES)} {r.choice(LAST_NAMES)}",
+    "Email": lambda r: f"{r.choice(FIRST_NAMES).lower()}.{r.choice(LAST_NAMES).lower()}{r.randint(1, 999)}@{r.choice(DOMAINS)}",
+    "Phone": lambda r: f"{r.randint(200, 999)}-{r.randint(200, 999)}-{r.randint(1000, 9999)}",
+    "SSN": lambda r: f"{r.randint(100, 899)}-{r.randint(10, 99)}-{r.randint(1000, 9999)}",
+    "Address": lambda r: f"{r.randint(1, 9999)} {r.choice(STREETS)}",
+    "Date of Birth": lambda r: f"{r.randint(1940, 2005)}-{r.randint(1, 12):02d}-{r.randint(1, 28):02d}",
+}
+
+
+def pii_column_names(count):
+    """The first count PII columns, numbered once the named ones run out"""
+    names = list(PII_COLUMNS)
+    return [names[i] if i < len(names) else f"{names[i % len(names)]} {i // len(names) + 1}"
+            for i in range(count)]
+
+
+def _value(rng, column):
+    base = column if column in PII_COLUMNS else column.rsplit(' ', 1)[0]
+    return PII_COLUMNS[base](rng)
+
+
+def generate_csv(rows, pii_columns=3, extra_columns=1, seed=0):
+    """
+    CSV bytes with rows data rows, pii_columns PII columns and extra_columns
+    non-PII numeric columns.
+    """
+    rng = random.Random(seed)
+    pii = pii_column_names(pii_columns)
+    extra = [f"Metric {i + 1}" for i in range(extra_columns)]
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(pii + extra)
+    for _ in range(rows):
+        writer.writerow([_value(rng, c) for c in pii] + [rng.randint(0, 100000) for _ in extra])
+    return out.getvalue().encode('utf-8')
+
+
+def csv_field_config(columns, mode="mask", prompt="Replace with realistic fake values"):
+    """Field configuration (the headers form field) applying mode to every column"""
+    return [{"name": c, "mode": mode, "prompt": prompt} for c in columns]
+
+
+def generate_pdf(pages, pii_density=0.3, lines_per_page=40, seed=0):
+    """
+    PDF bytes with pages pages of text; pii_density is the share of lines that
+    carry a name, email, phone number and SSN rather than filler text.
+    """
+    import fitz
+
+    rng = random.Random(seed)
+    doc = fitz.open()
+    try:
+        for page_num in range(pages):
+            page = doc.new_page()
+            lines = [f"Page {page_num + 1}  Name, Email, Phone, SSN"]
+            for _ in range(lines_per_page - 1):
+                if rng.random() < pii_density:
+                    lines.append(", ".join(PII_COLUMNS[c](rng) for c in ("Name", "Email", "Phone", "SSN")))
+                else:
+                    lines.append(FILLER[:rng.randint(40, len(FILLER))].strip())
+            page.insert_text((36, 48), "\n".join(lines), fontsize=9)
+        return doc.tobytes()
+    finally:
+        doc.close()
+
+
+def pdf_field_config(mode="mask", prompt="Replace with realistic fake values"):
+    """Field configuration for the fields generate_pdf() fills in"""
+    return [{"name": c, "mode": mode, "prompt": prompt} for c in ("Name", "Email", "Phone", "SSN")]
+
+
+def generate_binary(size, seed=0, compressible=False):
+    """size bytes for encryption benchmarks; compressible data repeats a short pattern"""
+    rng = random.Random(seed)
+    if compressible:
+        pattern = bytes(rng.getrandbits(8) for _ in range(256))
+        return (pattern * (size // len(pattern) + 1))[:size]
+    return rng.randbytes(size)
@@ -0,0 +1,89 @@
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+# -----------------------------
+# Import-time budget check. Each entry point is imported in a fresh interpreter
+# with -X importtime. The check fails when the cumulative import time goes over
+# its budget, or when a heavy dependency that should be loaded lazily turns up.
+# Run from the server folder (exit status 1 on failure):
+#   python -m bench.importtime
+#   python -m bench.importtime --scale 2     # slower machine: double every budget
+# -----------------------------
+
+# Loaded on first use by the subsystem that needs them, never at import time
+HEAVY_MODULES = ['pandas', 'fitz', 'pymupdf', 'PyPDF2', 'pydantic', 'google.generativeai', 'torch', 'transformers']
+
+# module -> (budget in milliseconds, modules it must not pull in)
+BUDGETS = {
+    'server': (400, HEAVY_MODULES),
+    'asgi': (500, HEAVY_MODULES),
+    'aes.aes': (150, HEAVY_MODULES + ['flask', 'werkzeug']),
+    'aes.archive': (150, HEAVY_MODULES + ['flask', 'werkzeug']),
+    'obfuscate.csvhandler': (200, HEAVY_MODULES),
+    'obfuscate.pdfhandler': (200, HEAVY_MODULES),
+}
+
+PROBE = """
+import sys, json
+import {module}
+print(json.dumps(sorted(sys.modules)))
+"""
+
+
+def measure(module):
+    """(cumulative import microseconds, loaded module names) from a fresh interpreter"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', PROBE.format(module=module)],
+                            capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr}")
+    cumulative = None
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = [field.strip() for field in line[len('import time:'):].split('|')]
+        if fields[2] == module:
+            cumulative = int(fields[1])
+    loaded = json.loads(result.stdout.strip().splitlines()[-1])
+    return cumulative, loaded
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Checks import time and lazy imports of the entry points")
+    parser.add_argument('--runs', type=int, default=3, help="imports per module; the median counts")
+    parser.add_argument('--scale', type=float, default=1.0, help="multiplier for every budget")
+    parser.add_argument('--only', help="comma-separated module names")
+    args = parser.parse_args(argv)
+
+    only = set(args.only.split(',')) if args.only else None
+    failures = []
+    for module, (budget_ms, forbidden) in BUDGETS.items():
+        if only and module not in only:
+            continue
+        timings = []
+        for _ in range(args.runs):
+            cumulative, loaded = measure(module)
+            timings.append(cumulative / 1000)
+        elapsed = statistics.median(timings)
+        budget = budget_ms * args.scale
+        eager = [name for name in forbidden if name in loaded]
+        status = 'ok'
+        if elapsed > budget:
+            failures.append(f"{module} imports in {elapsed:.0f} ms, budget {budget:.0f} ms")
+            status = 'OVER BUDGET'
+        if eager:
+            failures.append(f"{module} eagerly imports {', '.join(eager)}")
+            status = 'EAGER IMPORTS'
+        print(f"{module:<24}{elapsed:>8.0f} ms / {budget:>5.0f} ms  {status}")
+
+    for failure in failures:
+        print(f"FAIL {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
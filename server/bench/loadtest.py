@@ -0,0 +1,330 @@
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+
+import requests
+
+from bench import generators, git_revision
+
+# -----------------------------
+# End-to-end load generator for the HTTP API. Drives a weighted mix of
+# endpoints at one or more concurrency levels, for a fixed time per level, and
+# reports throughput, p50/p95/p99 latency and error rates overall and per
+# endpoint, plus the server's resident memory over time (sampled from the
+# process_resident_memory_bytes gauge on /metrics). Without --url it starts a
+# local server on a free port with the fake LLM backend. Run from the server folder:
+#   python -m bench.loadtest --server flask --concurrency 1,4,16 --duration 30 --out load.json
+#   python -m bench.loadtest --url http://127.0.0.1:5000 --mix maskobfcsv=3,encryptfile=1
+#   python -m bench.loadtest --baseline load.json --threshold 0.15
+# -----------------------------
+
+DEFAULT_MIX = "getcsvheader=1,maskobfcsv=4,getpdfheader=1,maskobfpdf=2,encryptfile=1,decryptfile=1"
+ENCRYPTION_KEY = "loadtest-key"
+SERVER_COMMANDS = {
+    'flask': lambda port: [sys.executable, '-c',
+                           f"import server; server.app.run(host='127.0.0.1', port={port}, threaded=True)"],
+    'asgi': lambda port: [sys.executable, '-m', 'hypercorn', 'asgi:app', '--bind', f'127.0.0.1:{port}'],
+}
+
+
+def parse_mix(text):
+    """'maskobfcsv=4,encryptfile=1' -> {'maskobfcsv': 4.0, 'encryptfile': 1.0}"""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def latency_summary(latencies):
+    values = sorted(latencies)
+    return {
+        'p50': percentile(values, 0.50),
+        'p95': percentile(values, 0.95),
+        'p99': percentile(values, 0.99),
+        'max': values[-1] if values else None,
+        'mean': sum(values) / len(values) if values else None,
+    }
+
+
+class Workload:
+    """Builds the form data and uploads for each endpoint from seeded inputs"""
+
+    def __init__(self, args, workdir, output_path):
+        self.output_path = output_path
+        self.csv_bytes = generators.generate_csv(args.csv_rows, args.csv_columns, seed=args.seed)
+        self.csv_columns = generators.pii_column_names(args.csv_columns)
+        self.pdf_bytes = generators.generate_pdf(args.pdf_pages, seed=args.seed)
+        self.binary_bytes = generators.generate_binary(args.file_bytes, seed=args.seed)
+
+        # Encrypted input for /decryptfile, made with the same format the server reads
+        from aes.aes import encrypt_file
+        plain_path = os.path.join(workdir, 'load.bin')
+        with open(plain_path, 'wb') as f:
+            f.write(self.binary_bytes)
+        with open(encrypt_file(plain_path, ENCRYPTION_KEY, workdir), 'rb') as f:
+            self.encrypted_bytes = f.read()
+
+    def _form(self, **fields):
+        if self.output_path:
+            fields['outputPath'] = self.output_path
+        return fields
+
+    def request(self, endpoint):
+        """(path, form, files) for one call to endpoint"""
+        if endpoint == 'getcsvheader':
+            return '/getcsvheader', {}, {'file': ('load.csv', self.csv_bytes, 'text/csv')}
+        if endpoint == 'maskobfcsv':
+            headers = generators.csv_field_config(self.csv_columns[:1], 'obfuscate') + \
+                generators.csv_field_config(self.csv_columns[1:], 'mask')
+            return '/maskobfcsv', self._form(headers=json.dumps(headers)), \
+                {'file': ('load.csv', self.csv_bytes, 'text/csv')}
+        if endpoint == 'getpdfheader':
+            return '/getpdfheader', {}, {'file': ('load.pdf', self.pdf_bytes, 'application/pdf')}
+        if endpoint == 'maskobfpdf':
+            return '/maskobfpdf', self._form(headers=json.dumps(generators.pdf_field_config('mask'))), \
+                {'file': ('load.pdf', self.pdf_bytes, 'application/pdf')}
+        if endpoint == 'encryptfile':
+            headers = json.dumps([{'mode': 'encrypt', 'key': ENCRYPTION_KEY}])
+            return '/encryptfile', self._form(headers=headers), \
+                {'file': ('load.bin', self.binary_bytes, 'application/octet-stream')}
+        if endpoint == 'decryptfile':
+            headers = json.dumps([{'mode': 'decrypt', 'key': ENCRYPTION_KEY}])
+            return '/decryptfile', self._form(headers=headers), \
+                {'file': ('load.bin.enc', self.encrypted_bytes, 'application/octet-stream')}
+        raise ValueError(f"Unknown endpoint: {endpoint}")
+
+
+def start_server(kind, workdir, llm_latency, with_caches):
+    """Starts a local server on a free port; returns (process, base url, log path)"""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    env = dict(os.environ, LLM_BACKEND='fake', LLM_FAKE_LATENCY=str(llm_latency), LOG_LEVEL='WARNING')
+    if not with_caches:
+        env.update(LLM_CACHE='0', RESULT_CACHE='0')
+    log_path = os.path.join(workdir, 'server.log')
+    log = open(log_path, 'wb')
+    server_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.Popen(SERVER_COMMANDS[kind](port), cwd=server_dir, env=env,
+                               stdout=log, stderr=subprocess.STDOUT)
+    log.close()
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            break
+        try:
+            if requests.get(f"{url}/metrics", timeout=1).status_code == 200:
+                return process, url, log_path
+        except requests.RequestException:
+            pass
+        time.sleep(0.25)
+    process.kill()
+    raise RuntimeError(f"Server did not start, see {log_path}")
+
+
+def read_rss(session, url):
+    try:
+        text = session.get(f"{url}/metrics", timeout=5).text
+    except requests.RequestException:
+        return None
+    for line in text.splitlines():
+        if line.startswith('process_resident_memory_bytes '):
+            return int(float(line.split()[1]))
+    return None
+
+
+def run_level(url, workload, mix, concurrency, duration, seed, rss_interval):
+    """Runs concurrency workers for duration seconds; returns the level's report"""
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    records = []
+    records_lock = threading.Lock()
+    stop = threading.Event()
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        session = requests.Session()
+        local = []
+        while not stop.is_set():
+            endpoint = rng.choices(names, weights)[0]
+            path, form, files = workload.request(endpoint)
+            start = time.perf_counter()
+            try:
+                status = session.post(f"{url}{path}", data=form, files=files, timeout=300).status_code
+            except requests.RequestException:
+                status = None
+            local.append((endpoint, time.perf_counter() - start, status))
+        with records_lock:
+            records.extend(local)
+
+    rss_samples = []
+
+    def sample_rss():
+        session = requests.Session()
+        started = time.perf_counter()
+        while True:
+            rss = read_rss(session, url)
+            if rss is not None:
+                rss_samples.append([round(time.perf_counter() - started, 3), rss])
+            if stop.wait(rss_interval):
+                break
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    sampler = threading.Thread(target=sample_rss, daemon=True)
+    started = time.perf_counter()
+    sampler.start()
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    # Requests in flight are allowed to finish and count towards this level
+    for thread in threads:
+        thread.join()
+    sampler.join()
+    elapsed = time.perf_counter() - started
+
+    def summarize(rows):
+        errors = sum(1 for _, _, status in rows if status is None or status >= 400)
+        return {
+            'requests': len(rows),
+            'errors': errors,
+            'error_rate': errors / len(rows) if rows else 0.0,
+            'throughput_rps': len(rows) / elapsed,
+            'latency': latency_summary([latency for _, latency, _ in rows]),
+        }
+
+    report = {'concurrency': concurrency, 'duration_seconds': elapsed}
+    report.update(summarize(records))
+    report['endpoints'] = {name: summarize([r for r in records if r[0] == name]) for name in names}
+    report['rss'] = {
+        'max_bytes': max((b for _, b in rss_samples), default=None),
+        'samples': rss_samples,
+    }
+    return report
+
+
+def print_level(level):
+    latency = level['latency']
+    rss = level['rss']['max_bytes']
+    print(f"c={level['concurrency']:<4} {level['throughput_rps']:>8.2f} req/s  "
+          f"p50 {latency['p50'] or 0:.3f}s  p95 {latency['p95'] or 0:.3f}s  p99 {latency['p99'] or 0:.3f}s  "
+          f"errors {level['error_rate']:.1%}  rss max {(rss or 0) / 1e6:,.0f} MB")
+    for name, stats in level['endpoints'].items():
+        if stats['requests']:
+            print(f"    {name:<14}{stats['requests']:>6} req  p95 {stats['latency']['p95']:.3f}s  "
+                  f"errors {stats['error_rate']:.1%}")
+
+
+def compare(results, baseline, threshold):
+    """Compares levels with the same concurrency; returns descriptions of regressions"""
+    regressions = []
+    base_levels = {level['concurrency']: level for level in baseline.get('levels', [])}
+    for level in results['levels']:
+        base = base_levels.get(level['concurrency'])
+        if base is None:
+            continue
+        c = level['concurrency']
+        if base['throughput_rps'] and level['throughput_rps'] < base['throughput_rps'] * (1 - threshold):
+            regressions.append(f"c={c} throughput {base['throughput_rps']:.2f} -> {level['throughput_rps']:.2f} req/s")
+        base_p95, p95 = base['latency']['p95'], level['latency']['p95']
+        if base_p95 and p95 and p95 > base_p95 * (1 + threshold):
+            regressions.append(f"c={c} p95 {base_p95:.3f}s -> {p95:.3f}s")
+        if level['error_rate'] > base['error_rate'] + 0.01:
+            regressions.append(f"c={c} error rate {base['error_rate']:.1%} -> {level['error_rate']:.1%}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test for the HTTP API")
+    parser.add_argument('--url', help="server to test; a local one is started when omitted")
+    parser.add_argument('--server', choices=sorted(SERVER_COMMANDS), default='flask',
+                        help="which local server to start")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help="endpoint=weight pairs")
+    parser.add_argument('--concurrency', default="1,4,16", help="comma-separated concurrency levels")
+    parser.add_argument('--duration', type=float, default=30, help="seconds per concurrency level")
+    parser.add_argument('--csv-rows', type=int, default=1000)
+    parser.add_argument('--csv-columns', type=int, default=3)
+    parser.add_argument('--pdf-pages', type=int, default=3)
+    parser.add_argument('--file-bytes', type=int, default=1024 * 1024)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--llm-latency', type=float, default=0.05, help="local server: fake backend delay per call")
+    parser.add_argument('--with-caches', action='store_true', help="local server: keep the LLM and result caches on")
+    parser.add_argument('--rss-interval', type=float, default=1.0)
+    parser.add_argument('--out', help="write results as JSON to this path")
+    parser.add_argument('--baseline', help="JSON results of an earlier run to compare against")
+    parser.add_argument('--threshold', type=float, default=0.15)
+    args = parser.parse_args(argv)
+
+    mix = parse_mix(args.mix)
+    levels = [int(c) for c in args.concurrency.split(',')]
+    results = {
+        'meta': {
+            'revision': git_revision(),
+            'timestamp': time.time(),
+            'server': args.url or args.server,
+            'options': vars(args),
+        },
+        'levels': [],
+    }
+
+    with tempfile.TemporaryDirectory(prefix='obscura-load-') as workdir:
+        process = None
+        url = args.url
+        output_path = None
+        if url is None:
+            process, url, log_path = start_server(args.server, workdir, args.llm_latency, args.with_caches)
+            # Keep outputs of the local server out of the client folder
+            output_path = os.path.join(workdir, 'outputs')
+            print(f"Started {args.server} server at {url} (log: {log_path})")
+        try:
+            workload = Workload(args, workdir, output_path)
+            # One untimed call per endpoint loads modules and models before measuring
+            for endpoint in mix:
+                path, form, files = workload.request(endpoint)
+                requests.post(f"{url}{path}", data=form, files=files, timeout=300)
+            for concurrency in levels:
+                level = run_level(url, workload, mix, concurrency, args.duration, args.seed, args.rss_interval)
+                results['levels'].append(level)
+                print_level(level)
+        finally:
+            if process is not None:
+                process.terminate()
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
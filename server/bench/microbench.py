@@ -0,0 +1,239 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import tempfile
+import statistics
+import tracemalloc
+from io import BytesIO, StringIO
+
+# -----------------------------
+# Microbenchmarks for the masking and encryption pipelines, run in-process on
+# seeded synthetic inputs with the deterministic fake LLM backend. Each
+# benchmark reports wall time, throughput, time per pipeline stage (from the
+# obscura_stage_seconds histogram) and the Python heap peak under tracemalloc.
+# Run from the server folder:
+#   python -m bench.microbench --size small --out bench-results.json
+#   python -m bench.microbench --baseline bench-results.json --threshold 0.15
+# With --baseline the run exits with status 1 if any benchmark got slower (or
+# its memory peak grew) by more than the threshold.
+# -----------------------------
+
+# Benchmarks measure the pipelines, not the caches in front of them
+os.environ.setdefault("LLM_CACHE", "0")
+os.environ.setdefault("RESULT_CACHE", "0")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from bench import generators, git_revision
+from core import metrics
+from core.pools import run_cpu
+from obfuscate.llmclient import LLMClient, FakeBackend, set_client
+
+SIZES = {
+    'small': {'rows': 2000, 'pii_columns': 3, 'pages': 5, 'binary_bytes': 4 * 1024 * 1024},
+    'medium': {'rows': 50000, 'pii_columns': 4, 'pages': 40, 'binary_bytes': 64 * 1024 * 1024},
+    'large': {'rows': 500000, 'pii_columns': 6, 'pages': 200, 'binary_bytes': 512 * 1024 * 1024},
+}
+ENCRYPTION_KEY = "benchmark-key"
+
+
+class Benchmark:
+    """
+    A named workload: setup() once (a plain or async function), then run()
+    repeatedly; run returns an awaitable and units/unit give the throughput.
+    """
+
+    def __init__(self, name, run, units, unit, setup=None):
+        self.name = name
+        self.run = run
+        self.units = units
+        self.unit = unit
+        self.setup = setup
+
+
+def build_benchmarks(size, seed, workdir):
+    from obfuscate.csvhandler import maskobfcsv_async
+    from obfuscate.pdfhandler import predictpdfheaders_async, maskobfpdf_async
+    from aes.aes import encrypt_file, decrypt_file
+
+    csv_bytes = generators.generate_csv(size['rows'], size['pii_columns'], seed=seed)
+    csv_text = csv_bytes.decode('utf-8')
+    columns = generators.pii_column_names(size['pii_columns'])
+    pdf_bytes = generators.generate_pdf(size['pages'], seed=seed)
+
+    def csv_run(mode, encrypt=False):
+        config = {'fileName': 'bench.csv', 'outputPath': workdir,
+                  'headers': generators.csv_field_config(columns, mode)}
+        if encrypt:
+            config['encryptionKey'] = ENCRYPTION_KEY
+        return lambda: maskobfcsv_async(config, StringIO(csv_text))
+
+    def pdf_run(mode):
+        config = {'fileName': 'bench.pdf', 'outputPath': workdir,
+                  'headers': generators.pdf_field_config(mode)}
+        return lambda: maskobfpdf_async(config, BytesIO(pdf_bytes))
+
+    def pdf_detect():
+        # Masking works on the values found by header detection
+        return predictpdfheaders_async(BytesIO(pdf_bytes))
+
+    plain_path = os.path.join(workdir, 'bench.bin')
+    text_path = os.path.join(workdir, 'bench.txt')
+    decrypt_dir = os.path.join(workdir, 'decrypted')
+
+    def write_inputs():
+        with open(plain_path, 'wb') as f:
+            f.write(generators.generate_binary(size['binary_bytes'], seed=seed))
+        with open(text_path, 'wb') as f:
+            f.write(generators.generate_binary(size['binary_bytes'], seed=seed, compressible=True))
+
+    def encrypt_input():
+        write_inputs()
+        encrypt_file(plain_path, ENCRYPTION_KEY, workdir)
+
+    return [
+        Benchmark('csv_mask', csv_run('mask'), size['rows'], 'rows'),
+        Benchmark('csv_obfuscate', csv_run('obfuscate'), size['rows'], 'rows'),
+        Benchmark('csv_mask_encrypt', csv_run('mask', encrypt=True), size['rows'], 'rows'),
+        Benchmark('pdf_headers', lambda: predictpdfheaders_async(BytesIO(pdf_bytes)), size['pages'], 'pages'),
+        Benchmark('pdf_mask', pdf_run('mask'), size['pages'], 'pages', setup=pdf_detect),
+        Benchmark('pdf_obfuscate', pdf_run('obfuscate'), size['pages'], 'pages', setup=pdf_detect),
+        Benchmark('aes_encrypt', lambda: run_cpu(encrypt_file, plain_path, ENCRYPTION_KEY, workdir),
+                  size['binary_bytes'], 'bytes', setup=write_inputs),
+        Benchmark('aes_encrypt_compressed',
+                  lambda: run_cpu(encrypt_file, text_path, ENCRYPTION_KEY, workdir, compress=True),
+                  size['binary_bytes'], 'bytes', setup=write_inputs),
+        Benchmark('aes_decrypt',
+                  lambda: run_cpu(decrypt_file, plain_path + '.enc', ENCRYPTION_KEY, decrypt_dir),
+                  size['binary_bytes'], 'bytes', setup=encrypt_input),
+    ]
+
+
+def stage_totals():
+    """Seconds recorded so far per pipeline stage"""
+    return {key[0]: value for suffix, key, _, value in metrics.STAGE_SECONDS.samples() if suffix == '_sum'}
+
+
+def run_benchmark(loop, bench, repeat, warmup):
+    if bench.setup:
+        prepared = bench.setup()
+        if asyncio.iscoroutine(prepared):
+            loop.run_until_complete(prepared)
+    for _ in range(warmup):
+        loop.run_until_complete(bench.run())
+
+    before = stage_totals()
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        loop.run_until_complete(bench.run())
+        seconds.append(time.perf_counter() - start)
+    after = stage_totals()
+
+    # One extra run under tracemalloc, kept out of the timings it would slow down
+    tracemalloc.start()
+    try:
+        loop.run_until_complete(bench.run())
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    median = statistics.median(seconds)
+    return {
+        'unit': bench.unit,
+        'units': bench.units,
+        'seconds': seconds,
+        'median_seconds': median,
+        'min_seconds': min(seconds),
+        'throughput_per_second': bench.units / median if median else None,
+        'peak_traced_bytes': peak,
+        'stages': {name: (total - before.get(name, 0.0)) / repeat
+                   for name, total in sorted(after.items()) if total > before.get(name, 0.0)},
+    }
+
+
+def compare(results, baseline, threshold):
+    """Prints current vs baseline per benchmark; returns the names that regressed"""
+    regressions = []
+    print(f"\n{'benchmark':<24}{'median':>12}{'baseline':>12}{'change':>9}{'peak MB':>10}{'change':>9}")
+    for name, current in results['benchmarks'].items():
+        base = baseline.get('benchmarks', {}).get(name)
+        if base is None:
+            print(f"{name:<24}{current['median_seconds']:>11.3f}s{'-':>12}")
+            continue
+        time_change = current['median_seconds'] / base['median_seconds'] - 1 if base['median_seconds'] else 0.0
+        mem_change = (current['peak_traced_bytes'] / base['peak_traced_bytes'] - 1
+                      if base.get('peak_traced_bytes') else 0.0)
+        flag = ''
+        if time_change > threshold or mem_change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f"{name:<24}{current['median_seconds']:>11.3f}s{base['median_seconds']:>11.3f}s"
+              f"{time_change:>+9.1%}{current['peak_traced_bytes'] / 1e6:>10.1f}{mem_change:>+9.1%}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Microbenchmarks for the masking and encryption pipelines")
+    parser.add_argument('--size', choices=sorted(SIZES), default='small')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--llm-latency', type=float, default=0.0, help="seconds the fake backend sleeps per call")
+    parser.add_argument('--llm-concurrency', type=int, default=8)
+    parser.add_argument('--only', help="comma-separated benchmark names")
+    parser.add_argument('--out', help="write results as JSON to this path")
+    parser.add_argument('--baseline', help="JSON results of an earlier run to compare against")
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="relative slowdown or memory growth counted as a regression")
+    args = parser.parse_args(argv)
+
+    set_client(LLMClient(FakeBackend(latency=args.llm_latency, seed=args.seed),
+                         max_concurrency=args.llm_concurrency))
+    only = set(args.only.split(',')) if args.only else None
+
+    results = {
+        'meta': {
+            'revision': git_revision(),
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'options': vars(args),
+        },
+        'benchmarks': {},
+    }
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        with tempfile.TemporaryDirectory(prefix='obscura-bench-') as workdir:
+            for bench in build_benchmarks(SIZES[args.size], args.seed, workdir):
+                if only and bench.name not in only:
+                    continue
+                result = run_benchmark(loop, bench, args.repeat, args.warmup)
+                results['benchmarks'][bench.name] = result
+                print(f"{bench.name:<24}{result['median_seconds']:>9.3f}s  "
+                      f"{result['throughput_per_second']:>14,.1f} {bench.unit}/s  "
+                      f"peak {result['peak_traced_bytes'] / 1e6:,.1f} MB")
+    finally:
+        loop.close()
+
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\nRegressed beyond {args.threshold:.0%}: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,235 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+from core.batch import PIPELINES, load_field_config, expand_inputs, find_collisions, make_processor, run_batch
+from core.ingest import MANIFEST_NAME, Ingester, config_hash
+from obfuscate.policy import compile_policy, get_policy_registry
+
+# -----------------------------
+# Headless batch processing without the HTTP layer: files, directories and glob
+# patterns go through the same handlers as the endpoints, in-process, with a
+# bounded number of files in flight. Run from the server folder:
+#   python cli.py mask data/*.csv --config fields.json --out masked/
+#   python cli.py mask reports/ --recursive --pattern '*.pdf' --config fields.json --out masked/
+#   python cli.py encrypt exports/ --key-env OBSCURA_KEY --compress --out secured/
+#   python cli.py decrypt secured/*.enc --key-env OBSCURA_KEY --out plain/
+#   python cli.py ingest /share/exports --config fields.json --out /share/masked --watch
+#   python cli.py mask feeds/daily.csv --config fields.json --out masked/ --incremental
+#   python cli.py mask exports/ --policy hr-export --out masked/
+# The field config has the shape of the endpoints' `headers` JSON, either a bare
+# list or {"headers": [...]}:
+#   [{"name": "Email", "mode": "mask", "prompt": ""}, ...]
+# Exit status is 1 when any file failed.
+# -----------------------------
+
+
+def add_common_arguments(parser):
+    parser.add_argument('inputs', nargs='+', help="files, directories or glob patterns")
+    parser.add_argument('--out', required=True, help="output folder")
+    parser.add_argument('--recursive', action='store_true',
+                        help="descend into subfolders of directory inputs (and ** in globs)")
+    parser.add_argument('--pattern', help="only files in directory inputs whose name matches, e.g. '*.csv'")
+    parser.add_argument('--workers', type=int, default=int(os.getenv("CLI_WORKERS", "4")),
+                        help="files processed at the same time")
+    parser.add_argument('--summary', help="write the per-file summary as JSON to this path")
+
+
+def add_key_arguments(parser, required):
+    group = parser.add_mutually_exclusive_group(required=required)
+    group.add_argument('--key', help="encryption key (visible in the process list; prefer --key-env)")
+    group.add_argument('--key-env', help="name of the environment variable holding the encryption key")
+
+
+def resolve_key(parser, args):
+    if args.key_env:
+        key = os.getenv(args.key_env)
+        if not key:
+            parser.error(f"environment variable {args.key_env} is not set")
+        return key
+    return args.key
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Masks, obfuscates, encrypts or decrypts files in bulk")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    mask = commands.add_parser('mask', help="mask/obfuscate CSV and PDF files by their field config")
+    add_common_arguments(mask)
+    fields = mask.add_mutually_exclusive_group(required=True)
+    fields.add_argument('--config', help="field config JSON in the shape of the headers field")
+    fields.add_argument('--policy', help="name of a registered masking policy (POST /policies)")
+    mask.add_argument('--mode', choices=['mask', 'obfuscate'], help="apply this mode to every configured field")
+    add_key_arguments(mask, required=False)
+    mask.add_argument('--incremental', action='store_true',
+                      help="for append-only CSVs, only mask rows added since the last run and append them")
+
+    encrypt = commands.add_parser('encrypt', help="AES-encrypt files to .enc")
+    add_common_arguments(encrypt)
+    add_key_arguments(encrypt, required=True)
+    encrypt.add_argument('--compress', action='store_true', help="compress before encrypting")
+
+    decrypt = commands.add_parser('decrypt', help="decrypt .enc files")
+    add_common_arguments(decrypt)
+    add_key_arguments(decrypt, required=True)
+
+    ingest = commands.add_parser('ingest', help="process new or changed files below a folder, optionally watching it")
+    ingest.add_argument('root', help="input folder, scanned recursively")
+    ingest.add_argument('--out', required=True, help="output folder; the input tree is mirrored below it")
+    ingest.add_argument('--pipeline', choices=PIPELINES, default='mask')
+    ingest.add_argument('--config', help="field config JSON (mask pipeline)")
+    ingest.add_argument('--policy', help="name of a registered masking policy, instead of --config")
+    ingest.add_argument('--mode', choices=['mask', 'obfuscate'], help="apply this mode to every configured field")
+    add_key_arguments(ingest, required=False)
+    ingest.add_argument('--incremental', action='store_true',
+                        help="for append-only CSVs, only mask rows added since the last run and append them")
+    ingest.add_argument('--compress', action='store_true', help="compress before encrypting (encrypt pipeline)")
+    ingest.add_argument('--pattern', help="only files whose name matches, e.g. '*.csv'")
+    ingest.add_argument('--workers', type=int, default=int(os.getenv("CLI_WORKERS", "4")),
+                        help="files processed at the same time")
+    ingest.add_argument('--manifest', help=f"manifest path (default: <out>/{MANIFEST_NAME})")
+    ingest.add_argument('--retry-failed', action='store_true', help="retry files that failed with the same content")
+    ingest.add_argument('--watch', action='store_true', help="keep watching the folder for new files")
+    ingest.add_argument('--interval', type=float, default=float(os.getenv("INGEST_INTERVAL", "10")),
+                        help="seconds between rescans when watching")
+    ingest.add_argument('--settle', type=float, default=float(os.getenv("INGEST_SETTLE", "2")),
+                        help="seconds a file must stay unmodified before it is picked up when watching")
+    ingest.add_argument('--summary', help="write the per-file summary of a single run as JSON to this path")
+    return parser
+
+
+def display(path):
+    relative = os.path.relpath(path)
+    return path if relative.startswith('..') else relative
+
+
+def print_progress(result, finished, total):
+    name = display(result.path)
+    if result.status == 'ok':
+        print(f"[{finished}/{total}] {name} -> {display(result.output)} ({result.seconds:.2f}s)", flush=True)
+    else:
+        print(f"[{finished}/{total}] {name} FAILED: {result.error}", flush=True)
+
+
+def print_summary(results, elapsed):
+    width = max([len(display(r.path)) for r in results] + [4])
+    print(f"\n{'file':<{width}}  {'status':<7}{'seconds':>9}{'in MB':>10}{'out MB':>10}")
+    for r in results:
+        print(f"{display(r.path):<{width}}  {r.status:<7}{r.seconds:>9.2f}"
+              f"{r.bytes_in / 1e6:>10.2f}{r.bytes_out / 1e6:>10.2f}")
+    failed = sum(1 for r in results if r.status != 'ok')
+    print(f"\n{len(results) - failed} ok, {failed} failed in {elapsed:.2f}s")
+
+
+def print_scan(stats):
+    print(f"Scanned {stats['scanned']}: {stats['unchanged']} unchanged, {stats['deferred']} settling, "
+          f"{stats['ok']} processed, {stats['failed']} failed in {stats['seconds']:.2f}s", flush=True)
+
+
+def read_fields(parser, args):
+    """The compiled policy of --policy or --config, with --mode applied"""
+    try:
+        if args.policy:
+            if args.config:
+                parser.error("--config and --policy cannot be combined")
+            policy = get_policy_registry().get(args.policy)
+            if policy is None:
+                parser.error(f"unknown policy {args.policy}")
+            if args.mode:
+                policy = compile_policy([dict(field, mode=args.mode) for field in policy.config()], policy.name,
+                                        policy.description, policy.version, allow_patterns=True)
+            return policy
+        if not args.config:
+            parser.error("--config or --policy is required for masking")
+        fields = load_field_config(args.config)
+        if args.mode:
+            fields = [dict(field, mode=args.mode) for field in fields]
+        return compile_policy(fields)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+
+def check_incremental(parser, args, key):
+    if getattr(args, 'incremental', False):
+        if getattr(args, 'pipeline', 'mask') != 'mask':
+            parser.error("--incremental only applies to the mask pipeline")
+        if key:
+            parser.error("--incremental appends to plaintext outputs and cannot be combined with a key")
+
+
+def ingest(parser, args):
+    policy = read_fields(parser, args) if args.pipeline == 'mask' else None
+    key = resolve_key(parser, args)
+    if args.pipeline != 'mask' and not key:
+        parser.error(f"--key or --key-env is required for {args.pipeline}")
+    check_incremental(parser, args, key)
+    if not os.path.isdir(args.root):
+        parser.error(f"{args.root} is not a folder")
+
+    ingester = Ingester(args.root, args.out, args.pipeline,
+                        make_processor(args.pipeline, fields=policy, encryption_key=key, compress=args.compress,
+                                       incremental=args.incremental),
+                        config_hash(args.pipeline, policy.config() if policy else None, key, args.compress),
+                        manifest_path=args.manifest, workers=args.workers, pattern=args.pattern,
+                        settle=args.settle if args.watch else 0.0, retry_failed=args.retry_failed,
+                        on_done=print_progress)
+    try:
+        if args.watch:
+            print(f"Watching {ingester.root} (Ctrl+C to stop)", flush=True)
+            try:
+                asyncio.run(ingester.watch(args.interval, on_scan=lambda stats: stats['queued'] and print_scan(stats)))
+            except KeyboardInterrupt:
+                pass
+            return 0
+        stats = asyncio.run(ingester.run_once())
+    finally:
+        ingester.close()
+    print_scan(stats)
+    if args.summary:
+        with open(args.summary, 'w', encoding='utf-8') as f:
+            json.dump(dict(stats, command='ingest', pipeline=args.pipeline), f, indent=2)
+    return 1 if stats['failed'] else 0
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.command == 'ingest':
+        return ingest(parser, args)
+
+    policy = read_fields(parser, args) if args.command == 'mask' else None
+    key = resolve_key(parser, args)
+    check_incremental(parser, args, key)
+
+    out = os.path.abspath(args.out)
+    pairs = expand_inputs(args.inputs, out, recursive=args.recursive, pattern=args.pattern)
+    if not pairs:
+        parser.error("no input files found")
+    collisions = find_collisions(pairs)
+    if collisions:
+        for first, second in collisions:
+            print(f"{second} would overwrite the output of {first}", file=sys.stderr)
+        parser.error("inputs with the same file name would share an output; use a directory input instead")
+
+    processor = make_processor(args.command, fields=policy, encryption_key=key,
+                               compress=getattr(args, 'compress', False),
+                               incremental=getattr(args, 'incremental', False))
+    start = time.perf_counter()
+    results = asyncio.run(run_batch(processor, pairs, workers=args.workers,
+                                    on_done=print_progress, pipeline=args.command))
+    elapsed = time.perf_counter() - start
+    print_summary(results, elapsed)
+
+    if args.summary:
+        with open(args.summary, 'w', encoding='utf-8') as f:
+            json.dump({'command': args.command, 'seconds': elapsed,
+                       'files': [r.to_dict() for r in results]}, f, indent=2)
+    return 1 if any(r.status != 'ok' for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,36 +1,68 @@
-from flask import request, jsonify, current_app
+from flask import request, jsonify
 import os
 import json
+import shutil
 from werkzeug.utils import secure_filename
 from aes.aes import encrypt_file, decrypt_file
+from aes.archive import create_archive, extract_members, list_archive, is_archive
+from core.jobs import register_job_kind, is_async_request, submit_job
+from core.pools import run_cpu, run_sync
+from settings import UPLOAD_FOLDER, SECURED_FILES_FOLDER
+from core.tracing import get_logger
 
-def encrypt_route():
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file part'}), 400
+logger = get_logger('aeshandler')
+
+
+# Request handling is written once as coroutines over (form, files) so the Flask
+# views below and the ASGI server share it; each returns (payload, status).
+
+def save_upload(file, temp_path):
+    """Copies an uploaded file to disk (works for Flask and Quart uploads)"""
+    with open(temp_path, 'wb') as f:
+        shutil.copyfileobj(file.stream, f)
+
+async def encrypt_route_async(form, uploads):
+    if 'file' not in uploads:
+        return {'error': 'No file part'}, 400
     
-    files = request.files.getlist('file')
-    headers_str = request.form.get('headers')
-    output_path = request.form.get('outputPath', '')
-#or current_app.config['SECURED_FILES_FOLDER']
+    files = uploads.getlist('file')
+    headers_str = form.get('headers')
+    output_path = form.get('outputPath', '')
+#or SECURED_FILES_FOLDER
+    compress = form.get('compress', '').lower() in ('1', 'true', 'yes')
+    archive = form.get('archive', '').lower() in ('1', 'true', 'yes')
     
-    print("Output pathxxxxxxxxxxxx:", output_path)
+    logger.debug("Encrypting %d files to %s", len(files), output_path or 'secured_files')
     
     # Parse headers JSON to get encryption key
     try:
         headers = json.loads(headers_str) if headers_str else []
         encryption_key = next((h.get('key') for h in headers if h.get('mode') == 'encrypt'), None)
     except json.JSONDecodeError:
-        return jsonify({'error': 'Invalid headers format'}), 400
+        return {'error': 'Invalid headers format'}, 400
     
     # print("Files:", files)
     # print("Headers:", headers)
     # print("Output path:", output_path)
     
     if not files:
-        return jsonify({'error': 'No files uploaded'}), 400
+        return {'error': 'No files uploaded'}, 400
     
     if not encryption_key:
-        return jsonify({'error': 'No encryption key provided in headers'}), 400
+        return {'error': 'No encryption key provided in headers'}, 400
+    
+    # Archive members are named after the uploads, so the names must stay distinct once secured
+    if archive:
+        names = [secure_filename(file.filename) for file in files if file.filename != '']
+        if len(set(names)) != len(names):
+            return {'error': 'Uploaded files must have distinct names'}, 400
+    
+    # Long jobs can run in the background; the client polls /jobs/<id>
+    if is_async_request(form):
+        return submit_job('encryptfile', form, uploads)
+    
+    if archive:
+        return await encrypt_archive(files, form.get('archiveName', ''), encryption_key, output_path, compress)
     
     results = []
     
@@ -42,13 +74,13 @@ def encrypt_route():
                 
             # Secure the filename and create full paths
             secure_name = secure_filename(file.filename)
-            temp_path = os.path.join(current_app.config['UPLOAD_FOLDER'], f"temp_{secure_name}")
+            temp_path = os.path.join(UPLOAD_FOLDER, f"temp_{secure_name}")
             
             # Save uploaded file temporarily
-            file.save(temp_path)
+            await run_cpu(save_upload, file, temp_path)
             
             # Encrypt the file
-            encrypted_path = encrypt_file(temp_path, encryption_key, output_path)
+            encrypted_path = await run_cpu(encrypt_file, temp_path, encryption_key, output_path, compress=compress)
             
             results.append({
                 'filename': secure_name,
@@ -67,33 +99,64 @@ def encrypt_route():
             if temp_path and os.path.exists(temp_path):
                 os.remove(temp_path)
     
-    return jsonify({
+    return {
         'status': 'success',
         'files': results,
         'totalProcessed': len(results)
-    })
+    }, 200
+
+
+async def encrypt_archive(files, archive_name, encryption_key, output_path, compress):
+    """
+    Packs all uploaded files into a single encrypted archive
+    """
+    archive_name = secure_filename(archive_name) or 'archive'
+    members = [
+        (secure_filename(file.filename), file.stream)
+        for file in files if file.filename != ''
+    ]
+    if not members:
+        return {'error': 'No files uploaded'}, 400
     
+    try:
+        archive_path = await run_cpu(create_archive, members, encryption_key, archive_name, output_path, compress=compress)
+    except Exception as e:
+        return {'error': str(e)}, 500
     
-def decrypt_route():
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file part'}), 400
+    return {
+        'status': 'success',
+        'files': [{
+            'filename': os.path.basename(archive_path),
+            'encryptedPath': archive_path,
+            'members': [name for name, _ in members],
+            'status': 'success'
+        }],
+        'totalProcessed': len(members)
+    }, 200
+    
+    
+async def decrypt_route_async(form, uploads):
+    if 'file' not in uploads:
+        return {'error': 'No file part'}, 400
     
-    files = request.files.getlist('file')
-    headers_str = request.form.get('headers')
-    output_path = request.form.get('outputPath') or current_app.config['SECURED_FILES_FOLDER']
+    files = uploads.getlist('file')
+    headers_str = form.get('headers')
+    output_path = form.get('outputPath') or SECURED_FILES_FOLDER
+    # Optional archive member selection; all members are extracted when empty
+    member_names = form.getlist('member')
     
     # Parse headers JSON to get encryption key
     try:
         headers = json.loads(headers_str) if headers_str else []
         encryption_key = next((h.get('key') for h in headers if h.get('mode') == 'decrypt'), None)
     except json.JSONDecodeError:
-        return jsonify({'error': 'Invalid headers format'}), 400
+        return {'error': 'Invalid headers format'}, 400
     
     if not files:
-        return jsonify({'error': 'No files uploaded'}), 400
+        return {'error': 'No files uploaded'}, 400
     
     if not encryption_key:
-        return jsonify({'error': 'No encryption key provided in headers'}), 400
+        return {'error': 'No encryption key provided in headers'}, 400
     
     results = []
     
@@ -105,13 +168,24 @@ def decrypt_route():
                 
             # Secure the filename and create full paths
             secure_name = secure_filename(file.filename)
-            temp_path = os.path.join(current_app.config['UPLOAD_FOLDER'], f"temp_{secure_name}")
+            temp_path = os.path.join(UPLOAD_FOLDER, f"temp_{secure_name}")
             
             # Save uploaded file temporarily
-            file.save(temp_path)
+            await run_cpu(save_upload, file, temp_path)
+            
+            # Archives are extracted member by member, plain files decrypted whole
+            if is_archive(temp_path):
+                extracted = await run_cpu(extract_members, temp_path, encryption_key, member_names or None, output_path)
+                results.extend({
+                    'filename': os.path.basename(path),
+                    'decryptedPath': path,
+                    'archive': secure_name,
+                    'status': 'success'
+                } for path in extracted)
+                continue
             
             # Decrypt the file
-            decrypted_path = decrypt_file(temp_path, encryption_key, output_path)
+            decrypted_path = await run_cpu(decrypt_file, temp_path, encryption_key, output_path)
             
             results.append({
                 'filename': secure_name,
@@ -130,8 +204,55 @@ def decrypt_route():
             if temp_path and os.path.exists(temp_path):
                 os.remove(temp_path)
     
-    return jsonify({
+    return {
         'status': 'success',
         'files': results,
         'totalProcessed': len(results)
-    })
\ No newline at end of file
+    }, 200
+
+
+async def list_archive_route_async(form, files):
+    uploaded = files.get('file')
+    if not uploaded:
+        return {'error': 'No file part'}, 400
+    
+    # Parse headers JSON to get encryption key
+    try:
+        headers = json.loads(form.get('headers') or '[]')
+        encryption_key = next((h.get('key') for h in headers if h.get('mode') == 'decrypt'), None)
+    except json.JSONDecodeError:
+        return {'error': 'Invalid headers format'}, 400
+    
+    if not encryption_key:
+        return {'error': 'No encryption key provided in headers'}, 400
+    
+    temp_path = os.path.join(UPLOAD_FOLDER, f"temp_{secure_filename(uploaded.filename)}")
+    try:
+        await run_cpu(save_upload, uploaded, temp_path)
+        if not is_archive(temp_path):
+            return {'error': 'File is not an encrypted archive'}, 400
+        return {'members': await run_cpu(list_archive, temp_path, encryption_key)}, 200
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+register_job_kind('encryptfile', encrypt_route_async)
+
+
+# Flask views
+def encrypt_route():
+    payload, status = run_sync(encrypt_route_async(request.form, request.files))
+    return jsonify(payload), status
+
+
+def decrypt_route():
+    payload, status = run_sync(decrypt_route_async(request.form, request.files))
+    return jsonify(payload), status
+
+
+def list_archive_route():
+    payload, status = run_sync(list_archive_route_async(request.form, request.files))
+    return jsonify(payload), status
\ No newline at end of file
@@ -1,56 +1,189 @@
-from flask import Flask, request, jsonify
+from flask import request, jsonify
 import os
-import json
-from flask_cors import CORS
-from obfuscate.csvhandler import predictheaders, maskobfcsv
+from io import TextIOWrapper
+from werkzeug.utils import secure_filename
+from obfuscate.csvhandler import (predictheaders_async, maskobfcsv_async, maskobfcsv_batch_async,
+                                  maskobfcsv_incremental_async, plan_csv_job)
+from core.batch import batch_payload
+from core.checkpoints import is_incremental
+from core.planner import RssMonitor
+from core.jobs import register_job_kind, is_async_request, submit_job
+from core.pools import run_cpu, run_sync
+from core.uploads import open_upload
+from core.resultcache import get_result_cache, is_no_cache, result_cache_key
+from obfuscate.llmclient import backend_version
+from obfuscate.policy import PolicyError, request_policy
 
-def getcsvheader():
+
+# Request handling is written once as coroutines over (form, files) so the Flask
+# views below and the ASGI server share it; each returns (payload, status).
+
+async def getcsvheader_async(form, files):
     # Accepts multipart/form-data with uploaded file
-    uploaded = request.files.get('file')
+    uploaded = files.get('file')
     if not uploaded:
-        return jsonify({"error": "No file uploaded"}), 400
+        return {"error": "No file uploaded"}, 400
 
     try:
-        content = uploaded.read().decode('utf-8')
-        headers = predictheaders(content)
-        return jsonify({
+        # Only the header row is read from the spooled upload
+        text_stream = TextIOWrapper(open_upload(uploaded), encoding='utf-8', newline='')
+        try:
+            headers = await predictheaders_async(text_stream)
+        finally:
+            text_stream.detach()
+        return {
             "headers": headers, 
             "message": "These columns can be selected for obfuscation"
-        })
+        }, 200
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return {"error": str(e)}, 500
     
     
-def mask_obfuscate_csv():
+async def mask_obfuscate_csv_async(form, files):
     # Accepts multipart/form-data with CSV file and JSON form fields
-    uploaded = request.files.get('file')
-    headers_json = request.form.get('headers')
-    output_path = request.form.get('outputPath', '')
-    input_path = request.form.get('inputPath', '')
+    uploaded = files.get('file')
+    headers_json = form.get('headers')
+    policy_name = form.get('policy')
+    output_path = form.get('outputPath', '')
+    input_path = form.get('inputPath', '')
+
+    if not uploaded or not (headers_json or policy_name):
+        return {'error': 'Missing file or headers'}, 400
+
+    # A registered template (policy=<name>) or the headers, compiled once and shared
+    try:
+        policy = request_policy(policy_name, headers_json)
+    except PolicyError as e:
+        return {'error': str(e)}, 400
+
+    # Optional fused pipeline: encrypt the masked output instead of writing plaintext
+    encryption_key = None
+    if form.get('pipeline') == 'encrypt':
+        encryption_key = form.get('encryptionKey')
+        if not encryption_key:
+            return {'error': 'No encryption key provided for the encrypt pipeline'}, 400
+
+    # Append-only feeds can be re-masked incrementally: only rows past the source's
+    # checkpoint are processed and appended to the earlier output
+    incremental = is_incremental(form)
+    if incremental and encryption_key:
+        return {'error': 'Incremental runs append to a plaintext output and cannot be encrypted'}, 400
 
-    if not uploaded or not headers_json:
-        return jsonify({'error': 'Missing file or headers'}), 400
+    # Identical requests reuse the earlier output; encrypted outputs depend on the key
+    # so they are never cached, and incremental outputs grow in place
+    file_stream = open_upload(uploaded)
+    cache = None if encryption_key or incremental or is_no_cache(form) else get_result_cache()
+    if cache is not None:
+        cache_key = await run_cpu(result_cache_key, 'csv', file_stream, policy.config(),
+                                  uploaded.filename, output_path, backend_version())
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return {**cached, 'cacheHit': True}, 200
+
+    # Long jobs can run in the background; the client polls /jobs/<id>
+    if is_async_request(form):
+        return submit_job('maskobfcsv', form, files)
 
     try:
-        file_content = uploaded.read().decode('utf-8')
+        # pandas parses the spooled upload directly instead of a decoded copy
         json_data = {
             'fileName': uploaded.filename,
-            'headers': headers_json,
+            'headers': policy.config(),
+            'policy': policy,
             'outputPath': output_path,
-            'inputPath': input_path
+            'inputPath': input_path,
+            'encryptionKey': encryption_key
         }
-        # Ensure headers are parsed if they're in string format
-        if isinstance(json_data['headers'], str):
-            try:
-                json_data['headers'] = json.loads(json_data['headers'])
-            except:
-                pass
-                
-        # maskobfcsv now expects (json_data, file_content)
-        output_file = maskobfcsv(json_data, file_content)
-        return jsonify({
+
+        if incremental:
+            source_id = form.get('sourceId') or uploaded.filename
+            output_file, summary = await maskobfcsv_incremental_async(json_data, file_stream, source_id)
+            return {
+                'output': output_file,
+                'filename': os.path.basename(output_file),
+                'encrypted': False,
+                'incremental': summary
+            }, 200
+
+        # The planner picks in-memory, chunked or process-parallel execution for the
+        # memory budget; the plan and the peak RSS go back with the response
+        plan = plan_csv_job(file_stream, policy)
+        with RssMonitor() as monitor:
+            output_file = await maskobfcsv_async(json_data, file_stream, plan=plan)
+        plan.peak_rss_bytes = monitor.peak
+        payload = {
             'output': output_file,
-            'filename': os.path.basename(output_file)
-        })
+            'filename': os.path.basename(output_file),
+            'encrypted': bool(encryption_key),
+            'plan': plan.to_dict()
+        }
+        if cache is not None:
+            cache.put(cache_key, payload)
+        return {**payload, 'cacheHit': False}, 200
+    except Exception as e:
+        return {'error': str(e)}, 500
+
+
+async def mask_obfuscate_csv_batch_async(form, files):
+    # Accepts multipart/form-data with several CSV files under 'file' sharing one headers JSON
+    uploads = [uploaded for uploaded in files.getlist('file') if uploaded.filename]
+    headers_json = form.get('headers')
+    policy_name = form.get('policy')
+    output_path = form.get('outputPath', '')
+
+    if not uploads or not (headers_json or policy_name):
+        return {'error': 'Missing files or headers'}, 400
+    filenames = [uploaded.filename for uploaded in uploads]
+    if len(set(filenames)) != len(filenames):
+        return {'error': 'Uploaded files must have distinct names'}, 400
+
+    encryption_key = None
+    if form.get('pipeline') == 'encrypt':
+        encryption_key = form.get('encryptionKey')
+        if not encryption_key:
+            return {'error': 'No encryption key provided for the encrypt pipeline'}, 400
+
+    try:
+        policy = request_policy(policy_name, headers_json)
+    except PolicyError as e:
+        return {'error': str(e)}, 400
+
+    if is_async_request(form):
+        return submit_job('maskobfcsvbatch', form, files)
+
+    try:
+        json_data = {
+            'headers': policy.config(),
+            'policy': policy,
+            'outputPath': output_path,
+            'encryptionKey': encryption_key
+        }
+        # Values of each obfuscated column are pooled across the files into shared model calls
+        sources = [(uploaded.filename, open_upload(uploaded)) for uploaded in uploads]
+        outputs = await maskobfcsv_batch_async(json_data, sources)
+        archive_name = None
+        if form.get('zip', '').lower() in ('1', 'true', 'yes'):
+            archive_name = secure_filename(form.get('archiveName', '')) or 'batch'
+        return batch_payload(filenames, outputs, bool(encryption_key), archive_name), 200
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
\ No newline at end of file
+        return {'error': str(e)}, 500
+
+
+register_job_kind('maskobfcsv', mask_obfuscate_csv_async)
+register_job_kind('maskobfcsvbatch', mask_obfuscate_csv_batch_async)
+
+
+# Flask views
+def getcsvheader():
+    payload, status = run_sync(getcsvheader_async(request.form, request.files))
+    return jsonify(payload), status
+
+
+def mask_obfuscate_csv():
+    payload, status = run_sync(mask_obfuscate_csv_async(request.form, request.files))
+    return jsonify(payload), status
+
+
+def mask_obfuscate_csv_batch():
+    payload, status = run_sync(mask_obfuscate_csv_batch_async(request.form, request.files))
+    return jsonify(payload), status
\ No newline at end of file
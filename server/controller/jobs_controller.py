@@ -0,0 +1,64 @@
+from flask import jsonify, send_file
+import os
+from core.jobs import get_job_manager, job_result_path, SUCCEEDED, CANCELLED, RUNNING
+from core.pools import run_cpu, run_sync
+
+
+# Job status, cancellation and result lookup shared by the Flask and ASGI servers;
+# each returns (payload, status).
+
+async def job_status_async(job_id):
+    job = await run_cpu(get_job_manager().get, job_id)
+    if job is None:
+        return {'error': 'Job not found'}, 404
+    return job, 200
+
+
+async def cancel_job_async(job_id):
+    """
+    200 once the job is cancelled; 202 with cancelPending while a running job,
+    possibly on another server process, has yet to reach its next progress
+    report; 409 if it had already finished.
+    """
+    job = await run_cpu(get_job_manager().cancel, job_id)
+    if job is None:
+        return {'error': 'Job not found'}, 404
+    if job['status'] == RUNNING:
+        return {**job, 'status': 'cancelPending'}, 202
+    if job['status'] != CANCELLED:
+        return {'error': f"Job is {job['status']}", 'status': job['status']}, 409
+    return job, 200
+
+
+async def job_result_async(job_id):
+    """
+    Returns (payload, status, file_path). file_path is set when the job
+    produced an output file the caller should stream back.
+    """
+    job = await run_cpu(get_job_manager().get, job_id)
+    if job is None:
+        return {'error': 'Job not found'}, 404, None
+    if job['status'] != SUCCEEDED:
+        return {'error': f"Job is {job['status']}", 'status': job['status']}, 409, None
+    path = job_result_path(job)
+    if path is None:
+        return job['result'], 200, None
+    return None, 200, path
+
+
+# Flask views
+def job_status(job_id):
+    payload, status = run_sync(job_status_async(job_id))
+    return jsonify(payload), status
+
+
+def cancel_job(job_id):
+    payload, status = run_sync(cancel_job_async(job_id))
+    return jsonify(payload), status
+
+
+def job_result(job_id):
+    payload, status, path = run_sync(job_result_async(job_id))
+    if path is not None:
+        return send_file(path, as_attachment=True, download_name=os.path.basename(path), conditional=True)
+    return jsonify(payload), status
@@ -1,134 +1,246 @@
 from flask import Flask, request, jsonify
 import os
-import json
+from contextlib import ExitStack
 from flask_cors import CORS
-from PyPDF2 import PdfReader
-from obfuscate.pdfhandler import predictpdfheaders, maskobfpdf
-import traceback
-from io import BytesIO
+from werkzeug.utils import secure_filename
+from obfuscate.pdfhandler import predictpdfheaders_async, maskobfpdf_async, maskobfpdf_batch_async, scanned_values
+from core.batch import batch_payload
+from core.planner import RssMonitor, inspect_pdf, plan_pdf
+from core.jobs import register_job_kind, is_async_request, submit_job
+from core.pools import run_cpu, run_pdf, run_sync
+from core.uploads import open_upload, mapped_upload
+from core.metrics import stage
+from core.tracing import get_logger
+from core.resultcache import get_result_cache, is_no_cache, result_cache_key
+from obfuscate.llmclient import backend_version
+from obfuscate.policy import PolicyError, request_policy
+
+logger = get_logger('pdfhandler_controller')
 
 
 app = Flask(__name__)
 CORS(app)
 
-def getpdfheader():
+# Request handling is written once as coroutines over (form, files) so the Flask
+# views below and the ASGI server share it; each returns (payload, status).
+
+def verify_pdf(file_stream):
+    """
+    Verify the PDF is valid by opening it with PyPDF2; returns the page count
+    """
+    from PyPDF2 import PdfReader
+
+    reader = PdfReader(file_stream)
+    num_pages = len(reader.pages)
+    # Reset file position to beginning for subsequent operations
+    file_stream.seek(0)
+    return num_pages
+
+async def getpdfheader_async(form, files):
     """
     Get and process PDF headers from uploaded file
     """
     # Accepts multipart/form-data with uploaded file
-    uploaded = request.files.get('file')
+    uploaded = files.get('file')
     if not uploaded:
-        return jsonify({"error": "No file uploaded"}), 400
+        return {"error": "No file uploaded"}, 400
     
     try:
-        # Read the file content as bytes
-        file_bytes = uploaded.read()
-        
-        print("File read, creating BytesIO object")
-        # Create BytesIO object
-        file_bytes_io = BytesIO(file_bytes)
+        # Work on the spooled upload instead of reading it into memory
+        file_stream = open_upload(uploaded)
         
         # Verify the PDF is valid by trying to open it with PyPDF2
         try:
-            print("Verifying PDF with PyPDF2")
-            reader = PdfReader(file_bytes_io)
-            num_pages = len(reader.pages)
-            print(f"PDF has {num_pages} pages")
-            
-            # Reset file position to beginning for subsequent operations
-            file_bytes_io.seek(0)
+            with stage('pdf_verify'):
+                num_pages = await run_cpu(verify_pdf, file_stream)
+            logger.debug("PDF has %d pages", num_pages)
         except Exception as pdf_error:
-            print(f"PDF validation error: {pdf_error}")
-            print(traceback.format_exc())
-            return jsonify({"error": f"Invalid PDF file: {str(pdf_error)}"}), 400
+            logger.warning("PDF validation error: %s", pdf_error, exc_info=True)
+            return {"error": f"Invalid PDF file: {str(pdf_error)}"}, 400
         
         # Call the PDFhandler function to identify headers
-        print("Calling predictpdfheaders")
-        headers = predictpdfheaders(file_bytes_io)
+        with mapped_upload(file_stream) as pdf_view:
+            headers = await predictpdfheaders_async(pdf_view)
         
-        return jsonify({
+        return {
             "headers": headers,
             "message": "These columns can be selected for obfuscation"
-        })
+        }, 200
     except Exception as e:
-        print(f"Error in getpdfheader endpoint: {str(e)}")
-        print(traceback.format_exc())
-        return jsonify({"error": str(e)}), 500
+        logger.error("Error in getpdfheader endpoint: %s", e, exc_info=True)
+        return {"error": str(e)}, 500
     
-def maskpdf():
+async def maskpdf_async(form, files):
     """
     Process PDF file for masking/obfuscation
     """
     # Get the form data
-    uploaded = request.files.get('file')
-    headers_json = request.form.get('headers')
-    output_path = request.form.get('outputPath', '')
-    input_path = request.form.get('inputPath', '')
+    uploaded = files.get('file')
+    headers_json = form.get('headers')
+    policy_name = form.get('policy')
+    output_path = form.get('outputPath', '')
+    input_path = form.get('inputPath', '')
     
-    print(f"Output path: {output_path}")
-    print(f"Input path: {input_path}")
-    print(f"Headers JSON: {headers_json}")
+    logger.debug("Masking PDF, output path: %s", output_path or "default")
     
-    if not uploaded or not headers_json:
-        return jsonify({'error': 'Missing file or headers'}), 400
+    if not uploaded or not (headers_json or policy_name):
+        return {'error': 'Missing file or headers'}, 400
+
+    # A registered template (policy=<name>) or the headers, compiled once and shared
+    try:
+        policy = request_policy(policy_name, headers_json)
+    except PolicyError as e:
+        return {'error': str(e)}, 400
+
+    # Optional fused pipeline: encrypt the masked output instead of writing plaintext
+    encryption_key = None
+    if form.get('pipeline') == 'encrypt':
+        encryption_key = form.get('encryptionKey')
+        if not encryption_key:
+            return {'error': 'No encryption key provided for the encrypt pipeline'}, 400
+
+    # Identical requests reuse the earlier output; encrypted outputs depend on the key
+    # so they are never cached. The values of the last header scan shape the output
+    # too, so the run uses this snapshot of them and the key covers it
+    file_stream = open_upload(uploaded)
+    field_values = scanned_values(policy)
+    cache = None if encryption_key or is_no_cache(form) else get_result_cache()
+    if cache is not None:
+        cache_key = await run_cpu(result_cache_key, 'pdf', file_stream, policy.config(),
+                                  uploaded.filename, output_path, backend_version(), field_values)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return {**cached, 'cacheHit': True}, 200
+
+    # Long jobs can run in the background; the client polls /jobs/<id>
+    if is_async_request(form):
+        return submit_job('maskobfpdf', form, files)
     
     try:
-        # Read file as bytes
-        file_bytes = uploaded.read()
-        
-        print("Creating BytesIO object for maskpdf")
-        # Create BytesIO object 
-        file_bytes_io = BytesIO(file_bytes)
-        
         # Verify the PDF is valid
         try:
-            print("Verifying PDF in maskpdf")
-            reader = PdfReader(file_bytes_io)
-            num_pages = len(reader.pages)
-            print(f"PDF has {num_pages} pages")
-            
-            # Reset file position to beginning for subsequent operations
-            file_bytes_io.seek(0)
+            with stage('pdf_verify'):
+                num_pages = await run_cpu(verify_pdf, file_stream)
+            logger.debug("PDF has %d pages", num_pages)
         except Exception as pdf_error:
-            print(f"PDF validation error in maskpdf: {pdf_error}")
-            print(traceback.format_exc())
-            return jsonify({"error": f"Invalid PDF file: {str(pdf_error)}"}), 400
+            logger.warning("PDF validation error in maskpdf: %s", pdf_error, exc_info=True)
+            return {"error": f"Invalid PDF file: {str(pdf_error)}"}, 400
         
         # Ensure output directory exists
         if output_path:
             os.makedirs(output_path, exist_ok=True)
         
-        # Parse the headers JSON to ensure it's a proper Python object
-        try:
-            headers = json.loads(headers_json)
-            print(f"Successfully parsed headers: {headers}")
-        except json.JSONDecodeError as json_err:
-            print(f"Failed to parse headers JSON: {json_err}")
-            return jsonify({"error": f"Invalid headers JSON: {str(json_err)}"}), 400
-        
         # Prepare JSON data
         json_data = {
             'fileName': uploaded.filename,
-            'headers': headers,  # Now passing parsed Python object instead of raw JSON string
-            'outputPath': output_path
+            'headers': policy.config(),
+            'policy': policy,
+            'fieldValues': field_values,
+            'outputPath': output_path,
+            'encryptionKey': encryption_key
         }
         
-        # Process the PDF file
-        print("Calling maskobfpdf")
-        output_file = maskobfpdf(json_data, file_bytes_io)
+        # Process the PDF file; the plan records the estimate and the peak RSS
+        with mapped_upload(file_stream) as pdf_view:
+            plan = plan_pdf(await run_pdf(inspect_pdf, pdf_view))
+            with RssMonitor() as monitor:
+                output_file = await maskobfpdf_async(json_data, pdf_view)
+        plan.peak_rss_bytes = monitor.peak
         
         # Get just the filename from the full path
         filename = os.path.basename(output_file)
         
-        return jsonify({
+        payload = {
             'output': output_file,
-            'filename': filename
-        })
+            'filename': filename,
+            'encrypted': bool(encryption_key),
+            'plan': plan.to_dict()
+        }
+        if cache is not None:
+            cache.put(cache_key, payload)
+        return {**payload, 'cacheHit': False}, 200
         
     except Exception as e:
-        print(f"Error in maskpdf endpoint: {str(e)}")
-        print(traceback.format_exc())
-        return jsonify({'error': str(e)}), 500
+        logger.error("Error in maskpdf endpoint: %s", e, exc_info=True)
+        return {'error': str(e)}, 500
+
+async def maskpdf_batch_async(form, files):
+    """
+    Process several PDF files that share one field configuration
+    """
+    uploads = [uploaded for uploaded in files.getlist('file') if uploaded.filename]
+    headers_json = form.get('headers')
+    policy_name = form.get('policy')
+    output_path = form.get('outputPath', '')
+
+    if not uploads or not (headers_json or policy_name):
+        return {'error': 'Missing files or headers'}, 400
+    filenames = [uploaded.filename for uploaded in uploads]
+    if len(set(filenames)) != len(filenames):
+        return {'error': 'Uploaded files must have distinct names'}, 400
+
+    encryption_key = None
+    if form.get('pipeline') == 'encrypt':
+        encryption_key = form.get('encryptionKey')
+        if not encryption_key:
+            return {'error': 'No encryption key provided for the encrypt pipeline'}, 400
+
+    try:
+        policy = request_policy(policy_name, headers_json)
+    except PolicyError as e:
+        return {'error': str(e)}, 400
+
+    if is_async_request(form):
+        return submit_job('maskobfpdfbatch', form, files)
+
+    try:
+        streams = [open_upload(uploaded) for uploaded in uploads]
+        for uploaded, file_stream in zip(uploads, streams):
+            try:
+                with stage('pdf_verify'):
+                    await run_cpu(verify_pdf, file_stream)
+            except Exception as pdf_error:
+                logger.warning("PDF validation error in batch: %s", pdf_error)
+                return {"error": f"Invalid PDF file {uploaded.filename}: {str(pdf_error)}"}, 400
+
+        if output_path:
+            os.makedirs(output_path, exist_ok=True)
+        json_data = {
+            'headers': policy.config(),
+            'policy': policy,
+            'outputPath': output_path,
+            'encryptionKey': encryption_key
+        }
+        # Field values are pooled across the documents into shared model calls
+        with ExitStack() as stack:
+            sources = [(uploaded.filename, stack.enter_context(mapped_upload(file_stream)))
+                       for uploaded, file_stream in zip(uploads, streams)]
+            outputs = await maskobfpdf_batch_async(json_data, sources)
+        archive_name = None
+        if form.get('zip', '').lower() in ('1', 'true', 'yes'):
+            archive_name = secure_filename(form.get('archiveName', '')) or 'batch'
+        return batch_payload(filenames, outputs, bool(encryption_key), archive_name), 200
+
+    except Exception as e:
+        logger.error("Error in maskpdf batch endpoint: %s", e, exc_info=True)
+        return {'error': str(e)}, 500
+
+register_job_kind('maskobfpdf', maskpdf_async)
+register_job_kind('maskobfpdfbatch', maskpdf_batch_async)
+
+
+# Flask views
+def getpdfheader():
+    payload, status = run_sync(getpdfheader_async(request.form, request.files))
+    return jsonify(payload), status
+
+def maskpdf():
+    payload, status = run_sync(maskpdf_async(request.form, request.files))
+    return jsonify(payload), status
+
+def maskpdf_batch():
+    payload, status = run_sync(maskpdf_batch_async(request.form, request.files))
+    return jsonify(payload), status
 
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
\ No newline at end of file
@@ -0,0 +1,52 @@
+from flask import request, jsonify
+from obfuscate.policy import PolicyConflict, PolicyError, get_policy_registry
+from core.pools import run_cpu, run_sync
+
+
+# Registration and lookup of named masking policies shared by the Flask and ASGI
+# servers; each returns (payload, status). Mask requests then send policy=<name>
+# instead of the headers JSON.
+
+async def register_policy_async(form, files):
+    # Accepts the template's name, its fields in the shape of the headers JSON and a description;
+    # replacing an existing template also takes the POLICY_TOKEN as token
+    name = form.get('name')
+    headers_json = form.get('headers')
+    if not name or not headers_json:
+        return {'error': 'Missing name or headers'}, 400
+    try:
+        policy = await run_cpu(get_policy_registry().register, name, headers_json, form.get('description', ''),
+                               form.get('token'))
+    except PolicyConflict as e:
+        return {'error': str(e)}, 409
+    except PolicyError as e:
+        return {'error': str(e)}, 400
+    return policy.to_dict(), 201
+
+
+async def list_policies_async(form, files):
+    policies = await run_cpu(get_policy_registry().list)
+    return {'policies': [policy.to_dict() for policy in policies]}, 200
+
+
+async def get_policy_async(name):
+    policy = await run_cpu(get_policy_registry().get, name)
+    if policy is None:
+        return {'error': 'Policy not found'}, 404
+    return policy.to_dict(), 200
+
+
+# Flask views
+def register_policy():
+    payload, status = run_sync(register_policy_async(request.form, request.files))
+    return jsonify(payload), status
+
+
+def list_policies():
+    payload, status = run_sync(list_policies_async(request.form, request.files))
+    return jsonify(payload), status
+
+
+def get_policy(name):
+    payload, status = run_sync(get_policy_async(name))
+    return jsonify(payload), status
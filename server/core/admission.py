@@ -0,0 +1,333 @@
+import os
+import math
+import time
+import heapq
+import asyncio
+import hashlib
+import threading
+import itertools
+
+from core import metrics
+from core.tracing import get_logger
+
+# -----------------------------
+# Admission control for the upload endpoints. Requests are split into two
+# pools with their own concurrency limits, so bulk work cannot take the slots
+# that header and preview calls need:
+#   interactive  /getcsvheader, /getpdfheader, /listarchive
+#   batch        mask, batch mask, encrypt and decrypt endpoints
+# Status, result, metrics and download routes are not admitted at all.
+# A request that finds its pool full waits in a weighted fair queue: each
+# client (the API key header, else the remote address) gets a share of the
+# pool proportional to its weight, whatever the number of requests it queues
+# (start-time fair queuing). Requests fail fast with 429 and Retry-After when
+# the pool's queue or the client's share of it is full, and with 429 after
+# waiting longer than ADMISSION_WAIT. Limits are per server process (per worker
+# under prefork.py). Settings (environment):
+#   ADMISSION                    1/0 to enable or disable (default enabled)
+#   ADMISSION_INTERACTIVE_SLOTS  interactive requests running at once (default 8)
+#   ADMISSION_INTERACTIVE_QUEUE  interactive requests waiting at most (default 64)
+#   ADMISSION_BATCH_SLOTS        batch requests running at once (default 2)
+#   ADMISSION_BATCH_QUEUE        batch requests waiting at most (default 16)
+#   ADMISSION_CLIENT_QUEUE       requests one client may have waiting per pool (default 4)
+#   ADMISSION_WAIT               seconds a request may wait for a slot (default 30)
+#   ADMISSION_WEIGHTS            client=weight pairs, e.g. "key-abc=4,10.0.0.5=2" (default weight 1)
+#   API_KEY_HEADER               header that identifies clients (default X-API-Key)
+# -----------------------------
+
+INTERACTIVE = 'interactive'
+BATCH = 'batch'
+
+ENDPOINT_POOLS = {
+    '/getcsvheader': INTERACTIVE,
+    '/getpdfheader': INTERACTIVE,
+    '/listarchive': INTERACTIVE,
+    '/maskobfcsv': BATCH,
+    '/maskobfcsv/batch': BATCH,
+    '/maskobfpdf': BATCH,
+    '/maskobfpdf/batch': BATCH,
+    '/encryptfile': BATCH,
+    '/decryptfile': BATCH,
+}
+
+MAX_RETRY_AFTER = 60
+# Weight of the first service time samples against the running average
+SERVICE_SMOOTHING = 0.2
+
+logger = get_logger('admission')
+
+ADMISSIONS = metrics.counter('obscura_admission_total', 'Admission decisions by pool and outcome',
+                             ['pool', 'outcome'])
+ADMISSION_WAIT_SECONDS = metrics.histogram('obscura_admission_wait_seconds', 'Time requests queued for a slot',
+                                           ['pool'])
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted; carries the HTTP status and Retry-After seconds"""
+
+    def __init__(self, message, retry_after, status=429):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+def admission_enabled():
+    return os.getenv("ADMISSION", "1").lower() not in ("0", "false", "no")
+
+
+def endpoint_pool(rule):
+    """The pool a route rule is admitted through, or None for routes that are not admitted"""
+    return ENDPOINT_POOLS.get(rule)
+
+
+def parse_weights(value):
+    """Parses "client=weight,..." into a dict; malformed pairs are skipped"""
+    weights = {}
+    for pair in (value or '').split(','):
+        client, _, weight = pair.strip().rpartition('=')
+        try:
+            if client and float(weight) > 0:
+                weights[client] = float(weight)
+        except ValueError:
+            logger.warning("Ignoring admission weight %r", pair)
+    return weights
+
+
+def client_identity(api_key, remote_addr, weights):
+    """
+    (client id, weight) of a request. API keys are only kept as a digest, so
+    they never end up in logs or metrics.
+    """
+    if api_key:
+        client = 'key:' + hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+        return client, weights.get(api_key, 1.0)
+    remote_addr = remote_addr or 'unknown'
+    return 'addr:' + remote_addr, weights.get(remote_addr, 1.0)
+
+
+class Ticket:
+    """One request's place in a pool: queued until granted, then holding a slot until released"""
+
+    def __init__(self, pool, client, start_tag=0.0, finish_tag=0.0, future=None, queued=False):
+        self.pool = pool
+        self.client = client
+        self.start_tag = start_tag
+        self.finish_tag = finish_tag
+        self.granted = False
+        self.queued = queued
+        self.released = False
+        self.queued_at = time.monotonic()
+        self.granted_at = None
+        self._event = threading.Event()
+        self._future = future
+        self._loop = future.get_loop() if future is not None else None
+
+    def grant(self):
+        self.granted = True
+        self.granted_at = time.monotonic()
+        self._event.set()
+        if self._future is not None:
+            self._loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self._future.done():
+            self._future.set_result(self)
+
+    def wait(self, timeout):
+        return self._event.wait(timeout)
+
+
+class Pool:
+    """Concurrency slots plus a start-time fair queue of waiting tickets"""
+
+    def __init__(self, name, slots, max_queue, client_queue):
+        self.name = name
+        self.slots = max(1, slots)
+        self.max_queue = max_queue
+        self.client_queue = client_queue
+        self.active = 0
+        self.virtual_time = 0.0
+        self.service_seconds = 1.0
+        self.queue = []
+        self._order = itertools.count()
+        self._last_finish = {}
+        self.waiting = {}
+
+    def retry_after(self):
+        """Seconds until a slot is likely free for a request joining the back of the queue"""
+        wait = (len(self.queue) + 1) * self.service_seconds / self.slots
+        return max(1, min(MAX_RETRY_AFTER, math.ceil(wait)))
+
+    def enqueue(self, client, weight, future=None):
+        start = max(self.virtual_time, self._last_finish.get(client, 0.0))
+        ticket = Ticket(self, client, start, start + 1.0 / weight, future, queued=True)
+        self._last_finish[client] = ticket.finish_tag
+        self.waiting[client] = self.waiting.get(client, 0) + 1
+        heapq.heappush(self.queue, (ticket.finish_tag, next(self._order), ticket))
+        return ticket
+
+    def dispatch(self):
+        """Grants queued tickets, lowest finish tag first, while slots are free"""
+        while self.queue and self.active < self.slots:
+            _, _, ticket = heapq.heappop(self.queue)
+            self._dequeued(ticket)
+            self.virtual_time = max(self.virtual_time, ticket.start_tag)
+            self.active += 1
+            ticket.grant()
+        # Clients whose tags the virtual clock has passed start afresh anyway
+        if len(self._last_finish) > 1024:
+            self._last_finish = {client: tag for client, tag in self._last_finish.items()
+                                 if tag > self.virtual_time or client in self.waiting}
+
+    def remove(self, ticket):
+        for i, (_, _, queued) in enumerate(self.queue):
+            if queued is ticket:
+                self.queue.pop(i)
+                heapq.heapify(self.queue)
+                self._dequeued(ticket)
+                return True
+        return False
+
+    def _dequeued(self, ticket):
+        count = self.waiting.get(ticket.client, 0) - 1
+        if count > 0:
+            self.waiting[ticket.client] = count
+        else:
+            self.waiting.pop(ticket.client, None)
+
+    def stats(self):
+        return {'active': self.active, 'queued': len(self.queue), 'slots': self.slots,
+                'serviceSeconds': round(self.service_seconds, 3)}
+
+
+class AdmissionController:
+    """Thread-safe admission for both servers: Flask threads block in admit(), Quart awaits admit_async()"""
+
+    def __init__(self, pools, wait=30.0, weights=None):
+        self.pools = {pool.name: pool for pool in pools}
+        self.wait = wait
+        self.weights = weights or {}
+        self._lock = threading.Lock()
+
+    def _acquire(self, pool_name, client, weight, future=None):
+        """Returns a granted or queued ticket, or raises AdmissionRejected"""
+        pool = self.pools[pool_name]
+        with self._lock:
+            if pool.active < pool.slots and not pool.queue:
+                pool.active += 1
+                ticket = Ticket(pool, client)
+                ticket.grant()
+                ADMISSIONS.inc(pool=pool_name, outcome='admitted')
+                return ticket
+            if len(pool.queue) >= pool.max_queue:
+                reason = f"Too many {pool_name} requests queued"
+            elif pool.waiting.get(client, 0) >= pool.client_queue:
+                reason = f"Too many {pool_name} requests queued for this client"
+            else:
+                return pool.enqueue(client, weight, future)
+            retry_after = pool.retry_after()
+        ADMISSIONS.inc(pool=pool_name, outcome='rejected')
+        logger.info("Rejected %s request from %s: %s", pool_name, client, reason)
+        raise AdmissionRejected(f"{reason}, try again later", retry_after)
+
+    def _timed_out(self, ticket):
+        """Takes a ticket that waited too long out of the queue; raises unless it was granted meanwhile"""
+        with self._lock:
+            removed = ticket.pool.remove(ticket)
+            retry_after = ticket.pool.retry_after()
+        if not removed:
+            return
+        ADMISSIONS.inc(pool=ticket.pool.name, outcome='timeout')
+        raise AdmissionRejected(f"No {ticket.pool.name} slot free within {self.wait:g}s, try again later",
+                                retry_after)
+
+    def _admitted(self, ticket):
+        if ticket.queued:
+            ADMISSIONS.inc(pool=ticket.pool.name, outcome='admitted')
+            ADMISSION_WAIT_SECONDS.observe(ticket.granted_at - ticket.queued_at, pool=ticket.pool.name)
+        return ticket
+
+    def admit(self, pool_name, api_key=None, remote_addr=None):
+        """Blocks until the request holds a slot; returns the ticket to release()"""
+        client, weight = client_identity(api_key, remote_addr, self.weights)
+        ticket = self._acquire(pool_name, client, weight)
+        if not ticket.granted and not ticket.wait(self.wait):
+            self._timed_out(ticket)
+        return self._admitted(ticket)
+
+    async def admit_async(self, pool_name, api_key=None, remote_addr=None):
+        """Waits without blocking the event loop until the request holds a slot"""
+        client, weight = client_identity(api_key, remote_addr, self.weights)
+        future = asyncio.get_running_loop().create_future()
+        ticket = self._acquire(pool_name, client, weight, future)
+        if not ticket.granted:
+            try:
+                await asyncio.wait_for(asyncio.shield(future), self.wait)
+            except asyncio.TimeoutError:
+                self._timed_out(ticket)
+            except asyncio.CancelledError:
+                # Client went away while queued
+                with self._lock:
+                    removed = ticket.pool.remove(ticket)
+                if not removed:
+                    self.release(ticket)
+                raise
+        return self._admitted(ticket)
+
+    def release(self, ticket):
+        """Frees the ticket's slot and hands it to the next queued request"""
+        with self._lock:
+            if ticket.released:
+                return
+            ticket.released = True
+            pool = ticket.pool
+            pool.active -= 1
+            elapsed = time.monotonic() - ticket.granted_at
+            pool.service_seconds += SERVICE_SMOOTHING * (elapsed - pool.service_seconds)
+            pool.dispatch()
+
+    def stats(self):
+        with self._lock:
+            return {name: pool.stats() for name, pool in self.pools.items()}
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_admission_controller():
+    """Returns the process-wide admission controller, or None when ADMISSION is disabled"""
+    global _controller
+    if not admission_enabled():
+        return None
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                client_queue = int(os.getenv("ADMISSION_CLIENT_QUEUE", "4"))
+                _controller = AdmissionController(
+                    [
+                        Pool(INTERACTIVE, int(os.getenv("ADMISSION_INTERACTIVE_SLOTS", "8")),
+                             int(os.getenv("ADMISSION_INTERACTIVE_QUEUE", "64")), client_queue),
+                        Pool(BATCH, int(os.getenv("ADMISSION_BATCH_SLOTS", "2")),
+                             int(os.getenv("ADMISSION_BATCH_QUEUE", "16")), client_queue),
+                    ],
+                    wait=float(os.getenv("ADMISSION_WAIT", "30")),
+                    weights=parse_weights(os.getenv("ADMISSION_WEIGHTS")),
+                )
+    return _controller
+
+
+def api_key_header():
+    return os.getenv("API_KEY_HEADER", "X-API-Key")
+
+
+def _pool_samples(field):
+    if _controller is None:
+        return {}
+    return {(name,): stats[field] for name, stats in _controller.stats().items()}
+
+
+metrics.callback('obscura_admission_active', 'Requests holding an admission slot', 'gauge',
+                 lambda: _pool_samples('active'), ['pool'])
+metrics.callback('obscura_admission_queued', 'Requests waiting for an admission slot', 'gauge',
+                 lambda: _pool_samples('queued'), ['pool'])
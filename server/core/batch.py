@@ -0,0 +1,252 @@
+import os
+import glob
+import json
+import fnmatch
+import time
+import asyncio
+import zipfile
+
+from core.tracing import get_logger, trace
+
+# -----------------------------
+# In-process batch processing shared by the CLI and the ingest watcher. Files
+# go straight from disk into the same handlers the HTTP endpoints use (CSV as a
+# binary stream, PDF as a memory-mapped view, AES file to file), with at most
+# `workers` files in flight on one event loop; the CPU-heavy steps run on the
+# pools in core.pools. The batch mask endpoints use the zip/payload helpers at
+# the end.
+# -----------------------------
+
+PIPELINES = ('mask', 'encrypt', 'decrypt')
+MASK_KINDS = {'.csv': 'csv', '.pdf': 'pdf'}
+
+logger = get_logger('batch')
+
+# Header detection and masking of a PDF share pdfhandler's module-level value
+# store, so one PDF at a time goes through the pair
+_pdf_lock = None
+
+
+class FileResult:
+    """Outcome of one input file"""
+
+    def __init__(self, path, output_dir):
+        self.path = path
+        self.output_dir = output_dir
+        self.status = 'pending'
+        self.output = None
+        self.error = None
+        self.seconds = 0.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def to_dict(self):
+        return {
+            'path': self.path,
+            'status': self.status,
+            'output': self.output,
+            'error': self.error,
+            'seconds': self.seconds,
+            'bytesIn': self.bytes_in,
+            'bytesOut': self.bytes_out,
+        }
+
+
+def load_field_config(path):
+    """Reads a field configuration in the shape of the endpoints' headers JSON"""
+    with open(path, 'r', encoding='utf-8') as f:
+        fields = json.load(f)
+    if isinstance(fields, dict):
+        fields = fields.get('headers', [])
+    if not isinstance(fields, list) or not all(isinstance(f, dict) and f.get('name') for f in fields):
+        raise ValueError(f"{path}: expected a list of {{name, mode, prompt}} objects")
+    return fields
+
+
+def expand_inputs(inputs, output_dir, recursive=False, pattern=None):
+    """
+    Resolves files, directories and glob patterns into (path, output folder)
+    pairs. Files found under a directory keep their relative folder below
+    output_dir; everything else goes to output_dir itself.
+    """
+    pairs = []
+    seen = set()
+
+    def add(path, target):
+        path = os.path.abspath(path)
+        if path not in seen and os.path.isfile(path):
+            seen.add(path)
+            pairs.append((path, target))
+
+    for item in inputs:
+        if os.path.isdir(item):
+            walker = os.walk(item) if recursive else [(item, [], os.listdir(item))]
+            for folder, _, names in walker:
+                relative = os.path.relpath(folder, item)
+                target = output_dir if relative == '.' else os.path.join(output_dir, relative)
+                for name in sorted(names):
+                    if pattern is None or fnmatch.fnmatch(name, pattern):
+                        add(os.path.join(folder, name), target)
+        elif glob.has_magic(item):
+            for path in sorted(glob.glob(item, recursive=recursive)):
+                add(path, output_dir)
+        else:
+            add(item, output_dir)
+    return pairs
+
+
+def find_collisions(pairs):
+    """Input files that would write to the same output name as an earlier one"""
+    seen = {}
+    collisions = []
+    for path, output_dir in pairs:
+        key = (output_dir, os.path.basename(path))
+        if key in seen:
+            collisions.append((seen[key], path))
+        else:
+            seen[key] = path
+    return collisions
+
+
+def mask_kind(path):
+    return MASK_KINDS.get(os.path.splitext(path)[1].lower())
+
+
+async def mask_file(path, fields, output_dir, encryption_key=None, incremental=False):
+    """
+    Masks/obfuscates a CSV or PDF by its extension; returns the output path.
+    fields is a field config or a CompiledPolicy (e.g. a registered template).
+    With incremental, CSVs only have the rows appended since the last run
+    (checkpointed by path) masked onto the existing output.
+    """
+    from obfuscate.policy import CompiledPolicy
+
+    kind = mask_kind(path)
+    config = {'fileName': os.path.basename(path), 'headers': fields, 'outputPath': output_dir}
+    if isinstance(fields, CompiledPolicy):
+        config.update(headers=fields.config(), policy=fields)
+    if encryption_key:
+        config['encryptionKey'] = encryption_key
+
+    if kind == 'csv':
+        from obfuscate.csvhandler import maskobfcsv_async, maskobfcsv_incremental_async
+        with open(path, 'rb') as stream:
+            if incremental:
+                output, _ = await maskobfcsv_incremental_async(config, stream, path)
+                return output
+            return await maskobfcsv_async(config, stream)
+
+    if kind == 'pdf':
+        from obfuscate.pdfhandler import predictpdfheaders_async, maskobfpdf_async
+        from core.uploads import mapped_upload
+        global _pdf_lock
+        if _pdf_lock is None:
+            _pdf_lock = asyncio.Lock()
+        async with _pdf_lock:
+            with open(path, 'rb') as stream, mapped_upload(stream) as view:
+                await predictpdfheaders_async(view)
+                output = await maskobfpdf_async(config, view)
+        # The PDF handler reports failures as a message instead of raising
+        if not os.path.isfile(output):
+            raise RuntimeError(output)
+        return output
+
+    raise ValueError(f"Unsupported file type for masking: {os.path.basename(path)}")
+
+
+async def encrypt_path(path, encryption_key, output_dir, compress=False):
+    from aes.aes import encrypt_file
+    from core.pools import run_cpu
+    return await run_cpu(encrypt_file, path, encryption_key, output_dir, compress)
+
+
+async def decrypt_path(path, encryption_key, output_dir):
+    from aes.aes import decrypt_file
+    from core.pools import run_cpu
+    return await run_cpu(decrypt_file, path, encryption_key, output_dir)
+
+
+def make_processor(pipeline, fields=None, encryption_key=None, compress=False, incremental=False):
+    """Returns an async fn(path, output_dir) -> output path for a pipeline"""
+    if pipeline == 'mask':
+        return lambda path, output_dir: mask_file(path, fields, output_dir, encryption_key, incremental)
+    if pipeline == 'encrypt':
+        return lambda path, output_dir: encrypt_path(path, encryption_key, output_dir, compress)
+    if pipeline == 'decrypt':
+        return lambda path, output_dir: decrypt_path(path, encryption_key, output_dir)
+    raise ValueError(f"Unknown pipeline: {pipeline}")
+
+
+async def process_one(processor, path, output_dir, pipeline='batch'):
+    """Runs one file through processor, capturing the outcome in a FileResult"""
+    result = FileResult(path, output_dir)
+    start = time.perf_counter()
+    try:
+        result.bytes_in = os.path.getsize(path)
+        os.makedirs(output_dir, exist_ok=True)
+        with trace(f"{pipeline} {os.path.basename(path)}"):
+            result.output = await processor(path, output_dir)
+        result.bytes_out = os.path.getsize(result.output)
+        result.status = 'ok'
+    except Exception as e:
+        logger.warning("Processing %s failed: %s", path, e, exc_info=True)
+        result.status = 'failed'
+        result.error = str(e)
+    result.seconds = time.perf_counter() - start
+    return result
+
+
+async def run_batch(processor, pairs, workers=4, on_done=None, pipeline='batch'):
+    """
+    Processes (path, output folder) pairs with at most workers in flight.
+    on_done(result, finished, total) is called as each file completes.
+    """
+    semaphore = asyncio.Semaphore(max(1, workers))
+    finished = 0
+
+    async def run(path, output_dir):
+        nonlocal finished
+        async with semaphore:
+            result = await process_one(processor, path, output_dir, pipeline)
+        finished += 1
+        if on_done is not None:
+            on_done(result, finished, len(pairs))
+        return result
+
+    return await asyncio.gather(*(run(path, output_dir) for path, output_dir in pairs))
+
+
+def bundle_outputs(paths, archive_path):
+    """
+    Packs output files into one zip and removes the originals. CSVs are
+    deflated; PDFs and encrypted outputs are stored, as they do not compress.
+    """
+    with zipfile.ZipFile(archive_path, 'w') as archive:
+        for path in paths:
+            compression = zipfile.ZIP_DEFLATED if path.endswith('.csv') else zipfile.ZIP_STORED
+            archive.write(path, os.path.basename(path), compress_type=compression)
+    for path in paths:
+        os.remove(path)
+    return archive_path
+
+
+def batch_payload(filenames, outputs, encrypted, archive_name=None):
+    """
+    Response of the batch mask endpoints: one output per input, or with
+    archive_name a single zip of all outputs next to them.
+    """
+    if archive_name:
+        archive_path = os.path.join(os.path.dirname(outputs[0]), f"{archive_name}-output.zip")
+        bundle_outputs(outputs, archive_path)
+        return {
+            'output': archive_path,
+            'filename': os.path.basename(archive_path),
+            'members': [os.path.basename(path) for path in outputs],
+            'encrypted': encrypted,
+            'totalProcessed': len(outputs),
+        }
+    return {
+        'files': [{'filename': name, 'output': path} for name, path in zip(filenames, outputs)],
+        'encrypted': encrypted,
+        'totalProcessed': len(outputs),
+    }
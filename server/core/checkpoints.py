@@ -0,0 +1,230 @@
+import os
+import json
+import asyncio
+import time
+import hashlib
+import sqlite3
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: runs are only serialized within the process
+    fcntl = None
+
+import settings
+from core.tracing import get_logger
+
+# -----------------------------
+# Checkpoints for incremental re-masking of append-only CSV feeds. After a run,
+# a source (identified by the client's sourceId, or the CLI's input path)
+# records how far it was processed: the byte offset just past the last complete
+# row, the row count and a SHA-256 of those bytes, next to the output it
+# produced and that output's size and mtime. The next run hashes the same
+# number of bytes of the new file; when the hash matches and the output is
+# untouched, only the rows after the offset are masked and appended to the
+# output. Anything else (edited rows, a rewritten output, another field
+# configuration) falls back to a full run that starts a new checkpoint.
+# A run claims its checkpoint first, so two runs never append the same rows;
+# the claim holds across threads, event loops and (where fcntl exists) server
+# processes, through a byte-range lock per key in <database>.lock.
+# Settings (environment):
+#   CHECKPOINT_DB   path of the checkpoint database (default cache/checkpoints.db)
+# -----------------------------
+
+# Bump when the way appended rows are derived changes, so every source restarts once
+CHECKPOINT_VERSION = 1
+HASH_CHUNK_SIZE = 1024 * 1024
+CLAIM_POLL_INTERVAL = 0.05
+DEFAULT_DB_PATH = os.path.join(settings.BASE_DIR, "cache", "checkpoints.db")
+
+logger = get_logger('checkpoints')
+
+
+def is_incremental(form):
+    """Whether the client asked for an incremental run against the source's checkpoint"""
+    return form.get('incremental', '').lower() in ('1', 'true', 'yes')
+
+
+def checkpoint_key(source_id, headers, output_path):
+    """Key of a source's checkpoint; a different field configuration or output folder starts over"""
+    from core.resultcache import PIPELINE_VERSION, normalize_headers
+
+    params = [CHECKPOINT_VERSION, PIPELINE_VERSION, source_id, normalize_headers(headers), output_path or '']
+    return hashlib.sha256(json.dumps(params).encode('utf-8')).hexdigest()
+
+
+def scan_rows(stream, offset=None):
+    """
+    Hashes a binary stream up to the end of its last complete row (the last
+    newline), so a row still being written is left for the next run. With
+    offset, the hash of the first offset bytes is taken on the way. Returns
+    {'end', 'size', 'lines', 'hash', 'prefixHash'}; prefixHash is None when
+    the stream is shorter than offset or offset does not fall on a row end.
+    """
+    digest = hashlib.sha256()
+    prefix_hash = None
+    position = 0
+    lines = 0
+    tail = b''
+    stream.seek(0)
+    for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b''):
+        data = tail + chunk
+        cut = data.rfind(b'\n') + 1
+        complete, tail = data[:cut], data[cut:]
+        if offset is not None and prefix_hash is None and position < offset <= position + len(complete):
+            split = offset - position
+            digest.update(complete[:split])
+            if complete[split - 1:split] == b'\n':
+                prefix_hash = digest.hexdigest()
+            digest.update(complete[split:])
+        else:
+            digest.update(complete)
+        position += len(complete)
+        lines += complete.count(b'\n')
+    stream.seek(0)
+    return {
+        'end': position,
+        'size': position + len(tail),
+        'lines': lines,
+        'hash': digest.hexdigest(),
+        'prefixHash': prefix_hash,
+    }
+
+
+class RangeReader:
+    """Read-only view of bytes [start, end) of a seekable binary stream, for pandas to parse the appended rows"""
+
+    def __init__(self, stream, start, end):
+        self._stream = stream
+        self._remaining = end - start
+        stream.seek(start)
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._stream.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def readline(self, size=-1):
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._stream.readline(size)
+        self._remaining -= len(data)
+        return data
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+
+def claim_offset(key):
+    """Byte of the lock file that stands for a checkpoint key"""
+    return int(key[:15], 16)
+
+
+class CheckpointStore:
+    """Per-source record of the processed prefix and the output it was written to"""
+
+    def __init__(self, path=DEFAULT_DB_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db_lock = threading.Lock()
+        self._claims = set()
+        self._claims_lock = threading.Lock()
+        # One descriptor per process: closing any descriptor of the file drops all of its POSIX locks
+        self._lock_file = open(f"{path}.lock", 'a+b') if fcntl is not None else None
+        with self._db_lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS checkpoints (
+                    key TEXT PRIMARY KEY,
+                    source TEXT NOT NULL,
+                    byte_offset INTEGER NOT NULL,
+                    row_count INTEGER NOT NULL,
+                    prefix_hash TEXT NOT NULL,
+                    output TEXT NOT NULL,
+                    output_size INTEGER NOT NULL,
+                    output_mtime_ns INTEGER NOT NULL,
+                    updated REAL NOT NULL
+                )
+            """)
+
+    def _execute(self, sql, params=()):
+        with self._db_lock, self._db:
+            return self._db.execute(sql, params).fetchall()
+
+    def get(self, key):
+        """The checkpoint as a dict, or None when there is none or its output was changed or removed"""
+        rows = self._execute("SELECT * FROM checkpoints WHERE key = ?", (key,))
+        if not rows:
+            return None
+        checkpoint = dict(rows[0])
+        try:
+            st = os.stat(checkpoint['output'])
+        except OSError:
+            st = None
+        if st is None or st.st_size != checkpoint['output_size'] or st.st_mtime_ns != checkpoint['output_mtime_ns']:
+            logger.info("Output of %s changed since its checkpoint; starting over", checkpoint['source'])
+            self.drop(key)
+            return None
+        return checkpoint
+
+    def put(self, key, source, byte_offset, row_count, prefix_hash, output):
+        """Records a run that left output covering the first byte_offset bytes of the source"""
+        st = os.stat(output)
+        self._execute(
+            "INSERT OR REPLACE INTO checkpoints (key, source, byte_offset, row_count, prefix_hash, output, "
+            "output_size, output_mtime_ns, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, source, byte_offset, row_count, prefix_hash, output, st.st_size, st.st_mtime_ns, time.time()),
+        )
+
+    def drop(self, key):
+        self._execute("DELETE FROM checkpoints WHERE key = ?", (key,))
+
+    def try_claim(self, key):
+        """Claims a checkpoint for one run unless another thread or process holds it; never blocks"""
+        with self._claims_lock:
+            if key in self._claims:
+                return False
+            if self._lock_file is not None:
+                try:
+                    fcntl.lockf(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, claim_offset(key))
+                except OSError:
+                    return False
+            self._claims.add(key)
+            return True
+
+    def release(self, key):
+        with self._claims_lock:
+            if key not in self._claims:
+                return
+            self._claims.discard(key)
+            if self._lock_file is not None:
+                fcntl.lockf(self._lock_file, fcntl.LOCK_UN, 1, claim_offset(key))
+
+    async def claim(self, key):
+        """Waits until the checkpoint is claimed; pair with release() once the run is over"""
+        while not self.try_claim(key):
+            await asyncio.sleep(CLAIM_POLL_INTERVAL)
+
+    def close(self):
+        with self._db_lock:
+            self._db.close()
+        if self._lock_file is not None:
+            self._lock_file.close()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_checkpoint_store():
+    """Returns the process-wide checkpoint store"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = CheckpointStore(os.getenv("CHECKPOINT_DB", DEFAULT_DB_PATH))
+    return _store
@@ -0,0 +1,299 @@
+import os
+import json
+import time
+import errno
+import ctypes
+import ctypes.util
+import asyncio
+import hashlib
+import sqlite3
+import threading
+
+from core.batch import expand_inputs, mask_kind, run_batch
+from core.tracing import get_logger
+
+# -----------------------------
+# Incremental ingestion of a folder tree into one of the batch pipelines. A
+# SQLite manifest (next to the outputs by default) maps every input path to its
+# content hash, the hash of the configuration it was processed with and the
+# output it produced. A scan only stats unchanged files; files whose size or
+# mtime moved are hashed, and only new content, a changed configuration or a
+# missing output puts a file back in the queue. In watch mode the tree is
+# rescanned on inotify events (Linux) or on a timer.
+#   INGEST_INTERVAL  seconds between rescans in watch mode (default 10)
+#   INGEST_SETTLE    seconds a file must stay unmodified before it is picked up
+#                    in watch mode, so half-copied drops are not processed (default 2)
+# -----------------------------
+
+# Bump when the way outputs are derived changes, so everything is redone once
+INGEST_VERSION = 1
+HASH_CHUNK_SIZE = 1024 * 1024
+MANIFEST_NAME = ".obscura-manifest.db"
+
+logger = get_logger('ingest')
+
+
+def config_hash(pipeline, fields=None, encryption_key=None, compress=False):
+    """Hash of everything besides the input bytes that shapes an output"""
+    from core.resultcache import PIPELINE_VERSION, normalize_headers
+
+    # Only a digest of the key goes in, so the manifest never holds the key itself
+    key_digest = hashlib.sha256(encryption_key.encode('utf-8')).hexdigest() if encryption_key else None
+    params = [INGEST_VERSION, PIPELINE_VERSION, pipeline,
+              normalize_headers(fields) if fields is not None else None, key_digest, bool(compress)]
+    return hashlib.sha256(json.dumps(params).encode('utf-8')).hexdigest()
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """Per-path record of what was processed, from which content, with which config"""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db_lock = threading.Lock()
+        with self._db_lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    config_hash TEXT NOT NULL,
+                    output TEXT,
+                    status TEXT NOT NULL,
+                    error TEXT,
+                    updated REAL NOT NULL
+                )
+            """)
+
+    def _execute(self, sql, params=()):
+        with self._db_lock, self._db:
+            return self._db.execute(sql, params).fetchall()
+
+    def entries(self):
+        """All records by path, loaded at once so a scan does not query per file"""
+        return {row['path']: row for row in self._execute("SELECT * FROM files")}
+
+    def record(self, path, size, mtime_ns, content_hash, config_hash, output, status, error=None):
+        self._execute(
+            "INSERT OR REPLACE INTO files (path, size, mtime_ns, content_hash, config_hash, output, status, error, "
+            "updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (path, size, mtime_ns, content_hash, config_hash, output, status, error, time.time()),
+        )
+
+    def touch(self, path, size, mtime_ns):
+        """Stores a new size/mtime for a file whose content turned out unchanged"""
+        self._execute("UPDATE files SET size = ?, mtime_ns = ?, updated = ? WHERE path = ?",
+                      (size, mtime_ns, time.time(), path))
+
+    def close(self):
+        with self._db_lock:
+            self._db.close()
+
+
+class PollWatcher:
+    """Wakes the watch loop on a timer only"""
+
+    def refresh(self, root):
+        pass
+
+    async def wait(self, timeout):
+        await asyncio.sleep(timeout)
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """
+    Wakes the watch loop when anything is written, moved in or created below
+    the root (Linux). Events only trigger a rescan; the scan works out what
+    changed, so no event parsing is needed and overflowed queues are harmless.
+    """
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._fd = self._libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._event = asyncio.Event()
+        asyncio.get_running_loop().add_reader(self._fd, self._drain)
+
+    def refresh(self, root):
+        """Watches root and every folder below it; folders already watched are kept"""
+        for folder, _, _ in os.walk(root):
+            if self._libc.inotify_add_watch(self._fd, os.fsencode(folder), self.MASK) < 0:
+                logger.warning("Cannot watch %s: %s", folder, os.strerror(ctypes.get_errno()))
+
+    def _drain(self):
+        while True:
+            try:
+                if not os.read(self._fd, 65536):
+                    break
+            except BlockingIOError:
+                break
+            except OSError as e:
+                if e.errno != errno.EINTR:
+                    break
+        self._event.set()
+
+    async def wait(self, timeout):
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._event.clear()
+
+    def close(self):
+        asyncio.get_running_loop().remove_reader(self._fd)
+        os.close(self._fd)
+
+
+def open_watcher():
+    """inotify where the platform has it, polling everywhere else"""
+    if hasattr(os, 'uname') and os.uname().sysname == 'Linux':
+        try:
+            return InotifyWatcher()
+        except (OSError, AttributeError) as e:
+            logger.info("inotify unavailable (%s), polling instead", e)
+    return PollWatcher()
+
+
+class Ingester:
+    """Scans root and runs new or changed files through processor into output_dir"""
+
+    def __init__(self, root, output_dir, pipeline, processor, config_hash, manifest_path=None,
+                 workers=4, pattern=None, settle=0.0, retry_failed=False, on_done=None):
+        self.root = os.path.abspath(root)
+        self.output_dir = os.path.abspath(output_dir)
+        self.pipeline = pipeline
+        self.processor = processor
+        self.config_hash = config_hash
+        self.manifest = Manifest(manifest_path or os.path.join(self.output_dir, MANIFEST_NAME))
+        self.workers = workers
+        self.pattern = pattern
+        self.settle = settle
+        self.retry_failed = retry_failed
+        self.on_done = on_done
+
+    def accepts(self, path):
+        """Whether the pipeline handles this file; outputs under the input tree are never inputs"""
+        if path == os.path.abspath(self.manifest.path) or path.startswith(self.output_dir + os.sep):
+            return False
+        if self.pipeline == 'mask':
+            return mask_kind(path) is not None
+        if self.pipeline == 'decrypt':
+            return path.endswith('.enc')
+        return True
+
+    def _is_current(self, entry, content_hash=None):
+        """Whether the manifest entry still stands for the file's content and the current config"""
+        if entry is None or entry['config_hash'] != self.config_hash:
+            return False
+        if content_hash is not None and entry['content_hash'] != content_hash:
+            return False
+        if entry['status'] == 'failed':
+            return not self.retry_failed
+        return entry['output'] is not None and os.path.isfile(entry['output'])
+
+    async def scan(self):
+        """
+        Returns (pending, stats): the (path, output folder) pairs to process with
+        their (size, mtime_ns, content hash), and counts for the scan.
+        """
+        from core.pools import run_cpu
+
+        stats = {'scanned': 0, 'unchanged': 0, 'deferred': 0, 'queued': 0}
+        entries = self.manifest.entries()
+        pairs = await run_cpu(expand_inputs, [self.root], self.output_dir, True, self.pattern)
+        pending = []
+        now = time.time()
+        for path, output_dir in pairs:
+            if not self.accepts(path):
+                continue
+            stats['scanned'] += 1
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entry = entries.get(path)
+            if (entry is not None and entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns
+                    and self._is_current(entry)):
+                stats['unchanged'] += 1
+                continue
+            if self.settle and now - st.st_mtime < self.settle:
+                stats['deferred'] += 1
+                continue
+
+            content_hash = await run_cpu(hash_file, path)
+            if self._is_current(entry, content_hash):
+                # Touched or copied over with the same bytes
+                self.manifest.touch(path, st.st_size, st.st_mtime_ns)
+                stats['unchanged'] += 1
+                continue
+            pending.append((path, output_dir, (st.st_size, st.st_mtime_ns, content_hash)))
+        stats['queued'] = len(pending)
+        return pending, stats
+
+    async def run_once(self):
+        """One scan plus processing of everything it queued; returns the counts"""
+        start = time.perf_counter()
+        pending, stats = await self.scan()
+        known = {path: state for path, _, state in pending}
+
+        def done(result, finished, total):
+            size, mtime_ns, content_hash = known[result.path]
+            self.manifest.record(result.path, size, mtime_ns, content_hash, self.config_hash,
+                                 result.output, result.status, result.error)
+            if self.on_done is not None:
+                self.on_done(result, finished, total)
+
+        results = []
+        if pending:
+            results = await run_batch(self.processor, [(path, folder) for path, folder, _ in pending],
+                                      workers=self.workers, on_done=done, pipeline=self.pipeline)
+        stats['ok'] = sum(1 for r in results if r.status == 'ok')
+        stats['failed'] = len(results) - stats['ok']
+        stats['seconds'] = time.perf_counter() - start
+        stats['files'] = [r.to_dict() for r in results]
+        logger.info("Ingest scan of %s: %d scanned, %d unchanged, %d deferred, %d processed (%d failed) in %.2fs",
+                    self.root, stats['scanned'], stats['unchanged'], stats['deferred'], len(results),
+                    stats['failed'], stats['seconds'])
+        return stats
+
+    async def watch(self, interval=None, on_scan=None, stop=None):
+        """Rescans on changes (or every interval seconds) until stop is set"""
+        interval = interval if interval is not None else float(os.getenv("INGEST_INTERVAL", "10"))
+        watcher = open_watcher()
+        try:
+            while stop is None or not stop.is_set():
+                watcher.refresh(self.root)
+                stats = await self.run_once()
+                if on_scan is not None:
+                    on_scan(stats)
+                # Deferred files are picked up as soon as they have settled
+                timeout = min(interval, self.settle + 0.5) if stats['deferred'] else interval
+                await watcher.wait(timeout)
+        finally:
+            watcher.close()
+
+    def close(self):
+        self.manifest.close()
@@ -0,0 +1,387 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import sqlite3
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+import settings
+from core.pools import run_sync
+from core.tracing import get_logger, trace
+
+# -----------------------------
+# Background job subsystem. A job replays one of the controller coroutines
+# (registered per kind) against uploads saved under JOBS_FOLDER, on a bounded
+# worker pool. Job state lives in SQLite so queued work survives a restart.
+#   JOB_WORKERS  number of concurrent jobs (default 2)
+# Handlers report progress with report_progress(); it is a no-op outside a job.
+# Keys (encryptionKey, and the AES key inside headers) are never written to the
+# database: they stay in memory with the process that queued the job, so a job
+# that needs one fails instead of resuming after a restart. Finished rows lose
+# their form at once and are removed by the result sweeper after RESULT_TTL.
+# A cancel request is a flag in the job's row, so it reaches the job from any
+# server process sharing the folder; the running job polls it at most every
+# CANCEL_CHECK_INTERVAL from report_progress().
+# -----------------------------
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+PROGRESS_FLUSH_INTERVAL = 1.0  # seconds between progress writes to SQLite
+CANCEL_CHECK_INTERVAL = 0.25  # seconds between cancel flag reads from SQLite
+SECRET_FIELDS = ('encryptionKey',)
+
+_current_job = contextvars.ContextVar("current_job", default=None)
+_job_kinds = {}
+logger = get_logger('jobs')
+
+
+class JobCancelled(Exception):
+    """Raised inside a job when cancellation was requested"""
+
+
+def register_job_kind(kind, controller):
+    """Registers a controller coroutine (form, files) -> (payload, status) as a job kind"""
+    _job_kinds[kind] = controller
+
+
+def is_async_request(form):
+    """Whether the client asked for the request to run as a background job"""
+    return form.get('async', '').lower() in ('1', 'true', 'yes')
+
+
+def redact_form(form_items):
+    """
+    Form items with every key removed, and whether anything was removed. Keys
+    are the SECRET_FIELDS and the 'key' of each entry in the headers JSON.
+    """
+    stored = []
+    redacted = False
+    for name, value in form_items:
+        if name in SECRET_FIELDS:
+            redacted = redacted or bool(value)
+            continue
+        if name == 'headers':
+            try:
+                headers = json.loads(value)
+            except (TypeError, ValueError):
+                headers = None
+            if isinstance(headers, list) and any(isinstance(h, dict) and 'key' in h for h in headers):
+                value = json.dumps([{k: v for k, v in h.items() if k != 'key'} if isinstance(h, dict) else h
+                                    for h in headers])
+                redacted = True
+        stored.append([name, value])
+    return stored, redacted
+
+
+def report_progress(done, total=None, unit=None):
+    """
+    Records progress for the job running in the current context and raises
+    JobCancelled if the job was cancelled. Does nothing outside a job.
+    """
+    job = _current_job.get()
+    if job is not None:
+        job.update(done, total, unit)
+
+
+class JobContext:
+    """Live state of a running job, shared with the handler through a context variable"""
+
+    def __init__(self, manager, job_id):
+        self.manager = manager
+        self.job_id = job_id
+        self.done = 0
+        self.total = None
+        self.unit = None
+        self._last_flush = 0.0
+        self._last_cancel_check = 0.0
+
+    def update(self, done, total=None, unit=None):
+        now = time.monotonic()
+        if now - self._last_cancel_check >= CANCEL_CHECK_INTERVAL:
+            self._last_cancel_check = now
+            if self.manager.is_cancel_requested(self.job_id):
+                raise JobCancelled(f"Job {self.job_id} was cancelled")
+        self.done = done
+        if total is not None:
+            self.total = total
+        if unit is not None:
+            self.unit = unit
+        if now - self._last_flush >= PROGRESS_FLUSH_INTERVAL or (self.total and done >= self.total):
+            self._last_flush = now
+            self.manager.save_progress(self)
+
+
+class JobManager:
+    """SQLite-backed queue with a bounded worker pool"""
+
+    def __init__(self, folder=settings.JOBS_FOLDER, workers=2):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(folder, "jobs.db"), check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._live = {}
+        # Unredacted forms of queued jobs that carry keys, by job id
+        self._secret_forms = {}
+        with self._db_lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    form TEXT NOT NULL,
+                    uploads TEXT NOT NULL,
+                    progress_done INTEGER DEFAULT 0,
+                    progress_total INTEGER,
+                    progress_unit TEXT,
+                    result TEXT,
+                    error TEXT,
+                    created REAL NOT NULL,
+                    updated REAL NOT NULL,
+                    redacted INTEGER NOT NULL DEFAULT 0,
+                    cancel_requested INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            columns = {row['name'] for row in self._db.execute("PRAGMA table_info(jobs)")}
+            for column in ('redacted', 'cancel_requested'):
+                if column not in columns:
+                    self._db.execute(f"ALTER TABLE jobs ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0")
+            # Databases written before keys were redacted may still hold them in finished rows
+            self._db.execute("UPDATE jobs SET form = '[]' WHERE status IN (?, ?, ?)", FINISHED)
+
+    def _execute(self, sql, params=()):
+        with self._db_lock, self._db:
+            return self._db.execute(sql, params).fetchall()
+
+    def resume(self):
+        """Requeues jobs that were queued or interrupted by a restart"""
+        self._execute("UPDATE jobs SET status = ?, updated = ? WHERE status = ?", (QUEUED, time.time(), RUNNING))
+        rows = self._execute("SELECT id FROM jobs WHERE status = ? ORDER BY created", (QUEUED,))
+        for row in rows:
+            self._executor.submit(self._run, row['id'])
+        if rows:
+            logger.info("Resumed %d queued jobs", len(rows))
+
+    # Submission
+    def submit(self, kind, form, files):
+        """Persists the request (form fields and uploads) and queues it"""
+        # werkzeug is only needed by the server side of jobs; report_progress users skip it
+        from werkzeug.utils import secure_filename
+
+        if kind not in _job_kinds:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job_id = uuid.uuid4().hex
+        job_folder = os.path.join(self.folder, job_id)
+        os.makedirs(job_folder)
+
+        # Save every upload; the async flag is dropped so the replay runs inline
+        uploads = []
+        for field, storage in files.items(multi=True):
+            if not storage.filename:
+                continue
+            path = os.path.join(job_folder, f"{len(uploads)}_{secure_filename(storage.filename)}")
+            with open(path, 'wb') as f:
+                shutil.copyfileobj(storage.stream, f)
+            uploads.append({'field': field, 'filename': storage.filename, 'path': path})
+        form_items = [[k, v] for k, v in form.items(multi=True) if k != 'async']
+        stored_items, redacted = redact_form(form_items)
+        if redacted:
+            self._secret_forms[job_id] = form_items
+
+        now = time.time()
+        self._execute(
+            "INSERT INTO jobs (id, kind, status, form, uploads, created, updated, redacted) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, kind, QUEUED, json.dumps(stored_items), json.dumps(uploads), now, now, int(redacted)),
+        )
+        self._executor.submit(self._run, job_id)
+        return job_id
+
+    # Execution
+    def _run(self, job_id):
+        from werkzeug.datastructures import MultiDict, FileStorage
+
+        rows = self._execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        if not rows or rows[0]['status'] != QUEUED:
+            # Cancelled, possibly by another server process, before it started
+            self._secret_forms.pop(job_id, None)
+            return
+        row = rows[0]
+        form_items = self._secret_forms.pop(job_id, None)
+        if form_items is None and row['redacted']:
+            # Queued by a process that has since exited, together with its keys
+            if self._claim(job_id):
+                self._finish(job_id, FAILED, error="The job's key is not kept across restarts; submit it again")
+                shutil.rmtree(os.path.join(self.folder, job_id), ignore_errors=True)
+            return
+
+        if not self._claim(job_id):
+            return
+        job = JobContext(self, job_id)
+        self._live[job_id] = job
+        token = _current_job.set(job)
+
+        form = MultiDict(form_items if form_items is not None else json.loads(row['form']))
+        files = MultiDict()
+        streams = []
+        try:
+            for upload in json.loads(row['uploads']):
+                stream = open(upload['path'], 'rb')
+                streams.append(stream)
+                files.add(upload['field'], FileStorage(stream=stream, filename=upload['filename']))
+
+            with trace(f"job {row['kind']}", job_id=job_id):
+                payload, status = run_sync(_job_kinds[row['kind']](form, files))
+            if self.is_cancel_requested(job_id):
+                self._finish(job_id, CANCELLED)
+            elif status < 400:
+                self._finish(job_id, SUCCEEDED, result=payload)
+            else:
+                self._finish(job_id, FAILED, result=payload, error=payload.get('error'))
+        except JobCancelled:
+            self._finish(job_id, CANCELLED)
+        except Exception as e:
+            logger.error("Job %s failed: %s", job_id, e, exc_info=True)
+            self._finish(job_id, FAILED, error=str(e))
+        finally:
+            _current_job.reset(token)
+            for stream in streams:
+                stream.close()
+            # Inputs are no longer needed once the job has run
+            shutil.rmtree(os.path.join(self.folder, job_id), ignore_errors=True)
+
+    def _claim(self, job_id):
+        """Marks a queued job running; False if another server process claimed it first"""
+        with self._db_lock, self._db:
+            cursor = self._db.execute("UPDATE jobs SET status = ?, updated = ? WHERE id = ? AND status = ?",
+                                      (RUNNING, time.time(), job_id, QUEUED))
+            return cursor.rowcount == 1
+
+    def _finish(self, job_id, status, result=None, error=None):
+        job = self._live.pop(job_id, None)
+        if job is not None:
+            self.save_progress(job)
+        self._secret_forms.pop(job_id, None)
+        # The form is not needed once the job is over
+        self._execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, form = '[]', updated = ? WHERE id = ?",
+            (status, json.dumps(result) if result is not None else None, error, time.time(), job_id),
+        )
+
+    def purge(self, ttl, now=None):
+        """Deletes finished jobs last updated more than ttl seconds ago; returns how many"""
+        cutoff = (now or time.time()) - ttl
+        rows = self._execute("SELECT id FROM jobs WHERE status IN (?, ?, ?) AND updated < ?", (*FINISHED, cutoff))
+        for row in rows:
+            shutil.rmtree(os.path.join(self.folder, row['id']), ignore_errors=True)
+            self._execute("DELETE FROM jobs WHERE id = ?", (row['id'],))
+        return len(rows)
+
+    def save_progress(self, job):
+        self._execute(
+            "UPDATE jobs SET progress_done = ?, progress_total = ?, progress_unit = ?, updated = ? WHERE id = ?",
+            (job.done, job.total, job.unit, time.time(), job.job_id),
+        )
+
+    # Control
+    def is_cancel_requested(self, job_id):
+        rows = self._execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,))
+        return bool(rows and rows[0]['cancel_requested'])
+
+    def cancel(self, job_id):
+        """
+        Cancels a queued job, or asks a running job to stop at its next progress
+        report, whichever server process runs it. Returns the job afterwards.
+        """
+        now = time.time()
+        with self._db_lock, self._db:
+            queued = self._db.execute(
+                "UPDATE jobs SET status = ?, cancel_requested = 1, form = '[]', updated = ? "
+                "WHERE id = ? AND status = ?", (CANCELLED, now, job_id, QUEUED)).rowcount
+            if not queued:
+                self._db.execute("UPDATE jobs SET cancel_requested = 1, updated = ? WHERE id = ? AND status = ?",
+                                 (now, job_id, RUNNING))
+        if queued:
+            self._secret_forms.pop(job_id, None)
+            shutil.rmtree(os.path.join(self.folder, job_id), ignore_errors=True)
+        return self.get(job_id)
+
+    def get(self, job_id):
+        """Returns the job as a dict, with live progress for running jobs"""
+        rows = self._execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        if not rows:
+            return None
+        row = rows[0]
+        job = {
+            'jobId': row['id'],
+            'kind': row['kind'],
+            'status': row['status'],
+            'progress': {
+                'done': row['progress_done'],
+                'total': row['progress_total'],
+                'unit': row['progress_unit'],
+            },
+            'result': json.loads(row['result']) if row['result'] else None,
+            'error': row['error'],
+            'created': row['created'],
+            'updated': row['updated'],
+        }
+        live = self._live.get(job_id)
+        if live is not None:
+            job['progress'] = {'done': live.done, 'total': live.total, 'unit': live.unit}
+        if row['cancel_requested'] and job['status'] == RUNNING:
+            job['cancelRequested'] = True
+        return job
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_job_manager(resume=True):
+    """
+    Returns the process-wide job manager, resuming persisted jobs on first use.
+    Of several server processes sharing the job folder only one should resume.
+    """
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                manager = JobManager(workers=int(os.getenv("JOB_WORKERS", "2")))
+                if resume:
+                    manager.resume()
+                _manager = manager
+    return _manager
+
+
+def submit_job(kind, form, files):
+    """Queues a request as a background job and returns the 202 payload"""
+    job_id = get_job_manager().submit(kind, form, files)
+    return {
+        'jobId': job_id,
+        'status': QUEUED,
+        'statusUrl': f"/jobs/{job_id}",
+        'resultUrl': f"/jobs/{job_id}/result",
+    }, 202
+
+
+def job_result_path(job):
+    """Picks the output file of a finished job, if it produced one"""
+    result = job.get('result') or {}
+    candidates = [result.get('output')]
+    for entry in result.get('files', []):
+        candidates.extend([entry.get('encryptedPath'), entry.get('decryptedPath')])
+    for path in candidates:
+        if path and os.path.isfile(path):
+            return path
+    return None
@@ -0,0 +1,241 @@
+import os
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from core.tracing import span, get_logger
+
+# -----------------------------
+# Process-wide metrics with Prometheus text exposition (served on /metrics).
+# Recording is a dict lookup plus a few additions under a per-metric lock, so it
+# is cheap enough for hot paths; handlers should still record per row/page batch
+# rather than per value. Label values are fixed at the call site (stage names,
+# backend names, endpoints) to keep cardinality bounded.
+# -----------------------------
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(11))  # 1 KB .. 1 GB
+
+logger = get_logger('metrics')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base class; values are kept per tuple of label values"""
+
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {labels}")
+        return tuple(labels[name] for name in self.labelnames)
+
+    def samples(self):
+        """Yields (suffix, label values, extra label, value) tuples"""
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, values, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, values, extra)} {_format_value(value)}")
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield '', key, None, value
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield '', key, None, value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (non-cumulative) counts, then sum and count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, (list(state[0]), state[1], state[2])) for key, state in self._values.items()]
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                yield '_bucket', key, ('le', _format_value(float(bound))), cumulative
+            yield '_sum', key, None, total
+            yield '_count', key, None, count
+
+
+class CallbackMetric(Metric):
+    """Metric read at scrape time from fn(), which returns {label values tuple: value}"""
+
+    def __init__(self, name, documentation, kind, fn, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.kind = kind
+        self.fn = fn
+
+    def samples(self):
+        for key, value in (self.fn() or {}).items():
+            yield '', key, None, value
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """Adds a metric, returning the existing one if the name is already registered"""
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        blocks = []
+        for metric in metrics:
+            try:
+                blocks.append(metric.render())
+            except Exception as e:
+                logger.warning("Rendering metric %s failed: %s", metric.name, e)
+        return '\n'.join(blocks) + '\n'
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def counter(name, documentation, labelnames=()):
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name, documentation, labelnames=()):
+    return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+def callback(name, documentation, kind, fn, labelnames=()):
+    return REGISTRY.register(CallbackMetric(name, documentation, kind, fn, labelnames))
+
+
+def render():
+    """Prometheus text exposition of every registered metric"""
+    return REGISTRY.render()
+
+
+# Metrics shared across modules
+STAGE_SECONDS = histogram('obscura_stage_seconds', 'Time spent in each pipeline stage', ['stage'])
+HTTP_REQUEST_SECONDS = histogram('obscura_http_request_seconds', 'HTTP request latency',
+                                 ['endpoint', 'method', 'status'])
+ROWS_PROCESSED = counter('obscura_rows_processed_total', 'CSV rows masked or obfuscated')
+PAGES_PROCESSED = counter('obscura_pages_processed_total', 'PDF pages searched and redacted')
+BYTES_ENCRYPTED = counter('obscura_bytes_encrypted_total', 'Plaintext bytes encrypted')
+BYTES_DECRYPTED = counter('obscura_bytes_decrypted_total', 'Plaintext bytes produced by decryption')
+UPLOAD_BYTES = histogram('obscura_upload_bytes', 'Request body sizes', buckets=SIZE_BUCKETS)
+EXECUTION_PLANS = counter('obscura_execution_plans_total', 'Execution strategies picked by the planner',
+                          ['kind', 'strategy'])
+
+
+def resident_memory_bytes():
+    """Current resident set size of this process, or None where /proc is not available"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _resident_memory():
+    # Linux only; other platforms simply do not export the metric
+    rss = resident_memory_bytes()
+    return {(): rss} if rss is not None else {}
+
+
+callback('process_resident_memory_bytes', 'Resident memory size in bytes', 'gauge', _resident_memory)
+
+
+@contextmanager
+def stage(name):
+    """Times one pipeline stage into obscura_stage_seconds and records it as a trace span"""
+    with span(name), STAGE_SECONDS.time(stage=name):
+        yield
@@ -0,0 +1,228 @@
+import os
+import csv
+import threading
+
+from core.metrics import EXECUTION_PLANS, resident_memory_bytes
+from core.tracing import get_logger
+
+# -----------------------------
+# Execution planner for the mask handlers. The input is inspected cheaply (size,
+# header, a sampled block of rows, PDF page count) and a strategy is picked that
+# fits the per-job memory budget and core allowance:
+#   in_memory  whole file in one dataframe (the original path)
+#   chunked    fixed-size row chunks read, masked and written one at a time
+#   parallel   chunks rendered on a process pool, for files big enough to pay
+#              for the process start-up and the pickling
+# The plan, and the peak RSS sampled while the job ran, go into the response.
+# An in-memory run that overshoots the budget after parsing falls back to
+# chunked. PDFs are always processed in memory (PyMuPDF loads pages lazily);
+# their plan only records the estimate. Settings (environment):
+#   MEMORY_BUDGET_MB    memory one job may use (default 1024)
+#   PLAN_CORES          cores one job may use (default: number of cores)
+#   PARALLEL_MIN_ROWS   estimated rows from which CSVs go process-parallel (default 1000000)
+#   CSV_CHUNK_ROWS      upper bound for rows per chunk (default 50000)
+# -----------------------------
+
+IN_MEMORY = 'in_memory'
+CHUNKED = 'chunked'
+PARALLEL = 'parallel'
+
+SAMPLE_BYTES = 64 * 1024
+# Resident bytes per parsed CSV cell, measured on string columns with the
+# dataframe and its masked copy both alive
+CSV_CELL_BYTES = 150
+# Resident bytes per input byte of a PDF open in PyMuPDF, plus per page
+PDF_BYTES_FACTOR = 3
+PDF_PAGE_BYTES = 512 * 1024
+MIN_CHUNK_ROWS = 1000
+RSS_SAMPLE_INTERVAL = 0.02
+
+logger = get_logger('planner')
+
+
+def memory_budget():
+    return int(float(os.getenv("MEMORY_BUDGET_MB", "1024")) * 1024 * 1024)
+
+
+def core_allowance():
+    return max(1, int(os.getenv("PLAN_CORES", str(os.cpu_count() or 1))))
+
+
+class ExecutionPlan:
+    """Strategy picked for one job, with the inputs that led to it and what the run used"""
+
+    def __init__(self, kind, strategy, reason, estimated_bytes, budget_bytes, chunk_rows=None, workers=1,
+                 inputs=None):
+        self.kind = kind
+        self.strategy = strategy
+        self.reason = reason
+        self.estimated_bytes = estimated_bytes
+        self.budget_bytes = budget_bytes
+        self.chunk_rows = chunk_rows
+        self.workers = workers
+        self.inputs = inputs or {}
+        self.fallback = None
+        self.peak_rss_bytes = None
+        self.baseline_rss_bytes = resident_memory_bytes()
+        EXECUTION_PLANS.inc(kind=kind, strategy=strategy)
+
+    def over_budget(self):
+        """Whether the process grew by more than the budget since the plan was made"""
+        rss = resident_memory_bytes()
+        if rss is None or self.baseline_rss_bytes is None:
+            return False
+        return rss - self.baseline_rss_bytes > self.budget_bytes
+
+    def fall_back(self, strategy, reason, chunk_rows):
+        logger.warning("Falling back from %s to %s: %s", self.strategy, strategy, reason)
+        self.fallback = {'from': self.strategy, 'reason': reason}
+        self.strategy = strategy
+        self.chunk_rows = chunk_rows
+        EXECUTION_PLANS.inc(kind=self.kind, strategy=strategy)
+
+    def to_dict(self):
+        return {
+            'kind': self.kind,
+            'strategy': self.strategy,
+            'reason': self.reason,
+            'estimatedBytes': self.estimated_bytes,
+            'budgetBytes': self.budget_bytes,
+            'chunkRows': self.chunk_rows,
+            'workers': self.workers,
+            'inputs': self.inputs,
+            'fallback': self.fallback,
+            'peakRssBytes': self.peak_rss_bytes,
+        }
+
+
+def inspect_csv(source):
+    """
+    Size, column count and estimated row count of a CSV string or seekable
+    stream, from its first SAMPLE_BYTES. The stream position is restored.
+    """
+    if isinstance(source, str):
+        size = len(source)
+        sample = source[:SAMPLE_BYTES]
+    else:
+        position = source.tell()
+        size = source.seek(0, os.SEEK_END)
+        source.seek(0)
+        sample = source.read(SAMPLE_BYTES)
+        source.seek(position)
+        if isinstance(sample, bytes):
+            sample = sample.decode('utf-8', errors='replace')
+
+    # The last line of a partial sample is cut off
+    lines = sample.splitlines(keepends=True)
+    if len(sample) < size and len(lines) > 1:
+        lines = lines[:-1]
+    header = next(csv.reader(lines[:1]), [])
+    rows = lines[1:]
+    if rows:
+        row_bytes = sum(len(line) for line in rows) / len(rows)
+        estimated_rows = int((size - len(lines[0])) / row_bytes) if row_bytes else 0
+    else:
+        row_bytes = 0
+        estimated_rows = 0
+    return {
+        'sizeBytes': size,
+        'columns': len(header),
+        'sampledRows': len(rows),
+        'rowBytes': round(row_bytes, 1),
+        'estimatedRows': estimated_rows,
+    }
+
+
+def plan_csv(info, obfuscating=False, backend=None, budget=None, cores=None):
+    """Picks in_memory, chunked or parallel for a CSV described by inspect_csv()"""
+    budget = budget if budget is not None else memory_budget()
+    cores = cores if cores is not None else core_allowance()
+    inputs = dict(info, obfuscating=obfuscating, backend=backend)
+    # A local model needs the cores itself while it obfuscates
+    if obfuscating and backend == 'local':
+        cores = 1
+
+    row_bytes = max(1, info['columns']) * CSV_CELL_BYTES
+    estimated = info['estimatedRows'] * row_bytes
+    parallel_min = int(os.getenv("PARALLEL_MIN_ROWS", "1000000"))
+
+    if cores > 1 and info['estimatedRows'] >= parallel_min:
+        # Up to two chunks per worker are in flight besides the one being read
+        chunk_rows = max(MIN_CHUNK_ROWS, min(max_chunk_rows(), budget // (row_bytes * (2 * cores + 1))))
+        return ExecutionPlan('csv', PARALLEL, f"about {info['estimatedRows']} rows with {cores} cores",
+                             estimated, budget, chunk_rows, cores, inputs)
+    if estimated <= budget:
+        return ExecutionPlan('csv', IN_MEMORY, "estimate fits the memory budget", estimated, budget,
+                             inputs=inputs)
+    return ExecutionPlan('csv', CHUNKED, "estimate exceeds the memory budget", estimated, budget,
+                         chunked_rows(info['columns'], budget), 1, inputs)
+
+
+def max_chunk_rows():
+    return int(os.getenv("CSV_CHUNK_ROWS", "50000"))
+
+
+def chunked_rows(columns, budget=None):
+    """Rows per chunk when a chunk and its masked copy must fit the budget"""
+    budget = budget if budget is not None else memory_budget()
+    return max(MIN_CHUNK_ROWS, min(max_chunk_rows(), budget // (2 * max(1, columns) * CSV_CELL_BYTES)))
+
+
+def inspect_pdf(source):
+    """Size and page count of a PDF given as bytes, memoryview or seekable stream (runs on the PDF worker)"""
+    import fitz
+
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    size = source.getbuffer().nbytes if hasattr(source, 'getbuffer') else memoryview(source).nbytes
+    doc = fitz.open(stream=source, filetype="pdf")
+    try:
+        pages = len(doc)
+    finally:
+        doc.close()
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    return {'sizeBytes': size, 'pages': pages}
+
+
+def plan_pdf(info, budget=None):
+    budget = budget if budget is not None else memory_budget()
+    estimated = info['sizeBytes'] * PDF_BYTES_FACTOR + info['pages'] * PDF_PAGE_BYTES
+    reason = "PDFs are processed in memory"
+    if estimated > budget:
+        reason += "; estimate exceeds the memory budget"
+    return ExecutionPlan('pdf', IN_MEMORY, reason, estimated, budget, inputs=info)
+
+
+class RssMonitor:
+    """
+    Samples the process RSS on a background thread while a job runs and keeps
+    the peak. RSS is process-wide, so concurrent jobs show up in each other's
+    peaks.
+    """
+
+    def __init__(self, interval=RSS_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.peak = resident_memory_bytes()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stopped.wait(self.interval):
+            rss = resident_memory_bytes()
+            if rss is not None and (self.peak is None or rss > self.peak):
+                self.peak = rss
+
+    def __enter__(self):
+        if self.peak is not None:
+            self._thread = threading.Thread(target=self._sample, name="rss-monitor", daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        rss = resident_memory_bytes()
+        if rss is not None and (self.peak is None or rss > self.peak):
+            self.peak = rss
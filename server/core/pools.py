@@ -0,0 +1,90 @@
+import os
+import asyncio
+import threading
+import contextvars
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+from core.profiling import current_profile
+
+# -----------------------------
+# Executors for blocking work called from async handlers, so CPU-bound steps
+# (pandas, AES, PyMuPDF) never run on the event loop itself.
+#   CPU_WORKERS      size of the general CPU pool (default: number of cores)
+#   PROCESS_WORKERS  size of the process pool for process-parallel jobs (default: number of cores)
+# -----------------------------
+
+cpu_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv("CPU_WORKERS", str(os.cpu_count() or 4))),
+    thread_name_prefix="cpu",
+)
+
+# PyMuPDF is not thread-safe, so every fitz call goes through this single worker
+pdf_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pdf")
+
+
+async def run_in_pool(pool, func, *args, **kwargs):
+    """
+    Runs a blocking function on pool with the caller's context variables
+    (current job, trace span) carried over to the worker thread. Work for a
+    profiled request runs under its own profiler.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    session = current_profile()
+    if session is not None:
+        func = partial(session.run_profiled, func)
+    return await loop.run_in_executor(pool, partial(context.run, func, *args, **kwargs))
+
+
+async def run_cpu(func, *args, **kwargs):
+    """Runs a blocking function on the CPU pool"""
+    return await run_in_pool(cpu_pool, func, *args, **kwargs)
+
+
+async def run_pdf(func, *args, **kwargs):
+    """Runs a blocking PyMuPDF function on the dedicated PDF worker"""
+    return await run_in_pool(pdf_pool, func, *args, **kwargs)
+
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def get_process_pool():
+    """
+    Process pool for CPU-bound work large enough to pay for pickling its inputs,
+    started on first use. Workers are spawned rather than forked, so they do not
+    inherit the server's threads and locks.
+    """
+    global _process_pool
+    if _process_pool is None:
+        with _process_pool_lock:
+            if _process_pool is None:
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+
+                _process_pool = ProcessPoolExecutor(
+                    max_workers=int(os.getenv("PROCESS_WORKERS", str(os.cpu_count() or 4))),
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _process_pool
+
+
+async def run_process(func, *args, **kwargs):
+    """Runs a picklable module-level function on the process pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_process_pool(), partial(func, *args, **kwargs))
+
+
+def run_sync(coro):
+    """
+    Runs a coroutine to completion from synchronous code (e.g. a Flask view),
+    reusing the thread's event loop or creating one if the thread has none.
+    """
+    try:
+        loop = asyncio.get_event_loop()
+    except RuntimeError:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+    return loop.run_until_complete(coro)
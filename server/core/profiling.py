@@ -0,0 +1,214 @@
+import os
+import re
+import json
+import time
+import uuid
+import pstats
+import cProfile
+import threading
+import contextvars
+import tracemalloc
+
+import settings
+from core.tracing import get_logger
+
+# -----------------------------
+# Opt-in profiling of single requests, for reproducing a slow customer file on
+# the server itself. A request asks for it with the X-Profile header or the
+# profile query parameter; the server then runs it under cProfile (including
+# the work it hands to core.pools) and tracemalloc, and keeps the result under
+# profiles/<profile id> for download; the id is generated by the server and
+# returned in X-Profile-Id. Settings (environment):
+#   PROFILING         1 to honour profiling requests (default off)
+#   PROFILING_TOKEN   when set, the flag's value must equal it
+#   PROFILE_TTL       seconds profile artifacts are kept (default 7 days)
+# On the ASGI server the event loop is shared, so a profile also contains
+# whatever other requests ran on the loop at the same time. tracemalloc is
+# process-wide too: a profile that overlapped another one has no peak of its
+# own and is marked tracemallocShared.
+# -----------------------------
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_PARAM = 'profile'
+PROFILE_ID_HEADER = 'X-Profile-Id'
+TOP_FUNCTIONS = 40
+TOP_ALLOCATIONS = 25
+
+_active = contextvars.ContextVar("active_profile", default=None)
+_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+# tracemalloc is process-wide; it runs while at least one profile is open
+_tracemalloc_sessions = set()
+_tracemalloc_lock = threading.Lock()
+
+logger = get_logger('profiling')
+
+
+def profiling_enabled():
+    return os.getenv("PROFILING", "").lower() in ("1", "true", "yes")
+
+
+def profile_requested(flag):
+    """Whether a header/query flag value asks for a profile this server may take"""
+    if not flag or not profiling_enabled():
+        return False
+    token = os.getenv("PROFILING_TOKEN")
+    if token:
+        return flag == token
+    return flag.lower() in ("1", "true", "yes")
+
+
+def _acquire_tracemalloc(session):
+    with _tracemalloc_lock:
+        if _tracemalloc_sessions:
+            # The peak now covers both sessions; resetting it would cut the other one's short
+            session.tracemalloc_shared = True
+            for other in _tracemalloc_sessions:
+                other.tracemalloc_shared = True
+        else:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        _tracemalloc_sessions.add(session)
+
+
+def _release_tracemalloc(session):
+    """Returns (current, peak) traced bytes as seen by the session before it leaves"""
+    with _tracemalloc_lock:
+        current, peak = tracemalloc.get_traced_memory()
+        _tracemalloc_sessions.discard(session)
+        if not _tracemalloc_sessions:
+            tracemalloc.stop()
+        return current, peak
+
+
+class ProfileSession:
+    """
+    Profiles one request: a profiler on the request's own thread plus one per
+    task it runs on the worker pools, merged when the request finishes.
+    """
+
+    def __init__(self, name, trace_id=None):
+        # Artifacts are named by the server; the client's trace id is only recorded
+        self.profile_id = uuid.uuid4().hex
+        self.trace_id = trace_id
+        self.name = name
+        self.profiler = cProfile.Profile()
+        self.worker_profiles = []
+        self.worker_seconds = 0.0
+        self._lock = threading.Lock()
+        self._token = None
+        self._wall_start = None
+        self._cpu_start = None
+        self.main_thread_profiled = True
+        self.tracemalloc_shared = False
+
+    def start(self):
+        _acquire_tracemalloc(self)
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.process_time()
+        try:
+            self.profiler.enable()
+        except ValueError:
+            # Another profile already owns this thread (e.g. the shared event loop)
+            self.main_thread_profiled = False
+        self._token = _active.set(self)
+        return self
+
+    def run_profiled(self, func, *args, **kwargs):
+        """Runs func on a worker thread under its own profiler"""
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            profiler.enable()
+        except ValueError:
+            return func(*args, **kwargs)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.disable()
+            with self._lock:
+                self.worker_profiles.append(profiler)
+                self.worker_seconds += time.perf_counter() - start
+
+    def finish(self, status=None):
+        """Stops profiling and writes the artifacts; returns the summary"""
+        if self.main_thread_profiled:
+            self.profiler.disable()
+        wall = time.perf_counter() - self._wall_start
+        cpu = time.process_time() - self._cpu_start
+        try:
+            _active.reset(self._token)
+        except ValueError:
+            pass
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        current, peak = _release_tracemalloc(self)
+        if self.tracemalloc_shared:
+            peak = None
+
+        with self._lock:
+            profiles = ([self.profiler] if self.main_thread_profiled else []) + self.worker_profiles
+        summary = {
+            'profileId': self.profile_id,
+            'traceId': self.trace_id,
+            'name': self.name,
+            'status': status,
+            'created': time.time(),
+            'wallSeconds': wall,
+            'cpuSeconds': cpu,
+            'workerSeconds': self.worker_seconds,
+            'workerTasks': len(self.worker_profiles),
+            'tracemallocPeakBytes': peak,
+            'tracemallocCurrentBytes': current,
+            'tracemallocShared': self.tracemalloc_shared,
+            'topAllocations': [
+                {'location': str(stat.traceback[0]), 'bytes': stat.size, 'count': stat.count}
+                for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]
+            ],
+            'topFunctions': [],
+        }
+        os.makedirs(settings.PROFILES_FOLDER, exist_ok=True)
+        if profiles:
+            stats = pstats.Stats(*profiles)
+            stats.dump_stats(profile_path(self.profile_id, 'pstats'))
+            summary['topFunctions'] = _top_functions(stats)
+        with open(profile_path(self.profile_id, 'json'), 'w', encoding='utf-8') as f:
+            json.dump(summary, f)
+        logger.info("Profiled %s in %.3fs (peak %s bytes traced), saved as %s",
+                    self.name, wall, 'shared' if peak is None else peak, self.profile_id)
+        return summary
+
+
+def _top_functions(stats):
+    rows = []
+    for (filename, line, func), (calls, primitive, tottime, cumtime, _) in stats.stats.items():
+        rows.append({
+            'function': f"{filename}:{line}({func})",
+            'calls': calls,
+            'primitiveCalls': primitive,
+            'totalSeconds': tottime,
+            'cumulativeSeconds': cumtime,
+        })
+    rows.sort(key=lambda r: r['cumulativeSeconds'], reverse=True)
+    return rows[:TOP_FUNCTIONS]
+
+
+def current_profile():
+    return _active.get()
+
+
+def profile_path(profile_id, kind):
+    """Artifact path for a profile id; kind is 'json' (summary) or 'pstats'"""
+    suffix = '.prof' if kind == 'pstats' else '.json'
+    return os.path.join(settings.PROFILES_FOLDER, f"{profile_id}{suffix}")
+
+
+def find_profile(profile_id, kind='json'):
+    """Path of a stored artifact, or None if there is none for that profile id"""
+    if not _ID_PATTERN.match(profile_id or ''):
+        return None
+    path = profile_path(profile_id, kind)
+    return path if os.path.isfile(path) else None
@@ -0,0 +1,194 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import settings
+from core import metrics
+from core.tracing import get_logger
+
+# -----------------------------
+# Content-addressed cache of mask results. A request's key covers the uploaded
+# bytes, the normalized field configuration and the LLM backend; a hit returns
+# the earlier output as long as that file is still there, unchanged. The index
+# is bounded by the total size of the outputs it points at and kept on disk so
+# it survives restarts. Settings (environment):
+#   RESULT_CACHE              1/0 to enable or disable (default enabled)
+#   RESULT_CACHE_MAX_BYTES    output bytes the index may point at (default 5 GB)
+#   RESULT_CACHE_ENTRIES      maximum number of entries (default 1024)
+# Requests can skip the cache with the form field noCache=true.
+# -----------------------------
+
+# Bump when the masking pipeline changes so old results are not served
+PIPELINE_VERSION = 1
+HASH_CHUNK_SIZE = 1024 * 1024
+DEFAULT_INDEX_PATH = os.path.join(settings.BASE_DIR, "cache", "results.json")
+
+logger = get_logger('resultcache')
+
+
+def is_no_cache(form):
+    """Whether the client asked to bypass the result cache"""
+    return form.get('noCache', '').lower() in ('1', 'true', 'yes')
+
+
+def normalize_headers(headers):
+    """Canonical JSON for a field configuration, so key order and spacing do not matter"""
+    if isinstance(headers, str):
+        try:
+            headers = json.loads(headers)
+        except ValueError:
+            return headers
+    return json.dumps(headers, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+
+
+def result_cache_key(kind, stream, headers, filename, output_path, backend, extra=None):
+    """
+    Hashes the upload stream (then rewinds it) together with everything else that
+    shapes the output; extra holds further JSON inputs, e.g. a PDF's scanned values
+    """
+    digest = hashlib.sha256()
+    stream.seek(0)
+    for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    stream.seek(0)
+    params = [PIPELINE_VERSION, kind, normalize_headers(headers), filename, output_path, backend]
+    if extra is not None:
+        params.append(extra)
+    params = json.dumps(params, sort_keys=True)
+    digest.update(params.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """LRU index from request key to a previous response and the output it names"""
+
+    def __init__(self, index_path=DEFAULT_INDEX_PATH, max_bytes=5 * 1024 * 1024 * 1024, max_entries=1024):
+        self.index_path = index_path
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return
+        for key, entry in entries:
+            self._entries[key] = entry
+            self._bytes += entry['size']
+
+    def _save(self):
+        data = json.dumps(list(self._entries.items()), ensure_ascii=False)
+        try:
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            temp_path = f"{self.index_path}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(temp_path, self.index_path)
+        except OSError as e:
+            logger.warning("Result cache index write failed: %s", e)
+
+    def get(self, key):
+        """Returns the cached response payload, or None if missing or its output changed"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                try:
+                    st = os.stat(entry['payload']['output'])
+                    valid = st.st_size == entry['size'] and st.st_mtime == entry['mtime']
+                except OSError:
+                    valid = False
+                if valid:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return dict(entry['payload'])
+                # Swept or overwritten by a later request
+                self._drop(key)
+                self._save()
+            self.misses += 1
+            return None
+
+    def put(self, key, payload):
+        """Remembers a successful response; payload['output'] must be the output file"""
+        try:
+            st = os.stat(payload['output'])
+        except OSError:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = {
+                'payload': payload,
+                'size': st.st_size,
+                'mtime': st.st_mtime,
+                'created': time.time(),
+            }
+            self._bytes += st.st_size
+            while self._entries and (self._bytes > self.max_bytes or len(self._entries) > self.max_entries):
+                self._drop(next(iter(self._entries)))
+            self._save()
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry['size']
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._save()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """Returns the process-wide result cache, or None when RESULT_CACHE is disabled"""
+    global _cache
+    if os.getenv("RESULT_CACHE", "1").lower() in ("0", "false", "no"):
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResultCache(
+                    max_bytes=int(os.getenv("RESULT_CACHE_MAX_BYTES", str(5 * 1024 * 1024 * 1024))),
+                    max_entries=int(os.getenv("RESULT_CACHE_ENTRIES", "1024")),
+                )
+    return _cache
+
+
+def _cache_lookups():
+    if _cache is None:
+        return {}
+    return {('hit',): _cache.hits, ('miss',): _cache.misses}
+
+
+def _cache_hit_ratio():
+    return {(): _cache.stats()['hit_ratio']} if _cache is not None else {}
+
+
+metrics.callback('obscura_result_cache_lookups_total', 'Mask result cache lookups by result', 'counter',
+                 _cache_lookups, ['result'])
+metrics.callback('obscura_result_cache_hit_ratio', 'Share of mask requests answered from the result cache', 'gauge',
+                 _cache_hit_ratio)
@@ -0,0 +1,144 @@
+import os
+import time
+import fnmatch
+import threading
+
+import settings
+from core.tracing import get_logger
+
+# -----------------------------
+# Result store housekeeping. Downloads no longer delete results, so a background
+# sweeper removes files past their TTL and trims each folder to its size quota,
+# oldest first. Settings (environment):
+#   RESULT_TTL              seconds secured_files, mask outputs and finished job records are kept (default 24h)
+#   RESULT_MAX_BYTES        size quota for each of those folders (default 10 GB)
+#   TEMP_UPLOAD_TTL         seconds leftovers in temp_uploads are kept (default 1h)
+#   RESULT_SWEEP_INTERVAL   seconds between sweeps (default 5 minutes, 0 disables)
+# -----------------------------
+
+KEEP_FILES = {'.gitkeep'}
+
+logger = get_logger('results')
+
+
+class SweepTarget:
+    """A folder with a TTL and size quota; pattern limits which files are managed"""
+
+    def __init__(self, folder, ttl, max_bytes=None, pattern=None):
+        self.folder = folder
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.pattern = pattern
+
+    def files(self):
+        try:
+            names = os.listdir(self.folder)
+        except OSError:
+            return []
+        entries = []
+        for name in names:
+            if name in KEEP_FILES or (self.pattern and not fnmatch.fnmatch(name, self.pattern)):
+                continue
+            path = os.path.join(self.folder, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if os.path.isfile(path):
+                entries.append((path, st.st_size, st.st_mtime))
+        return entries
+
+    def sweep(self, now=None):
+        """Removes expired files, then the oldest ones until the folder fits its quota"""
+        now = now or time.time()
+        entries = sorted(self.files(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for path, size, mtime in entries:
+            expired = self.ttl and now - mtime > self.ttl
+            over_quota = self.max_bytes is not None and total > self.max_bytes
+            if not expired and not over_quota:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                # Still open (e.g. mid-download on Windows); try again next sweep
+                continue
+            total -= size
+            removed += 1
+        return removed
+
+
+class JobRecords:
+    """Finished background jobs, whose records are deleted once their results have expired"""
+
+    def __init__(self, ttl):
+        self.folder = settings.JOBS_FOLDER
+        self.ttl = ttl
+
+    def sweep(self, now=None):
+        from core.jobs import get_job_manager
+
+        return get_job_manager(resume=False).purge(self.ttl, now) if self.ttl else 0
+
+
+def default_targets():
+    ttl = float(os.getenv("RESULT_TTL", str(24 * 3600)))
+    max_bytes = int(os.getenv("RESULT_MAX_BYTES", str(10 * 1024 * 1024 * 1024)))
+    return [
+        SweepTarget(settings.SECURED_FILES_FOLDER, ttl, max_bytes),
+        # The mask output folder is also the client's public folder; only touch our outputs
+        SweepTarget(settings.MASK_OUTPUT_FOLDER, ttl, max_bytes, pattern='*-output.*'),
+        SweepTarget(settings.UPLOAD_FOLDER, float(os.getenv("TEMP_UPLOAD_TTL", "3600"))),
+        SweepTarget(settings.PROFILES_FOLDER, float(os.getenv("PROFILE_TTL", str(7 * 24 * 3600)))),
+        JobRecords(ttl),
+    ]
+
+
+class ResultSweeper(threading.Thread):
+    """Daemon thread that sweeps the result folders every interval seconds"""
+
+    def __init__(self, targets, interval):
+        super().__init__(name="result-sweeper", daemon=True)
+        self.targets = targets
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            self.sweep()
+            self._stopped.wait(self.interval)
+
+    def sweep(self):
+        for target in self.targets:
+            try:
+                removed = target.sweep()
+            except Exception as e:
+                logger.warning("Sweeping %s failed: %s", target.folder, e)
+                continue
+            if removed:
+                logger.info("Removed %d expired files from %s", removed, target.folder)
+
+    def stop(self):
+        self._stopped.set()
+
+
+_sweeper = None
+_sweeper_lock = threading.Lock()
+
+
+def start_sweeper():
+    """Starts the process-wide sweeper once; a no-op when RESULT_SWEEP_INTERVAL is 0"""
+    global _sweeper
+    interval = float(os.getenv("RESULT_SWEEP_INTERVAL", "300"))
+    with _sweeper_lock:
+        if _sweeper is None and interval > 0:
+            _sweeper = ResultSweeper(default_targets(), interval)
+            _sweeper.start()
+    return _sweeper
+
+
+def result_path(filename):
+    """Path of a downloadable result in secured_files, or None if it does not exist"""
+    path = os.path.join(settings.SECURED_FILES_FOLDER, os.path.basename(filename))
+    return path if os.path.isfile(path) else None
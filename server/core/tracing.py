@@ -0,0 +1,227 @@
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import logging
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+# -----------------------------
+# Structured logging and tracing. Each request (or background job) is a trace;
+# spans nest across controller, handler and LLM call through a context variable,
+# which core.pools carries into worker threads. Settings (environment):
+#   LOG_LEVEL           minimum level for obscura.* loggers (default INFO)
+#   LOG_FORMAT          text | json (default text)
+#   TRACE_SAMPLE_RATE   share of traces whose spans are recorded and whose
+#                       debug/info logs are emitted (default 1.0); warnings
+#                       and errors are always emitted
+#   TRACE_BUFFER_SPANS  finished spans kept for Chrome trace export (default 10000)
+#   TRACE_EXPORT        1 to serve the buffer on /traces (default off)
+# Every record passes through a formatter that redacts common PII patterns.
+# -----------------------------
+
+TRACE_HEADER = 'X-Trace-Id'
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_finished = deque(maxlen=int(os.getenv("TRACE_BUFFER_SPANS", "10000")))
+# Span timestamps are perf_counter based; this maps them onto wall-clock microseconds
+_EPOCH_OFFSET = time.time() - time.perf_counter()
+
+
+class Span:
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'attrs', 'sampled', 'start', 'end', 'thread')
+
+    def __init__(self, name, trace_id, parent_id, sampled, attrs):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.end = None
+        self.thread = threading.get_ident()
+
+
+def current_span():
+    return _current_span.get()
+
+
+def current_trace_id():
+    span = _current_span.get()
+    return span.trace_id if span is not None else None
+
+
+def start_trace(name, trace_id=None, **attrs):
+    """
+    Opens the root span of a new trace and makes it current. Returns (span, token)
+    for finish_span(); used where a with-block does not fit (request hooks).
+    """
+    sample_rate = float(os.getenv("TRACE_SAMPLE_RATE", "1"))
+    sampled = sample_rate >= 1 or random.random() < sample_rate
+    span = Span(name, trace_id or uuid.uuid4().hex, None, sampled, attrs)
+    return span, _current_span.set(span)
+
+
+def finish_span(span, token):
+    span.end = time.perf_counter()
+    try:
+        _current_span.reset(token)
+    except ValueError:
+        # Teardown ran in a different context than the one the span was opened in
+        pass
+    if span.sampled:
+        _finished.append(span)
+
+
+@contextmanager
+def trace(name, trace_id=None, **attrs):
+    """Runs the block as the root span of a new trace"""
+    span, token = start_trace(name, trace_id, **attrs)
+    try:
+        yield span
+    finally:
+        finish_span(span, token)
+
+
+@contextmanager
+def span(name, **attrs):
+    """
+    Runs the block as a child of the current span. Outside a trace, or in an
+    unsampled one, nothing is recorded and the cost is one context variable read.
+    """
+    parent = _current_span.get()
+    if parent is None or not parent.sampled:
+        yield parent
+        return
+    child = Span(name, parent.trace_id, parent.span_id, True, attrs)
+    token = _current_span.set(child)
+    try:
+        yield child
+    finally:
+        finish_span(child, token)
+
+
+def export_chrome_trace(trace_id=None):
+    """Finished spans (optionally of one trace) in the Chrome trace event format"""
+    pid = os.getpid()
+    events = []
+    for s in list(_finished):
+        if trace_id is not None and s.trace_id != trace_id:
+            continue
+        args = {'trace_id': s.trace_id, 'span_id': s.span_id, 'parent_id': s.parent_id}
+        args.update(s.attrs)
+        events.append({
+            'name': s.name,
+            'cat': s.name.split('_', 1)[0],
+            'ph': 'X',
+            'ts': (s.start + _EPOCH_OFFSET) * 1e6,
+            'dur': (s.end - s.start) * 1e6,
+            'pid': pid,
+            'tid': s.thread,
+            'args': args,
+        })
+    events.sort(key=lambda e: e['ts'])
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def write_chrome_trace(path, trace_id=None):
+    """Writes export_chrome_trace() to path, for chrome://tracing or Perfetto"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(export_chrome_trace(trace_id), f)
+    return path
+
+
+def trace_export_enabled():
+    return os.getenv("TRACE_EXPORT", "").lower() in ("1", "true", "yes")
+
+
+# -----------------------------
+# Logging
+# -----------------------------
+PII_PATTERNS = [
+    (re.compile(r'[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}'), '<email>'),
+    (re.compile(r'\b\d{3}-\d{2}-\d{4}\b'), '<ssn>'),
+    (re.compile(r'\b(?:\d[ -]?){13,16}\b'), '<card>'),
+    (re.compile(r'\(?\b\d{3}\)?[\s.-]?\d{3}[\s.-]?\d{4}\b'), '<phone>'),
+]
+
+
+def redact(text):
+    """Replaces emails, SSNs, card and phone numbers with placeholders"""
+    for pattern, placeholder in PII_PATTERNS:
+        text = pattern.sub(placeholder, text)
+    return text
+
+
+class TraceContextFilter(logging.Filter):
+    """Adds trace/span ids to records and drops debug/info records of unsampled traces"""
+
+    def filter(self, record):
+        span = _current_span.get()
+        record.trace_id = span.trace_id if span is not None else '-'
+        record.span_id = span.span_id if span is not None else '-'
+        if span is not None and not span.sampled and record.levelno < logging.WARNING:
+            return False
+        return True
+
+
+class RedactingFormatter(logging.Formatter):
+    """Text formatter that runs the final line (message and traceback) through redact()"""
+
+    def format(self, record):
+        return redact(super().format(record))
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with the message and traceback redacted"""
+
+    def format(self, record):
+        entry = {
+            'ts': record.created,
+            'level': record.levelname,
+            'logger': record.name,
+            'message': redact(record.getMessage()),
+            'trace_id': getattr(record, 'trace_id', '-'),
+            'span_id': getattr(record, 'span_id', '-'),
+        }
+        if record.exc_info:
+            entry['exc'] = redact(self.formatException(record.exc_info))
+        return json.dumps(entry, ensure_ascii=False)
+
+
+_configured = False
+_configure_lock = threading.Lock()
+
+
+def configure_logging():
+    """Sets up the obscura logger tree once, from LOG_LEVEL and LOG_FORMAT"""
+    global _configured
+    if _configured:
+        return
+    with _configure_lock:
+        if _configured:
+            return
+        handler = logging.StreamHandler(sys.stdout)
+        if os.getenv("LOG_FORMAT", "text").lower() == "json":
+            handler.setFormatter(JsonFormatter())
+        else:
+            handler.setFormatter(RedactingFormatter(
+                '%(asctime)s %(levelname)s %(name)s [%(trace_id)s] %(message)s'))
+        handler.addFilter(TraceContextFilter())
+        root = logging.getLogger('obscura')
+        root.addHandler(handler)
+        root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+        root.propagate = False
+        _configured = True
+
+
+def get_logger(name):
+    """Logger for a module, e.g. get_logger('pdfhandler') -> obscura.pdfhandler"""
+    configure_logging()
+    return logging.getLogger(f'obscura.{name}')
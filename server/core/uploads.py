@@ -0,0 +1,144 @@
+import os
+import mmap
+import shutil
+import threading
+from contextlib import contextmanager
+from tempfile import SpooledTemporaryFile
+
+import settings
+from core import metrics
+
+# -----------------------------
+# Upload handling. Request bodies are spooled to memory up to a threshold and
+# then to a temp file in UPLOAD_FOLDER; handlers get the seekable stream (or a
+# memory-mapped view of it) instead of a bytes copy. Byte budgets:
+#   MAX_UPLOAD_BYTES       per-request body limit, also used as MAX_CONTENT_LENGTH (413)
+#   UPLOAD_SPOOL_BYTES     per-file size kept in memory before spilling to disk
+#   UPLOAD_INFLIGHT_BYTES  total request bodies being handled at once (429)
+# -----------------------------
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(512 * 1024 * 1024)))
+UPLOAD_SPOOL_BYTES = int(os.getenv("UPLOAD_SPOOL_BYTES", str(8 * 1024 * 1024)))
+UPLOAD_INFLIGHT_BYTES = int(os.getenv("UPLOAD_INFLIGHT_BYTES", str(2 * 1024 * 1024 * 1024)))
+UPLOAD_RETRY_AFTER = 5  # seconds suggested to clients rejected with 429
+
+
+class UploadRejected(Exception):
+    """Raised before the body is read when an upload does not fit the byte budgets"""
+
+    def __init__(self, message, status, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class InflightBudget:
+    """Thread-safe count of request body bytes currently admitted"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self, nbytes):
+        with self._lock:
+            if self.in_flight and self.in_flight + nbytes > self.limit:
+                return False
+            self.in_flight += nbytes
+            return True
+
+    def release(self, nbytes):
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - nbytes)
+
+
+upload_budget = InflightBudget(UPLOAD_INFLIGHT_BYTES)
+metrics.callback('obscura_upload_inflight_bytes', 'Request body bytes currently admitted', 'gauge',
+                 lambda: {(): upload_budget.in_flight})
+
+
+def reserve_upload(content_length):
+    """
+    Admits a request body of content_length bytes against both budgets and
+    returns the number of bytes reserved; release them with release_upload().
+    Bodies of unknown length (chunked) reserve the full per-request limit.
+    """
+    if content_length:
+        metrics.UPLOAD_BYTES.observe(content_length)
+    if content_length is not None and content_length > MAX_UPLOAD_BYTES:
+        raise UploadRejected(f"Upload exceeds the {MAX_UPLOAD_BYTES} byte limit", 413)
+    nbytes = MAX_UPLOAD_BYTES if content_length is None else content_length
+    if nbytes and not upload_budget.try_acquire(nbytes):
+        raise UploadRejected("Server is busy with other uploads, try again later", 429,
+                             retry_after=UPLOAD_RETRY_AFTER)
+    return nbytes
+
+
+def release_upload(nbytes):
+    if nbytes:
+        upload_budget.release(nbytes)
+
+
+def spooled_stream_factory(total_content_length=None, content_type=None, filename=None,
+                           content_length=None):
+    """Stream factory for the multipart parsers: memory first, then a temp file"""
+    return SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES, mode="rb+", dir=settings.UPLOAD_FOLDER)
+
+
+def open_upload(storage):
+    """
+    Returns the upload as a seekable binary stream positioned at the start.
+    Streams that cannot seek are spooled first.
+    """
+    stream = storage.stream
+    if getattr(stream, 'seekable', lambda: False)():
+        stream.seek(0)
+        return stream
+    spooled = spooled_stream_factory()
+    shutil.copyfileobj(stream, spooled)
+    spooled.seek(0)
+    storage.stream = spooled
+    return spooled
+
+
+@contextmanager
+def mapped_upload(stream):
+    """
+    Yields a memoryview over a seekable upload stream without copying it:
+    in-memory spools expose their buffer, spools on disk are memory-mapped.
+    Nothing opened on the view may outlive the with block: fitz.open(stream=view)
+    reads the buffer in place without pinning it, and using that document after
+    the mapping is closed crashes the process. Close such documents inside the
+    block, or pass bytes(view) to anything that has to live longer.
+    """
+    # SpooledTemporaryFile wraps a BytesIO until it rolls over to a real file
+    raw = getattr(stream, '_file', stream)
+    if hasattr(raw, 'getbuffer'):
+        buffer = raw.getbuffer()
+        try:
+            yield buffer
+        finally:
+            try:
+                # Otherwise the BytesIO cannot be closed when the request ends
+                buffer.release()
+            except BufferError:
+                pass
+        return
+
+    raw.flush()
+    size = os.fstat(raw.fileno()).st_size
+    if size == 0:
+        yield memoryview(b'')
+        return
+    mapping = mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapping)
+    try:
+        yield view
+    finally:
+        try:
+            view.release()
+            mapping.close()
+        except BufferError:
+            # A Python object still exports the view (e.g. a slice of it); the mapping
+            # closes when that is collected. fitz documents do not count, see above
+            pass
@@ -1,39 +1,38 @@
-import requests
 import json
 import asyncio
-from pydantic import BaseModel, ValidationError
 from typing import List, Union, Optional
-from dotenv import load_dotenv
 import os
-import google.generativeai as genai
+from obfuscate.llmclient import get_client
+from obfuscate.llmcache import get_cache, cache_key
+from core.tracing import get_logger
 
-# Load environment variables
-load_dotenv(".env")
+logger = get_logger('chat')
 
-# Configure Google Generative AI
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+_response_format = None
 
-# Define the Pydantic model for expected output
-class ResponseFormat(BaseModel):
-    changed_names: List[str]
+def get_response_format():
+    """
+    Returns the Pydantic model for expected output. pydantic is slow to import,
+    so the model is built when the first response needs validating.
+    """
+    global _response_format
+    if _response_format is None:
+        from pydantic import BaseModel
+
+        class ResponseFormat(BaseModel):
+            changed_names: List[str]
+
+        _response_format = ResponseFormat
+    return _response_format
 
 # -----------------------------
-# Async Local or Gemini-based chat function
+# Prompt and response helpers
 # -----------------------------
-async def chatlocal_async(system, content, is_pdf=False):
+def build_obfuscation_prompt(system):
     """
-    Send prompt to AI model and return obfuscated data (async version).
-    
-    Args:
-        system (str): System instructions for obfuscation method
-        content (str): Comma-separated data to obfuscate
-        is_pdf (bool): Flag to indicate if this is a PDF processing request
-    
-    Returns:
-        str: Comma-separated string of obfuscated values or raw model output for PDF processing
+    Wraps a per-field instruction in the obfuscation system prompt.
     """
-    # Prompt system message
-    pro_system_prompt = (
+    return (
         "You are a data obfuscation tool that transforms values while preserving their general format and type. " +
         "Apply this specific transformation to each value: " + system + ". " +
         "Follow these rules strictly:\n" +
@@ -47,49 +46,131 @@ async def chatlocal_async(system, content, is_pdf=False):
         "Example response format: {'changed_names': ['completely_new_value1', 'completely_new_value2', 'completely_new_value3']}\n\n" +
         "Example: If original value is '549.9041', an acceptable obfuscated value would be '238.4517' or '872.3106', NOT '587.951054'"
     )
+
+class IncrementalArrayParser:
+    """
+    Incremental parser for the first JSON array in a model response. Text is fed in
+    as it streams; each array element is returned as soon as it closes. Code fences
+    and a wrapping {"changed_names": [...]} object are skipped naturally because
+    everything before the first '[' is ignored.
+    """
+
+    def __init__(self):
+        self.started = False
+        self.done = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._item = []
+
+    def feed(self, text):
+        """Consumes a chunk of text and returns the values completed by it"""
+        values = []
+        for ch in text:
+            if self.done:
+                break
+            if not self.started:
+                self.started = ch == '['
+                continue
+            if self._in_string:
+                self._item.append(ch)
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+            if ch == '"':
+                self._in_string = True
+            elif ch in '[{':
+                self._depth += 1
+            elif ch in ']}':
+                if self._depth == 0:
+                    self._finish_item(values)
+                    self.done = True
+                    break
+                self._depth -= 1
+            elif ch == ',' and self._depth == 0:
+                self._finish_item(values)
+                continue
+            self._item.append(ch)
+        return values
+
+    def _finish_item(self, values):
+        text = ''.join(self._item).strip()
+        self._item = []
+        if not text:
+            return
+        try:
+            value = json.loads(text)
+        except json.JSONDecodeError:
+            # Models sometimes use single quotes or bare words
+            value = text.strip('\'"')
+        values.append(value if isinstance(value, str) else json.dumps(value))
+
+# -----------------------------
+# Async Local or Gemini-based chat function
+# -----------------------------
+async def chatlocal_async(system, content, is_pdf=False):
+    """
+    Send prompt to AI model and return obfuscated data (async version).
+    
+    Args:
+        system (str): System instructions for obfuscation method
+        content (str): Comma-separated data to obfuscate
+        is_pdf (bool): Flag to indicate if this is a PDF processing request
+    
+    Returns:
+        str: Comma-separated string of obfuscated values or raw model output for PDF processing
+    """
+    # Prompt system message
+    pro_system_prompt = build_obfuscation_prompt(system)
     
-    async def call_gemini_model():
+    async def call_model():
         try:
-            # Initialize the Gemini model
-            model = genai.GenerativeModel('gemini-1.5-flash')
-            
             # Combine system prompt and content for context
             if is_pdf:
                 combined_prompt = f"{system}\n\nInput data: {content}"
             else:
                 combined_prompt = f"{pro_system_prompt}\n\nInput data: {content}"
             
-            # Run the blocking call in a thread pool
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(
-                None,
-                lambda: model.generate_content(combined_prompt)
-            )
+            # Identical (model, prompt, content) requests are served from the response cache
+            client = get_client()
+            cache = get_cache()
+            key = None
+            if cache is not None:
+                key = cache_key(client.backend.model, system if is_pdf else pro_system_prompt,
+                                content, {'is_pdf': is_pdf})
+                cached = cache.get(key)
+                if cached is not None:
+                    return cached
             
-            if not response or not hasattr(response, 'text'):
-                print("Received empty response from Gemini API")
-                return None
-                
-            return response.text
+            # Shared client: pooled model handle, rate limiting, timeouts and retries
+            output = await client.generate(combined_prompt)
+            if cache is not None and output:
+                cache.put(key, output)
+            return output
             
         except Exception as e:
-            print(f"Google Gemini API call failed: {e}")
+            logger.warning("LLM call failed: %s", e)
             return None
 
-    # Use Gemini model
-    raw_output = await call_gemini_model()
+    # Use the configured model backend
+    raw_output = await call_model()
     
     # Handle API failure
     if raw_output is None:
-        print("AI model returned no response, using original data")
+        logger.warning("AI model returned no response, using original data")
         return content
 
     # If this is a PDF processing request, return the raw output
     if is_pdf:
-        print(f"PDF processing mode, returning raw output: {raw_output[:100]}...")
+        logger.debug("PDF processing mode, returning raw output (%d characters)", len(raw_output))
         return raw_output
 
     # Try to parse the response as JSON into our ResponseFormat
+    from pydantic import ValidationError
     try:
         # Clean the output - sometimes AI returns code blocks or extra text
         if "```json" in raw_output:
@@ -113,16 +194,15 @@ async def chatlocal_async(system, content, is_pdf=False):
         
         # Handle the case where parsed_json is a list instead of a dict
         if isinstance(parsed_json, list):
-            print("Received JSON list instead of object, converting to compatible format")
+            logger.debug("Received JSON list instead of object, converting to compatible format")
             parsed_json = {"changed_names": parsed_json}
             
-        validated_data = ResponseFormat(**parsed_json)
+        validated_data = get_response_format()(**parsed_json)
         comma_separated_string = ",".join(validated_data.changed_names)
         return comma_separated_string
         
     except (json.JSONDecodeError, ValidationError) as e:
-        print(f"Error parsing model output: {e}")
-        print("Raw output:", raw_output)
+        logger.warning("Error parsing model output (%d characters): %s", len(raw_output), e)
         
         # Try to extract data from a malformed response
         if "changed_names" in raw_output:
@@ -141,6 +221,94 @@ async def chatlocal_async(system, content, is_pdf=False):
         # If all else fails, return the raw output
         return raw_output
 
+async def chatlocal_stream_async(system, content, max_tail_retries=2):
+    """
+    Streaming variant of chatlocal_async for obfuscation requests.
+    
+    Yields obfuscated values one at a time, in input order, as soon as each
+    element of the model's JSON array closes. If the stream breaks or the array
+    comes back short, only the unfinished tail of the input is requested again;
+    values still missing after the retries fall back to the originals.
+    
+    Args:
+        system (str): System instructions for obfuscation method
+        content (str): Comma-separated data to obfuscate
+        max_tail_retries (int): How many times to re-request the unfinished tail
+    """
+    values = content.split(',')
+    pro_system_prompt = build_obfuscation_prompt(system)
+    client = get_client()
+    
+    # Complete responses share the cache with chatlocal_async
+    cache = get_cache()
+    key = None
+    if cache is not None:
+        key = cache_key(client.backend.model, pro_system_prompt, content, {'is_pdf': False})
+        cached = cache.get(key)
+        if cached is not None:
+            parsed = IncrementalArrayParser().feed(cached)
+            if len(parsed) >= len(values):
+                for value in parsed[:len(values)]:
+                    yield value
+                return
+    
+    produced = 0
+    for attempt in range(max_tail_retries + 1):
+        tail = values[produced:]
+        prompt = f"{pro_system_prompt}\n\nInput data: {','.join(tail)}"
+        parser = IncrementalArrayParser()
+        raw_chunks = []
+        stream = client.stream(prompt)
+        try:
+            async for chunk in stream:
+                raw_chunks.append(chunk)
+                for value in parser.feed(chunk):
+                    if produced < len(values):
+                        produced += 1
+                        yield value
+                if parser.done:
+                    break
+        except Exception as e:
+            logger.warning("LLM stream failed after %d/%d values: %s", produced, len(values), e)
+        finally:
+            await stream.aclose()
+        
+        if produced >= len(values):
+            if attempt == 0 and cache is not None:
+                cache.put(key, ''.join(raw_chunks))
+            return
+        logger.info("Stream ended early, re-requesting the remaining %d values", len(values) - produced)
+    
+    # Fall back to the original values for whatever is still missing
+    for value in values[produced:]:
+        yield value
+
+async def obfuscate_values_async(instruction, values, batch_size=None):
+    """
+    Obfuscates many values with one instruction and returns {original: replacement}.
+    
+    Each distinct value is sent once, in batches of batch_size values per model call
+    (LLM_BATCH_VALUES, default 100), so the number of calls follows the number of
+    distinct values rather than how often or in how many files they occur. Values
+    the model does not return keep their original.
+    """
+    batch_size = batch_size or int(os.getenv("LLM_BATCH_VALUES", "100"))
+    distinct = [value for value in dict.fromkeys(values) if value != ""]
+    batches = [distinct[i:i + batch_size] for i in range(0, len(distinct), batch_size)]
+    
+    async def run(batch):
+        response = await chatlocal_async(instruction, ','.join(batch))
+        returned = [value.strip() for value in response.split(',')] if response else []
+        if len(returned) < len(batch):
+            logger.warning("Not enough obfuscated values returned (%d of %d)", len(returned), len(batch))
+        return {original: returned[i] if i < len(returned) else original for i, original in enumerate(batch)}
+    
+    replacements = {"": ""}
+    for mapping in await asyncio.gather(*(run(batch) for batch in batches)):
+        replacements.update(mapping)
+    logger.debug("Obfuscated %d distinct values in %d model calls", len(distinct), len(batches))
+    return replacements
+
 # Synchronous wrapper for backward compatibility
 def chatlocal(system, content, is_pdf=False):
     """
@@ -2,15 +2,27 @@ import csv
 import json
 import os
 import asyncio
-from io import StringIO
-import pandas as pd
-from typing import Dict, List, Any
+from collections import deque
+from contextlib import ExitStack
+from io import BytesIO, StringIO, TextIOWrapper
+from typing import Dict, List, Any, IO, Tuple, Union
+import settings
+from core.pools import run_cpu, run_process
+from core.planner import (IN_MEMORY, CHUNKED, PARALLEL, CSV_CELL_BYTES, ExecutionPlan, inspect_csv, plan_csv,
+                          chunked_rows, memory_budget)
+from core.jobs import report_progress
+from core.metrics import stage, ROWS_PROCESSED
+from core.tracing import get_logger
+from obfuscate.policy import MASK, OBFUSCATE, CompiledPolicy, cached_policy, mask_series, resolve_policy
+
+logger = get_logger('csvhandler')
 
 async def predictheaders_async(file_content):
     """
-    Extract CSV headers from file content string (async version).
+    Extract CSV headers from file content string or text stream (async version).
     """
-    reader = csv.reader(StringIO(file_content))
+    source = StringIO(file_content) if isinstance(file_content, str) else file_content
+    reader = csv.reader(source)
     headers = next(reader, None)
     if not headers:
         raise Exception("CSV file is empty or invalid")
@@ -29,56 +41,77 @@ def predictheaders(file_content):
     
     return loop.run_until_complete(predictheaders_async(file_content))
 
-async def maskobfcsv_async(json_data: Dict[str, Any], file_content: str) -> str:
+def plan_csv_job(file_content, policy):
+    """
+    Inspects a CSV string or seekable stream and picks its execution strategy
+    (see core.planner) for the given CompiledPolicy or headers configuration.
+    """
+    if not isinstance(policy, CompiledPolicy):
+        policy = cached_policy(policy)
+    return plan_csv(inspect_csv(file_content), policy.obfuscating, policy.backend)
+
+async def maskobfcsv_async(json_data: Dict[str, Any], file_content: Union[str, IO], plan=None) -> str:
     """
     Applies masking or obfuscation to specified columns in CSV content (async version).
     
     Args:
-        json_data (dict): Configuration with fileName, headers (columns to process), and options
-        file_content (str): CSV file content as string
+        json_data (dict): Configuration with fileName, headers (columns to process) or policy, and options
+        file_content (str or file): CSV file content as string, or a seekable stream of it
+        plan (ExecutionPlan): Strategy from plan_csv_job(); planned here when omitted
     
     Returns:
         str: Path to the output CSV file
     """
     # Import inside function to avoid circular imports
     # from chat import chatlocal_async
+    # pandas is imported on first use so header prediction and non-CSV work start fast
+    import pandas as pd
 
     filename = json_data['fileName']
     
-    # Read CSV from string content
-    df = pd.read_csv(StringIO(file_content))
-    updated_df = df.copy()
+    # Read CSV from string content or straight from the upload stream
+    source = StringIO(file_content) if isinstance(file_content, str) else file_content
+    policy = resolve_policy(json_data)
+    if plan is None:
+        plan = plan_csv_job(source, policy)
+    if plan.strategy != IN_MEMORY:
+        return await maskobfcsv_chunked_async(json_data, source, plan)
 
-    column_info = json_data.get('headers', [])
-    original_headers = set(df.columns)
+    df = None
+    with stage('csv_read'):
+        try:
+            df = await run_cpu(pd.read_csv, source)
+        except MemoryError:
+            pass
+    # The estimate was off: drop the parsed frame and stream the file instead
+    if df is None or plan.over_budget():
+        columns = plan.inputs.get('columns', 1)
+        df = None
+        source.seek(0)
+        plan.fall_back(CHUNKED, "memory budget exceeded while parsing", chunked_rows(columns, plan.budget_bytes))
+        return await maskobfcsv_chunked_async(json_data, source, plan)
+    updated_df = df.copy()
+    report_progress(0, len(df), 'rows')
 
     # Process columns that need obfuscation
     obfuscation_tasks = []
     columns_to_obfuscate = []
 
     # First handle masking (no async needed)
-    for col in column_info:
-        column_name = col.get('name')
-        mode = col.get('mode')
-
-        if column_name not in original_headers:
-            print(f"Warning: Column '{column_name}' not found in file. Skipping.")
-            continue
-
-        if mode == "mask":
-            print(f"Masking the data in column: {column_name}")
-            updated_df[column_name] = df[column_name].apply(lambda x: '#' * len(str(x)))
+    for column_name, field in policy.resolve(df.columns):
+        if field.mode == MASK:
+            logger.debug("Masking the data in column: %s", column_name)
+            updated_df[column_name] = mask_series(df[column_name])
         
-        elif mode == "obfuscate":
+        elif field.mode == OBFUSCATE:
             # Store for async processing
-            columns_to_obfuscate.append(col)
+            columns_to_obfuscate.append((column_name, field))
 
     # Create a task for each column that needs obfuscation
-    for col in columns_to_obfuscate:
-        column_name = col.get('name')
-        instruction = col.get('prompt')
+    for column_name, field in columns_to_obfuscate:
+        instruction = field.prompt
         
-        print(f"Queuing obfuscation for column: {column_name}")
+        logger.debug("Queuing obfuscation for column: %s", column_name)
         
         # Convert column to string and handle NaN/None values
         csv_col = df[column_name].fillna("").astype(str)
@@ -100,17 +133,246 @@ async def maskobfcsv_async(json_data: Dict[str, Any], file_content: str) -> str:
     
     # Wait for all obfuscation tasks to complete
     if obfuscation_tasks:
-        print(f"Processing {len(obfuscation_tasks)} columns for obfuscation...")
-        await asyncio.gather(*obfuscation_tasks)
+        logger.debug("Processing %d columns for obfuscation", len(obfuscation_tasks))
+        try:
+            # Progress is reported in rows, scaled by the share of columns finished
+            with stage('csv_obfuscate'):
+                for finished, task in enumerate(asyncio.as_completed(obfuscation_tasks), 1):
+                    await task
+                    report_progress(len(df) * finished // len(obfuscation_tasks), len(df), 'rows')
+        except BaseException:
+            for task in obfuscation_tasks:
+                task.cancel()
+            raise
     
     # Save output
+    final_output_path = await write_masked_csv(updated_df, filename, json_data)
+    ROWS_PROCESSED.inc(len(df))
+    return final_output_path
+
+def render_csv_chunk(chunk, mask_columns, header):
+    """
+    Masks the given columns of a chunk and returns it as CSV text. Runs on the
+    CPU pool or, for process-parallel plans, in a worker process.
+    """
+    for column_name in mask_columns:
+        chunk[column_name] = mask_series(chunk[column_name])
+    return chunk.to_csv(index=False, header=header)
+
+def open_csv_output(stack, filename, json_data, append_to=None):
+    """
+    Opens <name>-output.csv (or the encrypted .enc) for writing text in chunks;
+    closed by stack, which removes a partial output if the job fails. With
+    append_to, rows go after that existing plaintext output instead, which is
+    cut back to its old length if the job fails.
+    Returns (output path, text stream).
+    """
+    output_path = json_data.get('outputPath', '')
+    output_filename = f"{os.path.splitext(filename)[0]}-output.csv"
+    encryption_key = json_data.get('encryptionKey')
+    if encryption_key:
+        from aes.aes import encrypted_output, ensure_folder_exists
+        final_output_path = os.path.join(ensure_folder_exists(output_path or None), f"{output_filename}.enc")
+        binary = stack.enter_context(encrypted_output(final_output_path, encryption_key, compress=True))
+        text_stream = TextIOWrapper(binary, encoding='utf-8', newline='')
+
+        def detach():
+            text_stream.flush()
+            text_stream.detach()
+        stack.callback(detach)
+        return final_output_path, text_stream
+
+    final_output_path = os.path.join(output_path if output_path else settings.MASK_OUTPUT_FOLDER, output_filename)
+    os.makedirs(os.path.dirname(final_output_path), exist_ok=True)
+
+    if append_to is not None:
+        final_output_path = append_to
+        size = os.path.getsize(final_output_path)
+
+        def restore(exc_type, exc, tb):
+            if exc_type is not None:
+                os.truncate(final_output_path, size)
+        stack.push(restore)
+        return final_output_path, stack.enter_context(open(final_output_path, 'a', encoding='utf-8', newline=''))
+
+    def remove_partial(exc_type, exc, tb):
+        if exc_type is not None and os.path.exists(final_output_path):
+            os.remove(final_output_path)
+    stack.push(remove_partial)
+    return final_output_path, stack.enter_context(open(final_output_path, 'w', encoding='utf-8', newline=''))
+
+async def maskobfcsv_chunked_async(json_data, source, plan, columns=None, append_to=None):
+    """
+    Chunked (and process-parallel) variant of maskobfcsv_async for files that
+    do not fit the memory budget in one piece. Rows are read, masked and
+    written plan.chunk_rows at a time; obfuscated values go through
+    deduplicated model calls and are remembered per column, so a value repeated
+    in later chunks is not sent again and keeps its replacement.
+
+    With columns, source holds header-less rows that are appended to the
+    existing output append_to (see maskobfcsv_incremental_async).
+    """
+    import pandas as pd
+    from obfuscate.chat import obfuscate_values_async
+
+    filename = json_data['fileName']
+    policy = resolve_policy(json_data)
+    estimated_rows = plan.inputs.get('estimatedRows') or 0
+    parallel = plan.strategy == PARALLEL
+    logger.info("Processing %s in chunks of %d rows (%s)", filename, plan.chunk_rows, plan.strategy)
+
+    append = append_to is not None
+    if append:
+        reader = await run_cpu(pd.read_csv, source, chunksize=plan.chunk_rows, header=None, names=columns)
+    else:
+        reader = await run_cpu(pd.read_csv, source, chunksize=plan.chunk_rows)
+    replacements = {}
+    rendering = deque()
+    rows = 0
+    report_progress(0, estimated_rows, 'rows')
+    with ExitStack() as stack:
+        stack.callback(reader.close)
+        final_output_path, stream = open_csv_output(stack, filename, json_data, append_to)
+        try:
+            while True:
+                with stage('csv_read'):
+                    chunk = await run_cpu(next, reader, None)
+                if chunk is None:
+                    break
+
+                mask_columns = []
+                for column_name, field in policy.resolve(chunk.columns):
+                    if field.mode == MASK:
+                        mask_columns.append(column_name)
+                    elif field.mode == OBFUSCATE:
+                        values = chunk[column_name].fillna("").astype(str)
+                        known = replacements.setdefault(column_name, {})
+                        new_values = [value for value in values.unique() if value not in known]
+                        if new_values:
+                            with stage('csv_obfuscate'):
+                                known.update(await obfuscate_values_async(field.prompt, new_values))
+                        chunk[column_name] = values.map(known)
+
+                header = rows == 0 and not append
+                rows += len(chunk)
+                if parallel:
+                    # Keep up to two chunks per worker rendering; write them back in order
+                    rendering.append(asyncio.ensure_future(run_process(render_csv_chunk, chunk, mask_columns, header)))
+                    if len(rendering) >= 2 * plan.workers:
+                        with stage('csv_write'):
+                            await run_cpu(stream.write, await rendering.popleft())
+                else:
+                    with stage('csv_write'):
+                        await run_cpu(stream.write, await run_cpu(render_csv_chunk, chunk, mask_columns, header))
+                report_progress(rows, max(rows, estimated_rows), 'rows')
+
+            while rendering:
+                with stage('csv_write'):
+                    await run_cpu(stream.write, await rendering.popleft())
+        except BaseException:
+            for future in rendering:
+                future.cancel()
+            raise
+
+    ROWS_PROCESSED.inc(rows)
+    report_progress(rows, rows, 'rows')
+    logger.info("Output saved to: %s", final_output_path)
+    return final_output_path
+
+async def maskobfcsv_incremental_async(json_data: Dict[str, Any], file_content: Union[str, IO],
+                                       source_id: str) -> Tuple[str, Dict[str, Any]]:
+    """
+    Masks an append-only CSV against the checkpoint of its source (see
+    core.checkpoints). When the bytes processed last time are unchanged, only
+    the rows after them are masked and appended to the existing output, so the
+    work follows the size of the delta; otherwise the whole file is processed
+    and a new checkpoint started. A trailing row without its newline is left
+    for the next run.
+
+    Args:
+        json_data (dict): Configuration with fileName, headers or policy, and outputPath (no encryptionKey)
+        file_content (str or file): CSV content as string, or a seekable binary stream of it
+        source_id (str): Stable name of the feed, e.g. its path or the client's sourceId
+
+    Returns:
+        tuple: (output path, summary with mode full/append/unchanged and row counts)
+    """
+    import pandas as pd
+    from core.checkpoints import RangeReader, checkpoint_key, get_checkpoint_store, scan_rows
+
+    if json_data.get('encryptionKey'):
+        raise ValueError("Incremental runs append to a plaintext output and cannot be encrypted")
+
+    source = BytesIO(file_content.encode('utf-8')) if isinstance(file_content, str) else file_content
+    policy = resolve_policy(json_data)
+    store = get_checkpoint_store()
+    key = checkpoint_key(source_id, policy.config(), json_data.get('outputPath', ''))
+    await store.claim(key)
+    try:
+        checkpoint = await run_cpu(store.get, key)
+        offset = checkpoint['byte_offset'] if checkpoint is not None else None
+        with stage('csv_checkpoint'):
+            scan = await run_cpu(scan_rows, source, offset)
+        rows = max(0, scan['lines'] - 1)
+
+        if checkpoint is not None and scan['prefixHash'] == checkpoint['prefix_hash']:
+            output_file = checkpoint['output']
+            appended = rows - checkpoint['row_count']
+            if scan['end'] > offset:
+                columns = list((await run_cpu(pd.read_csv, source, nrows=0)).columns)
+                budget = memory_budget()
+                plan = ExecutionPlan('csv', CHUNKED, "rows appended since the checkpoint",
+                                     appended * max(1, len(columns)) * CSV_CELL_BYTES, budget,
+                                     chunked_rows(len(columns), budget),
+                                     inputs={'columns': len(columns), 'estimatedRows': appended,
+                                             'sizeBytes': scan['end'] - offset})
+                await maskobfcsv_chunked_async(json_data, RangeReader(source, offset, scan['end']), plan, columns,
+                                               output_file)
+            logger.info("Appended %d rows of %s (%d bytes already processed)", appended, source_id, offset)
+            await run_cpu(store.put, key, source_id, scan['end'], rows, scan['hash'], output_file)
+            return output_file, {
+                'mode': 'append' if appended else 'unchanged',
+                'rowsAppended': appended,
+                'rowCount': rows,
+                'byteOffset': scan['end'],
+            }
+
+        reason = "no checkpoint" if checkpoint is None else "processed prefix changed"
+        logger.info("Processing %s in full: %s", source_id, reason)
+        output_file = await maskobfcsv_async(json_data, source)
+        if scan['end'] == scan['size']:
+            await run_cpu(store.put, key, source_id, scan['end'], rows, scan['hash'], output_file)
+        elif checkpoint is not None:
+            # The output now holds the unterminated last row, so no offset describes it
+            await run_cpu(store.drop, key)
+        return output_file, {
+            'mode': 'full',
+            'reason': reason,
+            'rowsAppended': rows,
+            'rowCount': rows,
+            'byteOffset': scan['end'],
+        }
+    finally:
+        store.release(key)
+
+async def write_masked_csv(updated_df, filename, json_data):
+    """
+    Writes a processed dataframe as <name>-output.csv, or encrypted when json_data
+    has an encryptionKey. Returns the output path.
+    """
     output_path = json_data.get('outputPath', '')
     base_name = os.path.splitext(filename)[0]
     output_filename = f"{base_name}-output.csv"
     
+    # Fused pipeline: stream the masked CSV straight into the encryptor
+    encryption_key = json_data.get('encryptionKey')
+    if encryption_key:
+        with stage('csv_encrypt_write'):
+            return await run_cpu(save_encrypted_csv, updated_df, output_filename, output_path, encryption_key)
+    
     # Determine final output path
     final_output_path = os.path.join(
-        output_path if output_path else os.path.join('..', 'client', 'public'),
+        output_path if output_path else settings.MASK_OUTPUT_FOLDER,
         output_filename
     )
 
@@ -118,19 +380,114 @@ async def maskobfcsv_async(json_data: Dict[str, Any], file_content: str) -> str:
     os.makedirs(os.path.dirname(final_output_path), exist_ok=True)
     
     # Save the updated dataframe to CSV
-    updated_df.to_csv(final_output_path, index=False)
+    with stage('csv_write'):
+        await run_cpu(updated_df.to_csv, final_output_path, index=False)
 
-    print(f"Output saved to: {final_output_path}")
+    logger.info("Output saved to: %s", final_output_path)
+    return final_output_path
+
+async def maskobfcsv_batch_async(json_data: Dict[str, Any], sources: List[tuple]) -> List[str]:
+    """
+    Applies one field configuration to several CSV files (async version).
+    
+    The values of each obfuscated column are pooled across all files and sent to
+    the model as shared, deduplicated batches, so the number of model calls
+    follows the distinct values rather than the number of files. A value gets
+    the same replacement in every file.
+    
+    Args:
+        json_data (dict): Configuration with headers or policy, outputPath and optional encryptionKey
+        sources (list): (fileName, CSV string or stream) pairs with distinct file names
+    
+    Returns:
+        list: Output paths, in the order of sources
+    """
+    import pandas as pd
+    from obfuscate.chat import obfuscate_values_async
+
+    frames = []
+    with stage('csv_read'):
+        for _, content in sources:
+            source = StringIO(content) if isinstance(content, str) else content
+            frames.append(await run_cpu(pd.read_csv, source))
+    updated_frames = [df.copy() for df in frames]
+    total_rows = sum(len(df) for df in frames)
+    report_progress(0, total_rows, 'rows')
+
+    # A field pools the values of every column it resolves to, in any file
+    policy = resolve_policy(json_data)
+    claimed = {}
+    for i, df in enumerate(frames):
+        for column_name, field in policy.resolve(df.columns):
+            claimed.setdefault(field.name, (field, []))[1].append((i, column_name))
+
+    async def obfuscate_field(field, columns):
+        values = {(i, column_name): frames[i][column_name].fillna("").astype(str) for i, column_name in columns}
+        pooled = [value for column in values.values() for value in column]
+        replacements = await obfuscate_values_async(field.prompt, pooled)
+        for (i, column_name), column in values.items():
+            updated_frames[i][column_name] = column.map(replacements)
+
+    obfuscation_tasks = []
+    for field, columns in claimed.values():
+        if field.mode == MASK:
+            for i, column_name in columns:
+                updated_frames[i][column_name] = mask_series(frames[i][column_name])
+        elif field.mode == OBFUSCATE:
+            obfuscation_tasks.append(obfuscate_field(field, columns))
+
+    if obfuscation_tasks:
+        logger.debug("Obfuscating %d columns across %d files", len(obfuscation_tasks), len(frames))
+        with stage('csv_obfuscate'):
+            await asyncio.gather(*obfuscation_tasks)
+
+    outputs = []
+    for (filename, _), df, updated_df in zip(sources, frames, updated_frames):
+        outputs.append(await write_masked_csv(updated_df, filename, json_data))
+        ROWS_PROCESSED.inc(len(df))
+    report_progress(total_rows, total_rows, 'rows')
+    return outputs
+
+def save_encrypted_csv(updated_df, output_filename, output_path, encryption_key):
+    """
+    Writes the dataframe as CSV through the AES encryptor so no plaintext copy
+    is written to disk. Defaults to the secured files folder.
+    """
+    from aes.aes import encrypted_output, ensure_folder_exists
+    
+    output_folder = ensure_folder_exists(output_path or None)
+    final_output_path = os.path.join(output_folder, f"{output_filename}.enc")
+    
+    # CSV text compresses well, so always run the compression stage here
+    with encrypted_output(final_output_path, encryption_key, compress=True) as stream:
+        text_stream = TextIOWrapper(stream, encoding='utf-8', newline='')
+        updated_df.to_csv(text_stream, index=False)
+        text_stream.flush()
+        text_stream.detach()
+    
+    logger.info("Encrypted output saved to: %s", final_output_path)
     return final_output_path
 
 async def process_obfuscation(column_name, data_string, instruction, updated_df, csv_col):
     """
     Helper function to process a single column obfuscation task asynchronously.
     """
-    from obfuscate.chat import chatlocal_async
+    from obfuscate.chat import chatlocal_async, chatlocal_stream_async
+    
+    logger.debug("Starting obfuscation for column %s (%d values)", column_name, len(csv_col))
     
-    print(f"Starting obfuscation for column: {column_name}")
-    print(f"Processing {len(csv_col)} values")
+    if os.getenv("LLM_STREAMING", "").lower() in ("1", "true", "yes"):
+        # Write each value into the column as soon as the model finishes it
+        try:
+            i = 0
+            async for value in chatlocal_stream_async(instruction, data_string):
+                if i < len(updated_df):
+                    updated_df.loc[i, column_name] = value.strip()
+                i += 1
+            logger.debug("Successfully obfuscated column: %s", column_name)
+        except Exception as e:
+            logger.warning("Obfuscation failed for column '%s', keeping original values: %s", column_name, e)
+        return
     
     try:
         # Get obfuscated data from AI model
@@ -138,7 +495,7 @@ async def process_obfuscation(column_name, data_string, instruction, updated_df,
         
         # Check if we got a valid response
         if not modified_data_string:
-            print(f"Warning: No valid response received for column '{column_name}'")
+            logger.warning("No valid response received for column '%s'", column_name)
             return
         
         # Handle the case where the response might be raw JSON string
@@ -157,7 +514,7 @@ async def process_obfuscation(column_name, data_string, instruction, updated_df,
         # Make sure we have enough values to apply (add padding if needed)
         if len(modified_values) < len(csv_col):
             # Pad with original values if we don't have enough obfuscated values
-            print(f"Warning: Not enough obfuscated values returned for column '{column_name}'")
+            logger.warning("Not enough obfuscated values returned for column '%s'", column_name)
             modified_values.extend(csv_col[len(modified_values):])
         
         # Apply the modified values to the dataframe
@@ -165,11 +522,10 @@ async def process_obfuscation(column_name, data_string, instruction, updated_df,
             if i < len(updated_df):
                 updated_df.loc[i, column_name] = value.strip()
         
-        print(f"Successfully obfuscated column: {column_name}")
+        logger.debug("Successfully obfuscated column: %s", column_name)
         
     except Exception as e:
-        print(f"Obfuscation failed for column '{column_name}': {str(e)}")
-        print("Falling back to original values for this column")
+        logger.warning("Obfuscation failed for column '%s', keeping original values: %s", column_name, e)
 
 # Synchronous wrapper for backward compatibility
 def maskobfcsv(json_data, file_content):
@@ -0,0 +1,212 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from core import metrics
+from core.tracing import get_logger
+
+# -----------------------------
+# Content-addressed cache for LLM responses: a bounded in-memory LRU in front of
+# an on-disk store with TTL and size-based eviction. Settings (environment):
+#   LLM_CACHE                 1/0 to enable or disable (default enabled)
+#   LLM_CACHE_DIR             disk tier location (default server/cache/llm)
+#   LLM_CACHE_TTL             seconds an entry stays valid (default 7 days)
+#   LLM_CACHE_MAX_BYTES       disk tier budget (default 256 MB)
+#   LLM_CACHE_MEMORY_ENTRIES  in-memory LRU size (default 512)
+# A disk entry's modification time stays its creation time, which the TTL is
+# measured from; reads set its access time, which orders size-based eviction.
+# -----------------------------
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+DEFAULT_CACHE_DIR = os.path.join(BASE_DIR, "cache", "llm")
+
+logger = get_logger('llmcache')
+
+
+def cache_key(model, system, content, params=None):
+    """Hash of everything that determines the model's answer"""
+    payload = json.dumps([model, system, content, params or {}], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """Two-tier (memory LRU + disk) cache of model responses keyed by cache_key()"""
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, memory_entries=512,
+                 ttl=7 * 24 * 3600, max_disk_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.memory_entries = memory_entries
+        self.ttl = ttl
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes = None
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _expired(self, created):
+        return self.ttl and time.time() - created > self.ttl
+
+    def get(self, key):
+        """Returns the cached response or None"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._expired(entry[0]):
+                    self._memory.move_to_end(key)
+                    self.hits_memory += 1
+                    return entry[1]
+                del self._memory[key]
+
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            entry = None
+
+        with self._lock:
+            if entry is None or self._expired(entry['created']):
+                self.misses += 1
+                return None
+            self.hits_disk += 1
+            self._remember(key, entry['created'], entry['value'])
+        try:
+            # Mark the use for size-based eviction without moving the creation time
+            os.utime(path, (time.time(), entry['created']))
+        except OSError:
+            pass
+        return entry['value']
+
+    def put(self, key, value):
+        """Stores a response in both tiers"""
+        created = time.time()
+        with self._lock:
+            self._remember(key, created, value)
+
+        path = self._path(key)
+        data = json.dumps({'created': created, 'value': value}, ensure_ascii=False).encode('utf-8')
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning("LLM cache write failed: %s", e)
+            return
+
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = self._scan_disk_bytes()
+            else:
+                self._disk_bytes += len(data)
+            over_budget = self._disk_bytes > self.max_disk_bytes
+        if over_budget:
+            self.evict()
+
+    def _remember(self, key, created, value):
+        self._memory[key] = (created, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.json'):
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    yield path, st.st_size, st.st_atime, st.st_mtime
+
+    def _scan_disk_bytes(self):
+        return sum(entry[1] for entry in self._entries())
+
+    def evict(self):
+        """Drops expired disk entries, then least recently used ones down to 90% of the budget"""
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        total = sum(size for _, size, _, _ in entries)
+        target = self.max_disk_bytes * 0.9
+        now = time.time()
+        for path, size, used, created in entries:
+            expired = self.ttl and now - created > self.ttl
+            if not expired and total <= target:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        with self._lock:
+            self._disk_bytes = total
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        for path, *_ in list(self._entries()):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        with self._lock:
+            self._disk_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits_memory + self.hits_disk + self.misses
+            return {
+                'hits_memory': self.hits_memory,
+                'hits_disk': self.hits_disk,
+                'misses': self.misses,
+                'hit_ratio': (self.hits_memory + self.hits_disk) / lookups if lookups else 0.0,
+                'memory_entries': len(self._memory),
+                'disk_bytes': self._disk_bytes,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Returns the process-wide response cache, or None when LLM_CACHE is disabled"""
+    global _cache
+    if os.getenv("LLM_CACHE", "1").lower() in ("0", "false", "no"):
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache(
+                    directory=os.getenv("LLM_CACHE_DIR", DEFAULT_CACHE_DIR),
+                    memory_entries=int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", "512")),
+                    ttl=float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600))),
+                    max_disk_bytes=int(os.getenv("LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024))),
+                )
+    return _cache
+
+
+def _cache_lookups():
+    if _cache is None:
+        return {}
+    return {('memory',): _cache.hits_memory, ('disk',): _cache.hits_disk, ('miss',): _cache.misses}
+
+
+def _cache_hit_ratio():
+    return {(): _cache.stats()['hit_ratio']} if _cache is not None else {}
+
+
+metrics.callback('obscura_llm_cache_lookups_total', 'LLM response cache lookups by result', 'counter',
+                 _cache_lookups, ['result'])
+metrics.callback('obscura_llm_cache_hit_ratio', 'Share of LLM prompts answered from the response cache', 'gauge',
+                 _cache_hit_ratio)
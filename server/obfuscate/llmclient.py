@@ -0,0 +1,393 @@
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import settings  # loads .env before the client reads its settings
+from core import metrics
+from core.tracing import get_logger, span
+
+# -----------------------------
+# LLM client layer: one shared backend handle behind a bounded executor,
+# a token-bucket rate limiter, per-call timeouts and jittered retries.
+# Settings are read from the environment when the client is first created:
+#   LLM_BACKEND              gemini | local | fake
+#   LLM_MODEL                model name (default gemini-1.5-flash)
+#   LLM_MAX_CONCURRENCY      max in-flight backend calls
+#   LLM_REQUESTS_PER_MINUTE  request budget (0 disables; off by default for local backends)
+#   LLM_TOKENS_PER_MINUTE    estimated token budget (0 disables; off by default for local backends)
+#   LLM_TIMEOUT              seconds per call
+#   LLM_MAX_RETRIES          retries after the first attempt
+#   LLM_FAKE_LATENCY         seconds of simulated latency for the fake backend
+#   LLM_STREAMING            1 to consume responses incrementally where callers support it
+# -----------------------------
+
+DEFAULT_MODEL = "gemini-1.5-flash"
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 30.0
+
+logger = get_logger('llmclient')
+
+LLM_REQUEST_SECONDS = metrics.histogram('obscura_llm_request_seconds', 'LLM backend call latency per attempt',
+                                        ['backend', 'outcome'])
+LLM_TOKENS = metrics.counter('obscura_llm_tokens_total', 'Estimated LLM tokens sent and received',
+                             ['backend', 'direction'])
+LLM_RETRIES = metrics.counter('obscura_llm_retries_total', 'LLM calls retried after a failure', ['backend'])
+LLM_IN_FLIGHT = metrics.gauge('obscura_llm_in_flight', 'LLM backend calls currently running', ['backend'])
+
+
+def estimate_tokens(text):
+    """Rough token estimate (~4 characters per token) used for rate limiting"""
+    return len(text) // 4 + 1
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. reserve() takes tokens immediately, letting the balance
+    go negative, and returns how long the caller has to wait for it to be repaid.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount=1.0):
+        amount = min(float(amount), self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+
+class RateLimiter:
+    """Combined request and token budget; a budget of 0 disables that bucket"""
+
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0):
+        self._requests = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self._tokens = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+
+    async def acquire(self, tokens):
+        wait = 0.0
+        if self._requests is not None:
+            wait = max(wait, self._requests.reserve(1))
+        if self._tokens is not None:
+            wait = max(wait, self._tokens.reserve(tokens))
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+# -----------------------------
+# Backends
+# -----------------------------
+class LLMBackend:
+    """Base class for blocking text-generation backends"""
+
+    name = "base"
+    model = None
+    remote = True  # remote backends get rate limiting by default
+
+    def generate(self, prompt):
+        """Returns the model's text for prompt, or None for an empty response"""
+        raise NotImplementedError
+
+    def stream(self, prompt):
+        """Yields the response in text chunks; non-streaming backends yield it whole"""
+        text = self.generate(prompt)
+        if text:
+            yield text
+
+    def warmup(self):
+        """Prepares the backend ahead of the first request"""
+
+    def is_retryable(self, error):
+        """Whether a failed call is worth retrying"""
+        return True
+
+
+class GeminiBackend(LLMBackend):
+    """Google Gemini backend; the SDK is configured once and the model handle reused"""
+
+    name = "gemini"
+    RETRYABLE_ERRORS = {
+        "ResourceExhausted", "TooManyRequests", "ServiceUnavailable",
+        "DeadlineExceeded", "InternalServerError", "GatewayTimeout",
+    }
+
+    def __init__(self, model=DEFAULT_MODEL):
+        self.model = model
+        self._handle = None
+        self._lock = threading.Lock()
+
+    def _get_handle(self):
+        if self._handle is None:
+            with self._lock:
+                if self._handle is None:
+                    import google.generativeai as genai
+                    genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+                    self._handle = genai.GenerativeModel(self.model)
+        return self._handle
+
+    def generate(self, prompt):
+        response = self._get_handle().generate_content(prompt)
+        if not response or not hasattr(response, 'text'):
+            logger.warning("Received empty response from Gemini API")
+            return None
+        return response.text
+
+    def stream(self, prompt):
+        for chunk in self._get_handle().generate_content(prompt, stream=True):
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunks without text parts (e.g. safety metadata) carry nothing to parse
+                continue
+            if text:
+                yield text
+
+    def is_retryable(self, error):
+        if isinstance(error, (TimeoutError, ConnectionError)):
+            return True
+        return type(error).__name__ in self.RETRYABLE_ERRORS
+
+
+class FakeBackend(LLMBackend):
+    """
+    Deterministic local backend for tests, benchmarks and offline development.
+    Obfuscation prompts get a stable, hash-derived replacement per input value;
+    detection prompts get the PII field names matched by simple patterns.
+    """
+
+    name = "fake"
+    remote = False
+    DETECTORS = {
+        "Email": re.compile(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}'),
+        "Phone": re.compile(r'\(?\d{3}\)?[\s.-]?\d{3}[\s.-]?\d{4}'),
+        "SSN": re.compile(r'\b\d{3}-\d{2}-\d{4}\b'),
+    }
+
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=0):
+        self.model = "fake"
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def generate(self, prompt):
+        with self._lock:
+            self.calls += 1
+            fail = self._random.random() < self.failure_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            raise ConnectionError("Simulated backend failure")
+
+        instructions, _, data = prompt.rpartition("Input data: ")
+        if "PII Field Detection" in instructions:
+            return json.dumps([name for name, pattern in self.DETECTORS.items() if pattern.search(data)])
+        values = data.split(',') if data else []
+        return json.dumps({"changed_names": [self.fake_value(v) for v in values]})
+
+    def stream(self, prompt, chunk_size=16):
+        text = self.generate(prompt)
+        for i in range(0, len(text), chunk_size):
+            yield text[i:i + chunk_size]
+
+    @staticmethod
+    def fake_value(value):
+        """Stable replacement that keeps digits as digits and letters as letters"""
+        digest = hashlib.sha256(value.encode('utf-8')).digest()
+        out = []
+        for i, ch in enumerate(value):
+            b = digest[i % len(digest)]
+            if ch.isdigit():
+                out.append(str(b % 10))
+            elif ch.isalpha():
+                letter = chr(ord('a') + b % 26)
+                out.append(letter.upper() if ch.isupper() else letter)
+            else:
+                out.append(ch)
+        return ''.join(out)
+
+
+def create_backend(name=None):
+    """Builds the backend named by LLM_BACKEND"""
+    name = (name or os.getenv("LLM_BACKEND", "gemini")).lower()
+    if name == "gemini":
+        return GeminiBackend(os.getenv("LLM_MODEL", DEFAULT_MODEL))
+    if name == "local":
+        from obfuscate.localbackend import TransformersBackend, DEFAULT_LOCAL_MODEL
+        threads = os.getenv("LLM_LOCAL_THREADS")
+        return TransformersBackend(
+            model=os.getenv("LLM_LOCAL_MODEL", DEFAULT_LOCAL_MODEL),
+            batch_window_ms=float(os.getenv("LLM_BATCH_WINDOW_MS", "5")),
+            max_batch_size=int(os.getenv("LLM_MAX_BATCH_SIZE", "8")),
+            max_new_tokens=int(os.getenv("LLM_MAX_NEW_TOKENS", "512")),
+            threads=int(threads) if threads else None,
+        )
+    if name == "fake":
+        return FakeBackend(latency=float(os.getenv("LLM_FAKE_LATENCY", "0")))
+    raise ValueError(f"Unknown LLM backend: {name}")
+
+
+# -----------------------------
+# Client
+# -----------------------------
+class LLMClient:
+    """
+    Async front end for a blocking backend. Calls run on the client's own bounded
+    executor, so concurrency is capped no matter how many event loops call in.
+    """
+
+    def __init__(self, backend, max_concurrency=8, requests_per_minute=0,
+                 tokens_per_minute=0, timeout=60.0, max_retries=4):
+        self.backend = backend
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm")
+
+    async def generate(self, prompt):
+        """
+        Runs prompt through the backend with rate limiting, a per-call timeout and
+        jittered exponential backoff. Raises the last error once retries run out.
+        """
+        loop = asyncio.get_running_loop()
+        tokens = estimate_tokens(prompt)
+        backend = self.backend.name
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire(tokens)
+            start = time.perf_counter()
+            try:
+                # A timed-out call keeps its worker until the backend returns
+                future = loop.run_in_executor(self._executor, self.backend.generate, prompt)
+                LLM_IN_FLIGHT.inc(backend=backend)
+                try:
+                    with span('llm_call', backend=backend, attempt=attempt, prompt_tokens=tokens):
+                        text = await asyncio.wait_for(future, self.timeout)
+                finally:
+                    LLM_IN_FLIGHT.dec(backend=backend)
+                LLM_REQUEST_SECONDS.observe(time.perf_counter() - start, backend=backend, outcome='ok')
+                LLM_TOKENS.inc(tokens, backend=backend, direction='prompt')
+                LLM_TOKENS.inc(estimate_tokens(text or ''), backend=backend, direction='completion')
+                return text
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    e = TimeoutError(f"LLM call timed out after {self.timeout}s")
+                outcome = 'timeout' if isinstance(e, TimeoutError) else 'error'
+                LLM_REQUEST_SECONDS.observe(time.perf_counter() - start, backend=backend, outcome=outcome)
+                if attempt >= self.max_retries or not self.backend.is_retryable(e):
+                    raise e
+                LLM_RETRIES.inc(backend=backend)
+                delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)) * random.uniform(0.5, 1.0)
+                logger.warning("LLM call failed (%s), retrying in %.1fs (attempt %d/%d)",
+                               e, delay, attempt + 1, self.max_retries)
+                await asyncio.sleep(delay)
+
+    async def stream(self, prompt):
+        """
+        Async generator over the backend's response chunks. The blocking backend
+        iterator runs on the client's executor; each chunk must arrive within the
+        per-call timeout. No retries here: callers know how much they already consumed.
+        """
+        loop = asyncio.get_running_loop()
+        tokens = estimate_tokens(prompt)
+        backend = self.backend.name
+        await self.limiter.acquire(tokens)
+        chunks = asyncio.Queue()
+        finished = object()
+        stopped = threading.Event()
+
+        def push(item):
+            try:
+                loop.call_soon_threadsafe(chunks.put_nowait, item)
+            except RuntimeError:
+                # Event loop already closed; the consumer is gone
+                stopped.set()
+
+        def pump():
+            try:
+                for chunk in self.backend.stream(prompt):
+                    if stopped.is_set():
+                        break
+                    push(chunk)
+            except Exception as e:
+                push(e)
+            finally:
+                push(finished)
+
+        loop.run_in_executor(self._executor, pump)
+        start = time.perf_counter()
+        outcome = 'error'
+        received = 0
+        LLM_IN_FLIGHT.inc(backend=backend)
+        try:
+            while True:
+                try:
+                    item = await asyncio.wait_for(chunks.get(), self.timeout)
+                except asyncio.TimeoutError:
+                    outcome = 'timeout'
+                    raise TimeoutError(f"LLM stream stalled for {self.timeout}s")
+                if item is finished:
+                    outcome = 'ok'
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                received += len(item)
+                yield item
+        finally:
+            stopped.set()
+            LLM_IN_FLIGHT.dec(backend=backend)
+            LLM_REQUEST_SECONDS.observe(time.perf_counter() - start, backend=backend, outcome=outcome)
+            LLM_TOKENS.inc(tokens, backend=backend, direction='prompt')
+            LLM_TOKENS.inc(received // 4, backend=backend, direction='completion')
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Returns the process-wide LLM client, creating it from the environment on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                backend = create_backend()
+                _client = LLMClient(
+                    backend,
+                    max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+                    requests_per_minute=float(os.getenv("LLM_REQUESTS_PER_MINUTE", "60" if backend.remote else "0")),
+                    tokens_per_minute=float(os.getenv("LLM_TOKENS_PER_MINUTE", "1000000" if backend.remote else "0")),
+                    timeout=float(os.getenv("LLM_TIMEOUT", "60")),
+                    max_retries=int(os.getenv("LLM_MAX_RETRIES", "4")),
+                )
+    return _client
+
+
+def backend_version():
+    """Identifies the backend and model, for caches of results derived from model output"""
+    backend = get_client().backend
+    return f"{backend.name}:{backend.model}"
+
+
+def set_client(client):
+    """Replaces the process-wide client (e.g. with a FakeBackend client in tests)"""
+    global _client
+    with _client_lock:
+        _client = client
@@ -0,0 +1,141 @@
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+from obfuscate.llmclient import LLMBackend
+from core.tracing import get_logger
+
+# -----------------------------
+# Local transformers backend for air-gapped deployments. Concurrent generate() calls
+# are collected for a short window and run as one left-padded batch on CPU.
+# Settings (environment):
+#   LLM_LOCAL_MODEL       Hugging Face model id or local path
+#   LLM_BATCH_WINDOW_MS   how long to wait for more requests before running a batch
+#   LLM_MAX_BATCH_SIZE    upper bound on requests per batch
+#   LLM_MAX_NEW_TOKENS    generation length per request
+#   LLM_LOCAL_THREADS     torch intra-op threads (default: torch's choice)
+# LLM_MAX_CONCURRENCY should be at least LLM_MAX_BATCH_SIZE, otherwise the client's
+# executor caps how many requests can be waiting to be batched.
+# -----------------------------
+
+DEFAULT_LOCAL_MODEL = "Qwen/Qwen2.5-0.5B-Instruct"
+
+logger = get_logger('localbackend')
+
+
+class TransformersBackend(LLMBackend):
+    """CPU transformers backend with lazy model load and dynamic batching"""
+
+    name = "local"
+    remote = False
+
+    def __init__(self, model=DEFAULT_LOCAL_MODEL, batch_window_ms=5, max_batch_size=8,
+                 max_new_tokens=512, threads=None):
+        self.model = model
+        self.batch_window = batch_window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self.max_new_tokens = max_new_tokens
+        self.threads = threads
+        self._tokenizer = None
+        self._model = None
+        self._load_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+    # Model loading
+    def _ensure_loaded(self):
+        if self._model is not None:
+            return
+        with self._load_lock:
+            if self._model is not None:
+                return
+            import torch
+            from transformers import AutoTokenizer, AutoModelForCausalLM
+
+            if self.threads:
+                torch.set_num_threads(self.threads)
+            start = time.perf_counter()
+            tokenizer = AutoTokenizer.from_pretrained(self.model)
+            # Decoder-only models must be padded on the left for batched generation
+            tokenizer.padding_side = "left"
+            if tokenizer.pad_token is None:
+                tokenizer.pad_token = tokenizer.eos_token
+            model = AutoModelForCausalLM.from_pretrained(self.model, torch_dtype=torch.float32)
+            model.eval()
+            self._tokenizer = tokenizer
+            self._model = model
+            logger.info("Loaded local model %s in %.1fs", self.model, time.perf_counter() - start)
+
+    def warmup(self):
+        """Loads the model and runs a tiny generation so the first request is fast"""
+        self._ensure_loaded()
+        self._run_batch(["Hello"], max_new_tokens=1)
+
+    # Batching
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._worker_lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._batch_loop, name="llm-batcher", daemon=True)
+                    self._worker.start()
+
+    def generate(self, prompt):
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((prompt, future))
+        return future.result()
+
+    def _batch_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            prompts = [prompt for prompt, _ in batch]
+            try:
+                outputs = self._run_batch(prompts)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), output in zip(batch, outputs):
+                future.set_result(output)
+
+    def _run_batch(self, prompts, max_new_tokens=None):
+        import torch
+
+        self._ensure_loaded()
+        tokenizer = self._tokenizer
+        if getattr(tokenizer, "chat_template", None):
+            texts = [
+                tokenizer.apply_chat_template([{"role": "user", "content": p}], tokenize=False,
+                                              add_generation_prompt=True)
+                for p in prompts
+            ]
+        else:
+            texts = prompts
+
+        inputs = tokenizer(texts, return_tensors="pt", padding=True)
+        with torch.inference_mode():
+            generated = self._model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens or self.max_new_tokens,
+                do_sample=False,
+                pad_token_id=tokenizer.pad_token_id,
+            )
+        # Only decode the newly generated tokens
+        new_tokens = generated[:, inputs["input_ids"].shape[1]:]
+        return tokenizer.batch_decode(new_tokens, skip_special_tokens=True)
+
+    def is_retryable(self, error):
+        # Local failures (OOM, bad model path) will not fix themselves on retry
+        return False
@@ -1,16 +1,77 @@
 import asyncio
-import traceback
 from io import BytesIO  # Ensure BytesIO is imported explicitly
 import os
-import fitz
-from PyPDF2 import PdfReader, PdfWriter
 import re
 import json
 from obfuscate.chat import chatlocal, chatlocal_async
+import settings
+from core.pools import run_pdf
+from core.jobs import report_progress
+from core.metrics import stage, PAGES_PROCESSED
+from core.tracing import get_logger
+from obfuscate.policy import MASK, OBFUSCATE, mask_text, recognizer_for, resolve_policy
+
+logger = get_logger('pdfhandler')
 
 # Global store for PII values discovered in the last call
 data_dict = {}
 
+def extract_pdf_text(pdf_file_obj):
+    """
+    Extracts the full text of a PDF with PyMuPDF (runs on the PDF worker)
+    """
+    import fitz
+
+    doc = fitz.open(stream=pdf_file_obj, filetype="pdf")
+    try:
+        return "".join(page.get_text() for page in doc)
+    finally:
+        doc.close()
+
+def extract_pii_values(full_text, headers):
+    """
+    Finds the values of each PII header in the document text with the
+    recognizer for the header's type (see obfuscate.policy). Returns
+    {header: [values]}.
+    """
+    values = {}
+    for header in headers:
+        recognizer = recognizer_for(header)
+        values[header] = recognizer.findall(full_text) if recognizer is not None else []
+        logger.debug("Found %d values for %s", len(values[header]), header)
+    return values
+
+
+def open_pdf(stream):
+    """
+    Opens a PDF (runs on the PDF worker); returns (doc, page count) so the
+    caller never has to call into the document from the event loop
+    """
+    import fitz
+
+    doc = fitz.open(stream=stream, filetype="pdf")
+    return doc, len(doc)
+
+
+def close_pdf(doc):
+    """Closes a document unless it already is (runs on the PDF worker)"""
+    if not doc.is_closed:
+        doc.close()
+
+
+def document_text(doc):
+    """Full text of an open document (runs on the PDF worker)"""
+    return "".join(page.get_text() for page in doc)
+
+
+def scanned_values(policy):
+    """
+    Copy of the values the last header scan found for the policy's fields;
+    fields with their own pattern find theirs in the document instead
+    """
+    return {field.name: list(data_dict.get(field.name, [])) for field in policy.fields if not field.pattern}
+
+
 async def predictpdfheaders_async(file_bytes):
     """
     Async version of PDF header prediction
@@ -19,28 +80,21 @@ async def predictpdfheaders_async(file_bytes):
     data_dict.clear()
 
     try:
-        print(f"Type of file_bytes in predictpdfheaders_async: {type(file_bytes)}")
         
-        # Ensure we're working with BytesIO object
-        if not isinstance(file_bytes, BytesIO):
-            print("Converting to BytesIO")
-            if isinstance(file_bytes, str):
-                file_bytes = file_bytes.encode('utf-8')
-            pdf_file_obj = BytesIO(file_bytes)
+        if isinstance(file_bytes, str):
+            file_bytes = file_bytes.encode('utf-8')
+        if isinstance(file_bytes, (bytes, memoryview)):
+            # fitz reads bytes and memoryviews (e.g. a mapped upload) in place
+            pdf_file_obj = file_bytes
         else:
-            print("Already a BytesIO object")
             pdf_file_obj = file_bytes
-            
-        # Reset the BytesIO position to the beginning to ensure full reading
-        pdf_file_obj.seek(0)
+            # Reset the BytesIO position to the beginning to ensure full reading
+            pdf_file_obj.seek(0)
         
         # Use PyMuPDF (fitz) for better text extraction
-        print("Opening PDF with fitz")
-        doc = fitz.open(stream=pdf_file_obj, filetype="pdf")
-        full_text = ""
-        for page in doc:
-            full_text += page.get_text()
-        print(f"Extracted {len(full_text)} characters of text")
+        with stage('pdf_extract'):
+            full_text = await run_pdf(extract_pdf_text, pdf_file_obj)
+        logger.debug("Extracted %d characters of text", len(full_text))
 
         systemprompt = """
         PII Field Detection Specialist - Strict Mode
@@ -87,10 +141,10 @@ async def predictpdfheaders_async(file_bytes):
         """
         
         # Use async version of chatlocal
-        print("Calling chatlocal_async")
-        detected = await chatlocal_async(systemprompt, full_text, True)
+        with stage('pdf_detect'):
+            detected = await chatlocal_async(systemprompt, full_text, True)
         detected = detected.strip()
-        print(f"chatlocal_async response received, length: {len(detected)}")
+        logger.debug("Header detection response received, length: %d", len(detected))
 
         # Clean up the response to extract just the JSON list
         # First try to find a JSON array in the response
@@ -103,7 +157,7 @@ async def predictpdfheaders_async(file_bytes):
             headers = json.loads(detected)
             # Make sure headers is a list
             if not isinstance(headers, list):
-                print(f"Received non-list JSON: {type(headers)}")
+                logger.debug("Received non-list JSON: %s", type(headers).__name__)
                 if isinstance(headers, dict) and "changed_names" in headers:
                     headers = headers["changed_names"]
                 else:
@@ -111,9 +165,9 @@ async def predictpdfheaders_async(file_bytes):
                     
             # Filter out any non-string headers and normalize
             final_headers = [str(h).strip() for h in headers if isinstance(h, (str, int, float))]
-            print(f"Parsed JSON headers: {final_headers}")
+            logger.debug("Parsed JSON headers: %s", final_headers)
         except (json.JSONDecodeError, TypeError) as json_error:
-            print(f"JSON parsing error: {json_error}")
+            logger.debug("JSON parsing error: %s", json_error)
             # If JSON parsing fails, try to extract headers from text
             headers = []
             # Try to extract items that look like they're in a list format
@@ -124,11 +178,11 @@ async def predictpdfheaders_async(file_bytes):
                 if line and len(line) > 1:
                     headers.append(line)
             final_headers = headers
-            print(f"Extracted headers from text: {final_headers}")
+            logger.debug("Extracted headers from text: %s", final_headers)
         
         # If AI detection failed, try traditional methods
         if not final_headers:
-            print("AI detection failed, trying traditional methods")
+            logger.info("AI detection failed, trying traditional methods")
             # Extract headers from tabular structure in PDF
             lines = full_text.split('\n')
             # Look for potential header rows (usually near the top of the document)
@@ -148,7 +202,7 @@ async def predictpdfheaders_async(file_bytes):
                         potential_headers = [h for h in potential_headers if len(h) > 1]
                         if len(potential_headers) >= 2:  # At least 2 columns to be considered headers
                             final_headers = potential_headers
-                            print(f"Found potential headers from document structure: {final_headers}")
+                            logger.debug("Found potential headers from document structure: %s", final_headers)
                             break
         
         # Common PII headers to look for in the extracted text
@@ -163,7 +217,7 @@ async def predictpdfheaders_async(file_bytes):
             pattern = re.compile(r'\b' + re.escape(pii_header) + r'(?:s|es|)?\b', re.IGNORECASE)
             if pattern.search(full_text) and pii_header not in final_headers:
                 final_headers.append(pii_header)
-                print(f"Added common PII header: {pii_header}")
+                logger.debug("Added common PII header: %s", pii_header)
         
         # Ensure we don't have duplicates (case-insensitive)
         seen = set()
@@ -174,46 +228,15 @@ async def predictpdfheaders_async(file_bytes):
                 unique_headers.append(header)
         
         # Extract actual PII values for each header
-        for header in unique_headers:
-            # Simple pattern matching based on header type
-            header_lower = header.lower()
-            data_dict[header] = []
-            
-            # Extract potential PII values
-            if "email" in header_lower:
-                # Email pattern
-                emails = re.findall(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}', full_text)
-                data_dict[header].extend(emails)
-                print(f"Found {len(emails)} emails")
-            elif "phone" in header_lower:
-                # Phone number patterns
-                phones = re.findall(r'\b(?:\+\d{1,2}\s)?\(?\d{3}\)?[\s.-]?\d{3}[\s.-]?\d{4}\b', full_text)
-                data_dict[header].extend(phones)
-                print(f"Found {len(phones)} phone numbers")
-            elif "address" in header_lower:
-                # Simple address pattern (not comprehensive)
-                addresses = re.findall(r'\d+\s+\w+\s+(?:St|Street|Ave|Avenue|Rd|Road|Blvd|Boulevard|Dr|Drive|Ln|Lane)', full_text, re.IGNORECASE)
-                data_dict[header].extend(addresses)
-                print(f"Found {len(addresses)} addresses")
-            elif "ssn" in header_lower or "social security" in header_lower:
-                # SSN pattern
-                ssns = re.findall(r'\b\d{3}[-\s]?\d{2}[-\s]?\d{4}\b', full_text)
-                data_dict[header].extend(ssns)
-                print(f"Found {len(ssns)} SSNs")
-            elif "name" in header_lower:
-                # This is simplified - in a real system you'd need more sophisticated name extraction
-                names = re.findall(r'Mr\.\s+\w+|Mrs\.\s+\w+|Ms\.\s+\w+|Dr\.\s+\w+|\b[A-Z][a-z]+\s+[A-Z][a-z]+\b', full_text)
-                data_dict[header].extend(names)
-                print(f"Found {len(names)} names")
+        data_dict.update(extract_pii_values(full_text, unique_headers))
         
         # Return headers for the UI with a blank placeholder at the start
         final_result = [" "] + unique_headers
-        print(f"Final headers with placeholder: {final_result}")
+        logger.debug("Final headers: %s", final_result)
         return final_result
 
     except Exception as e:
-        print(f"Error in predictpdfheaders_async: {e}")
-        print(traceback.format_exc())
+        logger.error("Error in predictpdfheaders_async: %s", e, exc_info=True)
         return [" "]
 
 # Synchronous wrapper
@@ -222,16 +245,13 @@ def predictpdfheaders(file_bytes):
     Synchronous wrapper for predictpdfheaders_async
     """
     try:
-        print(f"Type of file_bytes in predictpdfheaders: {type(file_bytes)}")
         
         # Ensure we're working with BytesIO object
         if not isinstance(file_bytes, BytesIO):
-            print("Converting to BytesIO in predictpdfheaders")
             if isinstance(file_bytes, str):
                 file_bytes = file_bytes.encode('utf-8')
             file_bytes_io = BytesIO(file_bytes)
         else:
-            print("Already a BytesIO object in predictpdfheaders")
             file_bytes_io = file_bytes
             
         # Reset the BytesIO position
@@ -239,64 +259,114 @@ def predictpdfheaders(file_bytes):
             
         # Get or create event loop
         try:
-            print("Getting event loop")
             loop = asyncio.get_event_loop()
         except RuntimeError:
-            print("Creating new event loop")
             loop = asyncio.new_event_loop()
             asyncio.set_event_loop(loop)
         
-        print("Running predictpdfheaders_async")
         result = loop.run_until_complete(predictpdfheaders_async(file_bytes_io))
-        print(f"Result from predictpdfheaders_async: {result}")
         return result
     except Exception as e:
-        print(f"Error in predictpdfheaders: {e}")
-        print(traceback.format_exc())
+        logger.error("Error in predictpdfheaders: %s", e, exc_info=True)
         return [" "]
 
 
 
+
 async def process_field_async(field, orig_values):
     """
-    Process a single field asynchronously
+    Process a single field (a CompiledField) asynchronously
     """
     try:
-        name = field["name"]
-        mode = field["mode"]
-        prompt = field.get("prompt", "")
+        name = field.name
+        mode = field.mode
+        prompt = field.prompt
 
         if not orig_values:
-            print(f"No original values for field {name}")
+            logger.debug("No original values for field %s", name)
             return name, ""
 
-        print(f"Processing field {name} with mode {mode}, {len(orig_values)} values")
+        logger.debug("Processing field %s with mode %s, %d values", name, mode, len(orig_values))
         
-        if mode == "mask":
+        if mode == MASK:
             # Masking can be done synchronously
             joined = ",".join(orig_values)
-            result = name, "#" * len(joined)
-            print(f"Masked {name}: replaced with {len(joined)} '#' characters")
+            result = name, mask_text(joined)
+            logger.debug("Masked %s: replaced with %d '#' characters", name, len(joined))
             return result
         
-        elif mode == "obfuscate":
+        elif mode == OBFUSCATE:
             joined = ",".join(orig_values)
             systemprompt = (
                 "You are a tool that can modify PII data. "
                 "Return ONLY the comma‑separated modified values, no extra text."
             )
             # Use async version of chatlocal
-            print(f"Calling chatlocal_async for obfuscation of {name}")
             modified = await chatlocal_async(systemprompt, joined + " " + prompt)
-            print(f"Obfuscated {name}: {modified[:50]}...")
+            logger.debug("Obfuscated %s (%d characters)", name, len(modified))
             return name, modified.strip()
         
-        print(f"Unknown mode {mode} for field {name}")
+        logger.warning("Unknown mode %s for field %s", mode, name)
         return name, None
     except Exception as e:
-        print(f"Error in process_field_async: {str(e)}")
-        print(traceback.format_exc())
-        return field.get("name", "unknown"), None
+        logger.error("Error in process_field_async: %s", e, exc_info=True)
+        return getattr(field, "name", "unknown"), None
+
+
+def apply_replacements(doc, modified_dict, field_values=None):
+    """
+    Searches every page for the original PII values (from field_values, by
+    default the values found by header detection) and redacts them with their
+    replacements (runs on the PDF worker). Returns the number of replacements.
+    """
+    field_values = data_dict if field_values is None else field_values
+    replacements_made = 0
+    for page_num, page in enumerate(doc):
+        report_progress(page_num, len(doc), 'pages')
+        for field_name, replacement in modified_dict.items():
+            original_values = field_values.get(field_name, [])
+
+            for original in original_values:
+                if not original:
+                    continue
+
+                # Use PyMuPDF's search_for method to find text instances
+                text_instances = page.search_for(original)
+
+                if text_instances:
+                    logger.debug("Found %d instances on page %d", len(text_instances), page_num + 1)
+
+                    # For each found text instance, add redaction annotation
+                    for inst in text_instances:
+                        # First, add the redaction annotation
+                        annot = page.add_redact_annot(inst, replacement)
+
+                        # Then apply the redaction with the replacement text
+                        page.apply_redactions()
+                        replacements_made += 1
+    report_progress(len(doc), len(doc), 'pages')
+    return replacements_made
+
+
+def apply_value_replacements(doc, replacements):
+    """
+    Redacts every occurrence of each original value with its own replacement
+    (runs on the PDF worker), applying the redactions once per page. Returns the
+    number of replacements.
+    """
+    replacements_made = 0
+    # Longer values first, so one that contains another is matched whole
+    ordered = sorted(replacements.items(), key=lambda item: len(item[0]), reverse=True)
+    for page in doc:
+        found = 0
+        for original, replacement in ordered:
+            for inst in page.search_for(original):
+                page.add_redact_annot(inst, replacement)
+                found += 1
+        if found:
+            page.apply_redactions()
+        replacements_made += found
+    return replacements_made
 
 
 async def maskobfpdf_async(json_data, file_bytes):
@@ -304,122 +374,191 @@ async def maskobfpdf_async(json_data, file_bytes):
     Async version of PDF masking/obfuscation with improved implementation
     
     Args:
-        json_data (dict): Configuration with fileName, headers (fields to process), and options
-        file_bytes: PDF file content as bytes or BytesIO
+        json_data (dict): Configuration with fileName, headers (fields to process) or policy, and options;
+            fieldValues pins the scanned values (see scanned_values) the output is cached under
+        file_bytes: PDF file content as bytes, memoryview or BytesIO
     """
+    doc = None
     try:
-        import fitz  # PyMuPDF for better text modification
-        import io
-        import os
-        import json
-        
-        # Convert input to BytesIO if needed
-        pdf_file_obj = BytesIO(file_bytes) if not isinstance(file_bytes, BytesIO) else file_bytes
-        pdf_file_obj.seek(0)
+        # fitz opens bytes, memoryviews (e.g. a mapped upload) and BytesIO directly
+        pdf_file_obj = BytesIO(file_bytes) if isinstance(file_bytes, bytearray) else file_bytes
+        if isinstance(pdf_file_obj, BytesIO):
+            pdf_file_obj.seek(0)
             
-        # Parse the headers from JSON data if it's a string
-        headers = json_data.get("headers", [])
-        if isinstance(headers, str):
-            try:
-                headers = json.loads(headers)
-                print(f"Parsed headers from JSON string: {headers}")
-            except json.JSONDecodeError as json_err:
-                print(f"Failed to parse headers JSON: {json_err}")
-                headers = []
-        
-        if not isinstance(headers, list):
-            print(f"Invalid headers format: {type(headers)}")
-            headers = []
+        # The compiled policy is shared with other requests using the same fields
+        policy = resolve_policy(json_data)
 
         # Open the PDF with PyMuPDF for better text handling
-        doc = fitz.open(stream=pdf_file_obj, filetype="pdf")
-        print(f"Opened PDF with {len(doc)} pages")
+        with stage('pdf_open'):
+            doc, pages = await run_pdf(open_pdf, pdf_file_obj)
+        logger.debug("Opened PDF with %d pages", pages)
         
+        # Values come from header detection; fields with their own pattern search the text
+        pinned = json_data.get('fieldValues')
+        field_values = dict(pinned) if pinned is not None else scanned_values(policy)
+        if any(field.pattern for field in policy.fields):
+            with stage('pdf_extract'):
+                full_text = await run_pdf(document_text, doc)
+            field_values.update({field.name: field.find(full_text) for field in policy.fields if field.pattern})
+
         # Process fields
         tasks = []
-        for field in headers:
-            if not isinstance(field, dict):
-                print(f"Skipping non-dict field: {field}")
-                continue
-                
-            name = field.get("name")
-            if not name or name == " ":  # Skip blank placeholder
-                continue
-                
-            orig_values = data_dict.get(name, [])
+        for field in policy.fields:
+            name = field.name
+            orig_values = field_values[name]
             if not orig_values:
-                print(f"No original values for field {name}")
+                logger.debug("No original values for field %s", name)
                 continue
                 
-            print(f"Adding task for field {name} with {len(orig_values)} values")
+            logger.debug("Adding task for field %s with %d values", name, len(orig_values))
             tasks.append(process_field_async(field, orig_values))
 
         # Process all fields concurrently
         modified_dict = {}
         if tasks:
-            results = await asyncio.gather(*tasks)
+            with stage('pdf_fields'):
+                results = await asyncio.gather(*tasks)
             modified_dict = {name: value for name, value in results if value is not None}
-            print(f"Processed {len(modified_dict)} fields: {list(modified_dict.keys())}")
+            logger.debug("Processed %d fields: %s", len(modified_dict), list(modified_dict.keys()))
 
         # Print some diagnostics about what we're replacing
         for field_name, replacement in modified_dict.items():
-            original_values = data_dict.get(field_name, [])
-            print(f"Field {field_name}: Replacing {len(original_values)} values with '{replacement[:20]}...'")
+            logger.debug("Field %s: replacing %d values", field_name, len(field_values[field_name]))
 
         # Process PDF pages - search and replace text on each page
-        replacements_made = 0
-        for page_num, page in enumerate(doc):
-            for field_name, replacement in modified_dict.items():
-                original_values = data_dict.get(field_name, [])
-                
-                for original in original_values:
-                    if not original:
-                        continue
-                        
-                    # Use PyMuPDF's search_for method to find text instances
-                    text_instances = page.search_for(original)
-                    
-                    if text_instances:
-                        print(f"Found {len(text_instances)} instances of '{original[:20]}...' on page {page_num+1}")
-                        
-                        # For each found text instance, add redaction annotation
-                        for inst in text_instances:
-                            # First, add the redaction annotation
-                            annot = page.add_redact_annot(inst, replacement)
-                            
-                            # Then apply the redaction with the replacement text
-                            page.apply_redactions()
-                            replacements_made += 1
+        with stage('pdf_redact'):
+            replacements_made = await run_pdf(apply_replacements, doc, modified_dict, field_values)
+        PAGES_PROCESSED.inc(pages)
 
-        print(f"Made a total of {replacements_made} replacements in the document")
+        logger.debug("Made a total of %d replacements in the document", replacements_made)
 
         # Save output
-        base_name = json_data.get('fileName', 'document.pdf')
-        output_path = json_data.get('outputPath', '')
-        out_name = f"{os.path.splitext(base_name)[0]}-output.pdf"
-        
-        # Use same directory structure as CSV handler
-        final_output_path = os.path.join(
-            output_path if output_path else os.path.join('..', 'client', 'public'),
-            out_name
-        )
-
-        # Ensure directory exists
-        os.makedirs(os.path.dirname(final_output_path), exist_ok=True)
-        
-        # Save the modified PDF
-        doc.save(final_output_path)
-        print(f"Saved modified PDF to {final_output_path}")
-        
-        # Close the document
-        doc.close()
-
-        return final_output_path
+        return await save_masked_pdf(doc, json_data)
 
     except Exception as e:
-        print(f"Error in maskobfpdf_async: {e}")
-        print(traceback.format_exc())
+        logger.error("Error in maskobfpdf_async: %s", e, exc_info=True)
         return str(e)
+    finally:
+        # The document reads file_bytes in place, so it must not outlive a mapped upload
+        if doc is not None:
+            await run_pdf(close_pdf, doc)
+
+async def save_masked_pdf(doc, json_data):
+    """
+    Saves a redacted document as <name>-output.pdf, or encrypted when json_data
+    has an encryptionKey, and closes it. Returns the output path.
+    """
+    base_name = json_data.get('fileName', 'document.pdf')
+    output_path = json_data.get('outputPath', '')
+    out_name = f"{os.path.splitext(base_name)[0]}-output.pdf"
+
+    # Fused pipeline: stream the redacted PDF straight into the encryptor
+    encryption_key = json_data.get('encryptionKey')
+    if encryption_key:
+        with stage('pdf_encrypt_save'):
+            final_output_path = await run_pdf(save_encrypted_pdf, doc, out_name, output_path, encryption_key)
+        await run_pdf(doc.close)
+        return final_output_path
+
+    # Use same directory structure as CSV handler
+    final_output_path = os.path.join(
+        output_path if output_path else settings.MASK_OUTPUT_FOLDER,
+        out_name
+    )
+
+    # Ensure directory exists
+    os.makedirs(os.path.dirname(final_output_path), exist_ok=True)
+
+    # Save the modified PDF
+    with stage('pdf_save'):
+        await run_pdf(doc.save, final_output_path)
+    logger.info("Saved modified PDF to %s", final_output_path)
+
+    # Close the document
+    await run_pdf(doc.close)
+
+    return final_output_path
+
+def save_encrypted_pdf(doc, out_name, output_path, encryption_key):
+    """
+    Saves the PyMuPDF document through the AES encryptor so no plaintext copy
+    is written to disk. Defaults to the secured files folder.
+    """
+    from aes.aes import encrypted_output, ensure_folder_exists
+    
+    output_folder = ensure_folder_exists(output_path or None)
+    final_output_path = os.path.join(output_folder, f"{out_name}.enc")
+    
+    # PyMuPDF needs a seekable target, so serialize in memory and stream that into the
+    # encryptor. PDF streams are already deflated, so skip the compression stage.
+    with encrypted_output(final_output_path, encryption_key) as stream:
+        stream.write(doc.tobytes())
+    
+    logger.info("Saved encrypted PDF to %s", final_output_path)
+    return final_output_path
+
+async def maskobfpdf_batch_async(json_data, sources):
+    """
+    Applies one field configuration to several PDFs (async version).
+    
+    Skips per-document header detection: the values of each configured field are
+    found in every document, pooled across documents and sent to the model as
+    shared, deduplicated batches, so model calls follow the distinct values, not
+    the number of files. Each value is replaced by its own counterpart wherever
+    it occurs. Does not touch data_dict, so it can run beside single-file requests.
+    
+    Args:
+        json_data (dict): Configuration with headers or policy, outputPath and optional encryptionKey
+        sources (list): (fileName, bytes, memoryview or BytesIO) pairs with distinct file names
+    
+    Returns:
+        list: Output paths, in the order of sources
+    """
+    from obfuscate.chat import obfuscate_values_async
+
+    def rewind(content):
+        if isinstance(content, BytesIO):
+            content.seek(0)
+        return content
+
+    policy = resolve_policy(json_data)
+
+    found = []
+    with stage('pdf_extract'):
+        for _, content in sources:
+            full_text = await run_pdf(extract_pdf_text, rewind(content))
+            found.append(policy.find_values(full_text))
+
+    async def replace_field(field):
+        pooled = [value for values in found for value in values.get(field.name, [])]
+        if field.mode == MASK:
+            return field.name, {value: mask_text(value) for value in pooled}
+        return field.name, await obfuscate_values_async(field.prompt, pooled)
+
+    with stage('pdf_fields'):
+        field_replacements = await asyncio.gather(*(replace_field(field) for field in policy.fields))
+
+    outputs = []
+    for done, ((filename, content), values) in enumerate(zip(sources, found)):
+        report_progress(done, len(sources), 'files')
+        replacements = {}
+        for name, mapping in field_replacements:
+            for value in values.get(name, []):
+                if value:
+                    replacements[value] = mapping.get(value, value)
+
+        with stage('pdf_open'):
+            doc, pages = await run_pdf(open_pdf, rewind(content))
+        try:
+            with stage('pdf_redact'):
+                replacements_made = await run_pdf(apply_value_replacements, doc, replacements)
+            PAGES_PROCESSED.inc(pages)
+            logger.debug("Made %d replacements in document %d of %d", replacements_made, done + 1, len(sources))
+            outputs.append(await save_masked_pdf(doc, dict(json_data, fileName=filename)))
+        finally:
+            await run_pdf(close_pdf, doc)
+    report_progress(len(sources), len(sources), 'files')
+    return outputs
 
 def maskobfpdf(json_data, file_bytes):
     """
@@ -430,9 +569,9 @@ def maskobfpdf(json_data, file_bytes):
         if isinstance(json_data.get('headers'), str):
             try:
                 json_data['headers'] = json.loads(json_data['headers'])
-                print(f"Parsed headers in maskobfpdf: {json_data['headers']}")
+                logger.debug("Parsed %d header fields in maskobfpdf", len(json_data['headers']))
             except json.JSONDecodeError as json_err:
-                print(f"Failed to parse headers JSON in maskobfpdf: {json_err}")
+                logger.warning("Failed to parse headers JSON in maskobfpdf: %s", json_err)
                 json_data['headers'] = []
                 
         # Get or create event loop
@@ -445,6 +584,5 @@ def maskobfpdf(json_data, file_bytes):
         # Run the async function
         return loop.run_until_complete(maskobfpdf_async(json_data, file_bytes))
     except Exception as e:
-        print(f"Error in maskobfpdf: {e}")
-        print(traceback.format_exc())
+        logger.error("Error in maskobfpdf: %s", e, exc_info=True)
         return str(e)
\ No newline at end of file
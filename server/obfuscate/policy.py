@@ -0,0 +1,429 @@
+import os
+import re
+import hmac
+import json
+import time
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+try:
+    import regex
+except ImportError:  # optional: without it user patterns run without a time limit
+    regex = None
+
+import settings
+from core.tracing import get_logger
+
+# -----------------------------
+# Masking policies compiled once and shared by the CSV and PDF handlers. A
+# policy is the endpoints' headers JSON, a list of fields:
+#   {"name": "Email", "mode": "mask" | "obfuscate", "prompt": "...",
+#    "match": "(?i)e-?mail.*",        optional regex for more column names
+#    "pattern": "[\\w.]+@[\\w.]+"}    optional regex that finds values in PDF text
+# Compiling resolves everything a request used to re-derive per call: modes are
+# checked, column matchers and value recognizers are compiled, masking becomes
+# a vectorized column transform, and the LLM backend is looked up once for
+# obfuscating policies. Column resolution is memoized per header row.
+# Ad-hoc headers are compiled on first use and kept in an LRU keyed by their
+# normalized JSON. Named templates are registered with POST /policies, stored
+# as JSON in POLICIES_FOLDER and referenced by requests with policy=<name>.
+# Only registered templates may carry match/pattern regexes. These are checked
+# for shapes that backtrack catastrophically (nested quantifiers, alternation
+# under a quantifier, backreferences). With the optional regex module
+# installed, each search is also given a time limit.
+#   POLICY_CACHE_SIZE       compiled ad-hoc policies kept (default 256)
+#   POLICY_TOKEN            required (as the token field) to replace a template;
+#                           unset, registered templates cannot be replaced over HTTP
+#   POLICY_PATTERN_TIMEOUT  seconds one search of a template regex may take (default 1)
+# -----------------------------
+
+MASK = 'mask'
+OBFUSCATE = 'obfuscate'
+MODES = (MASK, OBFUSCATE)
+# Blank placeholder the header endpoints put first for the UI
+PLACEHOLDER = ' '
+POLICY_NAME = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$')
+PATTERN_MAX_LENGTH = 256
+REPEATS = {sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, getattr(sre_parse, 'POSSESSIVE_REPEAT', None)} - {None}
+
+# Value recognizers for PDF text by field name, first keyword match wins
+RECOGNIZERS = [
+    (('email',), r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}', 0),
+    (('phone',), r'\b(?:\+\d{1,2}\s)?\(?\d{3}\)?[\s.-]?\d{3}[\s.-]?\d{4}\b', 0),
+    (('address',), r'\d+\s+\w+\s+(?:St|Street|Ave|Avenue|Rd|Road|Blvd|Boulevard|Dr|Drive|Ln|Lane)', re.IGNORECASE),
+    (('ssn', 'social security'), r'\b\d{3}[-\s]?\d{2}[-\s]?\d{4}\b', 0),
+    (('name',), r'Mr\.\s+\w+|Mrs\.\s+\w+|Ms\.\s+\w+|Dr\.\s+\w+|\b[A-Z][a-z]+\s+[A-Z][a-z]+\b', 0),
+]
+
+logger = get_logger('policy')
+
+
+class PolicyError(ValueError):
+    """Raised for malformed policies and unknown policy names"""
+
+
+class PolicyConflict(PolicyError):
+    """Raised when a registered template would be replaced without the policy token"""
+
+
+def _check_nodes(nodes, repeated=False):
+    """Raises PolicyError for constructs that can backtrack exponentially"""
+    for op, arg in nodes:
+        if op in (sre_parse.GROUPREF, sre_parse.GROUPREF_EXISTS):
+            raise PolicyError("backreferences are not allowed")
+        if op in REPEATS:
+            low, high, body = arg
+            if high > 1:
+                if repeated:
+                    raise PolicyError("nested quantifiers are not allowed")
+                _check_nodes(body, True)
+            else:
+                _check_nodes(body, repeated)
+        elif op is sre_parse.BRANCH:
+            if repeated:
+                raise PolicyError("alternation inside a repeated group is not allowed")
+            for branch in arg[1]:
+                _check_nodes(branch, repeated)
+        elif op is sre_parse.SUBPATTERN:
+            _check_nodes(arg[-1], repeated)
+        elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            _check_nodes(arg[1], repeated)
+        elif op is getattr(sre_parse, 'ATOMIC_GROUP', None):
+            _check_nodes(arg, repeated)
+
+
+def compile_user_pattern(pattern):
+    """
+    Compiles a regex from a policy template after checking its size and shape;
+    with the regex module it is compiled there, so searches can be time-limited
+    """
+    if not isinstance(pattern, str) or len(pattern) > PATTERN_MAX_LENGTH:
+        raise PolicyError(f"patterns are strings of at most {PATTERN_MAX_LENGTH} characters")
+    errors = (re.error, regex.error) if regex is not None else (re.error,)
+    try:
+        _check_nodes(sre_parse.parse(pattern))
+        return regex.compile(pattern) if regex is not None else re.compile(pattern)
+    except errors as e:
+        raise PolicyError(str(e))
+
+
+def pattern_timeout():
+    return float(os.getenv("POLICY_PATTERN_TIMEOUT", "1"))
+
+
+@lru_cache(maxsize=256)
+def recognizer_for(name):
+    """Compiled pattern that finds values of a field in document text, or None"""
+    lowered = name.lower()
+    for keywords, pattern, flags in RECOGNIZERS:
+        if any(keyword in lowered for keyword in keywords):
+            return re.compile(pattern, flags)
+    return None
+
+
+def mask_text(value):
+    return '#' * len(value)
+
+
+def mask_series(series):
+    """'#' for every character of each value's text, computed once per distinct length"""
+    lengths = series.astype(str).str.len()
+    return lengths.map({length: '#' * length for length in lengths.unique()})
+
+
+class CompiledField:
+    """One field of a policy with its matcher and recognizer compiled"""
+
+    def __init__(self, name, mode, prompt='', match=None, pattern=None):
+        self.name = name
+        self.mode = mode
+        self.prompt = prompt or ''
+        self.match = match
+        self.pattern = pattern
+        try:
+            self.matcher = compile_user_pattern(match) if match else None
+            self.recognizer = compile_user_pattern(pattern) if pattern else recognizer_for(name)
+        except PolicyError as e:
+            raise PolicyError(f"Invalid pattern for field {name}: {e}")
+
+    def _search(self, compiled, method, text):
+        # Only template patterns are compiled with the regex module, which takes a timeout
+        if regex is None or not isinstance(compiled, regex.Pattern):
+            return getattr(compiled, method)(text)
+        try:
+            return getattr(compiled, method)(text, timeout=pattern_timeout())
+        except TimeoutError:
+            # Failing beats handing back a document with the field's values left in
+            raise PolicyError(f"Pattern for field {self.name} took longer than {pattern_timeout()}s")
+
+    def matches(self, column):
+        return column == self.name or (self.matcher is not None and
+                                       self._search(self.matcher, 'fullmatch', str(column)) is not None)
+
+    def find(self, text):
+        """Values of this field in document text"""
+        return self._search(self.recognizer, 'findall', text) if self.recognizer is not None else []
+
+    def to_dict(self):
+        field = {'name': self.name, 'mode': self.mode, 'prompt': self.prompt}
+        if self.match:
+            field['match'] = self.match
+        if self.pattern:
+            field['pattern'] = self.pattern
+        return field
+
+
+class CompiledPolicy:
+    """Executable form of a field configuration, safe to share between concurrent requests"""
+
+    def __init__(self, fields, name=None, description='', version=None):
+        self.fields = fields
+        self.name = name
+        self.description = description
+        self.version = version
+        self.obfuscating = any(field.mode == OBFUSCATE for field in fields)
+        self._backend = None
+        self._resolved = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self):
+        """LLM backend the policy's obfuscated fields go to; None when nothing is obfuscated"""
+        if self.obfuscating and self._backend is None:
+            from obfuscate.llmclient import get_client
+            self._backend = get_client().backend.name
+        return self._backend
+
+    def config(self):
+        """The fields as headers JSON, e.g. for cache and checkpoint keys"""
+        return [field.to_dict() for field in self.fields]
+
+    def resolve(self, columns):
+        """
+        (column, field) pairs for a header row: a column is taken by the field
+        named after it, else by the first field whose matcher accepts it. Fields
+        that take no column are logged once per header row.
+        """
+        key = tuple(columns)
+        with self._lock:
+            resolved = self._resolved.get(key)
+            if resolved is not None:
+                self._resolved.move_to_end(key)
+                return resolved
+
+        by_name = {field.name: field for field in self.fields}
+        resolved = []
+        used = set()
+        for column in key:
+            field = by_name.get(column) or next((f for f in self.fields if f.matches(column)), None)
+            if field is not None:
+                resolved.append((column, field))
+                used.add(field.name)
+        for field in self.fields:
+            if field.name not in used:
+                logger.warning("Column '%s' not found in file. Skipping.", field.name)
+
+        with self._lock:
+            self._resolved[key] = resolved
+            if len(self._resolved) > 64:
+                self._resolved.popitem(last=False)
+        return resolved
+
+    def find_values(self, text):
+        """{field name: [values]} found in document text by each field's recognizer"""
+        return {field.name: field.find(text) for field in self.fields}
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'description': self.description,
+            'version': self.version,
+            'fields': self.config(),
+            'obfuscating': self.obfuscating,
+        }
+
+
+def parse_fields(headers):
+    """Headers JSON (string, list or {"headers": [...]}) as a list"""
+    if isinstance(headers, str):
+        try:
+            headers = json.loads(headers)
+        except json.JSONDecodeError as e:
+            raise PolicyError(f"Invalid headers JSON: {e}")
+    if isinstance(headers, dict):
+        headers = headers.get('headers', headers.get('fields', []))
+    if not isinstance(headers, list):
+        raise PolicyError(f"Expected a list of fields, got {type(headers).__name__}")
+    return headers
+
+
+def compile_policy(headers, name=None, description='', version=None, strict=False, allow_patterns=False):
+    """
+    Compiles headers JSON into a CompiledPolicy. Fields without a name or with
+    an unknown mode are skipped with a warning, or rejected when strict.
+    match/pattern regexes are only accepted with allow_patterns (templates).
+    """
+    fields = []
+    for field in parse_fields(headers):
+        if not isinstance(field, dict) or not field.get('name') or field['name'] == PLACEHOLDER:
+            if strict:
+                raise PolicyError(f"Every field needs a name: {field!r}")
+            continue
+        if not allow_patterns and (field.get('match') or field.get('pattern')):
+            raise PolicyError(f"Field {field['name']}: match and pattern are only allowed in registered policies")
+        if field.get('mode') not in MODES:
+            if strict:
+                raise PolicyError(f"Unknown mode {field.get('mode')!r} for field {field['name']}")
+            logger.warning("Unknown mode %s for field %s", field.get('mode'), field['name'])
+            continue
+        fields.append(CompiledField(field['name'], field['mode'], field.get('prompt'),
+                                    field.get('match'), field.get('pattern')))
+    if strict and not fields:
+        raise PolicyError("A policy needs at least one field")
+    return CompiledPolicy(fields, name, description, version)
+
+
+_compiled = OrderedDict()
+_compiled_lock = threading.Lock()
+
+
+def cached_policy(headers):
+    """Compiled policy for ad-hoc headers, shared by every request that sends the same configuration"""
+    from core.resultcache import normalize_headers
+
+    key = normalize_headers(parse_fields(headers))
+    with _compiled_lock:
+        policy = _compiled.get(key)
+        if policy is not None:
+            _compiled.move_to_end(key)
+            return policy
+    policy = compile_policy(json.loads(key))
+    with _compiled_lock:
+        _compiled[key] = policy
+        while len(_compiled) > int(os.getenv("POLICY_CACHE_SIZE", "256")):
+            _compiled.popitem(last=False)
+    return policy
+
+
+class PolicyRegistry:
+    """Named policy templates stored as JSON files; compiled once per file version"""
+
+    def __init__(self, folder=settings.POLICIES_FOLDER):
+        self.folder = folder
+        self._policies = {}
+        self._lock = threading.Lock()
+
+    def _path(self, name):
+        return os.path.join(self.folder, f"{name}.json")
+
+    def register(self, name, headers, description='', token=None):
+        """
+        Validates, compiles and stores a template. Replacing one of the same
+        name takes the POLICY_TOKEN; without a configured token it is refused.
+        """
+        if not name or not POLICY_NAME.match(name):
+            raise PolicyError("Policy names are 1-64 letters, digits, '.', '_' or '-'")
+        policy = compile_policy(headers, name, description, strict=True, allow_patterns=True)
+        os.makedirs(self.folder, exist_ok=True)
+        with self._lock:
+            path = self._path(name)
+            policy.version = 1
+            if os.path.exists(path):
+                expected = os.getenv("POLICY_TOKEN", "")
+                if not expected or not hmac.compare_digest((token or '').encode('utf-8'), expected.encode('utf-8')):
+                    raise PolicyConflict(f"Policy {name} already exists; replacing it needs the policy token")
+                with open(path, 'r', encoding='utf-8') as f:
+                    policy.version = (json.load(f).get('version') or 0) + 1
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({'name': name, 'description': description, 'version': policy.version,
+                           'fields': policy.config(), 'updated': time.time()}, f, indent=2)
+            os.replace(temp_path, path)
+            self._policies[name] = (os.stat(path).st_mtime_ns, policy)
+        logger.info("Registered policy %s version %d with %d fields", name, policy.version, len(policy.fields))
+        return policy
+
+    def _load(self, name):
+        """Compiled template, recompiled only when its file changed (e.g. registered by another worker)"""
+        path = self._path(name)
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            self._policies.pop(name, None)
+            return None
+        cached = self._policies.get(name)
+        if cached is not None and cached[0] == mtime_ns:
+            return cached[1]
+        with open(path, 'r', encoding='utf-8') as f:
+            stored = json.load(f)
+        policy = compile_policy(stored['fields'], name, stored.get('description', ''), stored.get('version'),
+                                allow_patterns=True)
+        self._policies[name] = (mtime_ns, policy)
+        return policy
+
+    def get(self, name):
+        if not name or not POLICY_NAME.match(name):
+            return None
+        with self._lock:
+            return self._load(name)
+
+    def list(self):
+        try:
+            names = sorted(entry[:-5] for entry in os.listdir(self.folder) if entry.endswith('.json'))
+        except OSError:
+            return []
+        policies = []
+        for name in names:
+            try:
+                policy = self.get(name)
+            except PolicyError as e:
+                # e.g. a template stored before its patterns were checked
+                logger.warning("Skipping policy %s: %s", name, e)
+                continue
+            if policy is not None:
+                policies.append(policy)
+        return policies
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_policy_registry():
+    """Returns the process-wide policy registry"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = PolicyRegistry()
+    return _registry
+
+
+def request_policy(name=None, headers=None):
+    """The compiled policy a request refers to: a registered template by name, else its headers"""
+    if name:
+        policy = get_policy_registry().get(name)
+        if policy is None:
+            raise PolicyError(f"Unknown policy: {name}")
+        return policy
+    if headers is None:
+        raise PolicyError("Missing headers or policy")
+    return cached_policy(headers)
+
+
+def resolve_policy(json_data):
+    """
+    Compiled policy of a handler configuration: json_data['policy'] is either a
+    CompiledPolicy already resolved by the controller or a template name;
+    without it the headers are compiled (and cached).
+    """
+    policy = json_data.get('policy')
+    if isinstance(policy, CompiledPolicy):
+        return policy
+    return request_policy(policy, json_data.get('headers', []))
@@ -0,0 +1,141 @@
+import os
+import gc
+import sys
+import time
+import signal
+import socket
+import argparse
+import importlib
+
+# -----------------------------
+# Preforking server: the Flask app and the heavy per-subsystem modules (pandas,
+# PyMuPDF, PyPDF2, pydantic, ...) are imported once in the parent, which then
+# forks workers that share the listening socket. Pages loaded before the fork
+# are shared copy-on-write, so each worker costs little extra memory and starts
+# serving at once. POSIX only. Run:
+#   python prefork.py --workers 4 --bind 127.0.0.1:5000
+# Worker 0 of the first generation resumes persisted jobs and runs the result
+# sweeper; the others only pick up the jobs they queue themselves. Cancel
+# requests go through the shared job database, so any worker can take them.
+# -----------------------------
+
+# Imported before forking; modules the workers import lazily on first use
+WARM_MODULES = [
+    'pandas',
+    'fitz',
+    'PyPDF2',
+    'pydantic',
+    'obfuscate.csvhandler',
+    'obfuscate.pdfhandler',
+    'obfuscate.chat',
+    'aes.archive',
+]
+
+
+def warm_modules(modules=WARM_MODULES):
+    """Imports modules so forked workers inherit them; returns the seconds spent"""
+    start = time.perf_counter()
+    for name in modules:
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            print(f"Not preloading {name}: {e}", file=sys.stderr)
+    return time.perf_counter() - start
+
+
+def listen(bind, backlog=128):
+    host, _, port = bind.rpartition(':')
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host or '127.0.0.1', int(port)))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def serve_worker(app, sock, index, first_generation):
+    """Runs in the forked child: serves requests from the shared socket until killed"""
+    from werkzeug.serving import make_server
+    from core.jobs import get_job_manager
+    from core.results import start_sweeper
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    if index == 0 and first_generation:
+        get_job_manager()
+        start_sweeper()
+    else:
+        get_job_manager(resume=False)
+    host, port = sock.getsockname()[:2]
+    server = make_server(host, port, app, threaded=True, fd=sock.fileno())
+    server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Preforking server for the Flask app")
+    parser.add_argument('--bind', default='127.0.0.1:5000')
+    parser.add_argument('--workers', type=int, default=int(os.getenv("PREFORK_WORKERS", str(os.cpu_count() or 2))))
+    parser.add_argument('--no-warm', action='store_true', help="fork without preloading the heavy modules")
+    args = parser.parse_args(argv)
+
+    if not hasattr(os, 'fork'):
+        parser.error("prefork mode needs os.fork(); use server.py or asgi.py on this platform")
+
+    start = time.perf_counter()
+    from server import app
+    warmed = 0.0 if args.no_warm else warm_modules()
+    # Objects that exist now are never collected again, so the collector does not
+    # touch (and un-share) their pages in the workers
+    gc.collect()
+    gc.freeze()
+    sock = listen(args.bind)
+    print(f"Loaded app in {time.perf_counter() - start:.2f}s (preloading {warmed:.2f}s), "
+          f"forking {args.workers} workers on {args.bind}")
+
+    children = {}
+
+    def spawn(index, first_generation):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                serve_worker(app, sock, index, first_generation)
+            finally:
+                os._exit(1)
+        children[pid] = index
+
+    for index in range(args.workers):
+        spawn(index, True)
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    # Replace workers that die until asked to stop
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        index = children.pop(pid, None)
+        if index is not None and not stopping:
+            print(f"Worker {index} (pid {pid}) exited with status {status}, restarting", file=sys.stderr)
+            time.sleep(0.5)
+            spawn(index, False)
+    sock.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,34 +1,140 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Request, Response, request, jsonify, send_file, g
 import os
+import time
+import threading
 from flask_cors import CORS
 from pathlib import Path
 
-from controller.csvhandler_controller import mask_obfuscate_csv, getcsvheader
-from controller.pdfhandler_controller import maskpdf, getpdfheader
-from controller.aeshandler_controller import encrypt_route, decrypt_route
+import settings
+
+from controller.csvhandler_controller import mask_obfuscate_csv, mask_obfuscate_csv_batch, getcsvheader
+from controller.pdfhandler_controller import maskpdf, maskpdf_batch, getpdfheader
+from controller.aeshandler_controller import encrypt_route, decrypt_route, list_archive_route
+from controller.jobs_controller import job_status, cancel_job, job_result
+from controller.policy_controller import register_policy, list_policies, get_policy
+from core.jobs import get_job_manager
+from core.results import result_path, start_sweeper
+from core import metrics
+from core.tracing import TRACE_HEADER, start_trace, finish_span, export_chrome_trace, trace_export_enabled
+from core.profiling import (PROFILE_HEADER, PROFILE_PARAM, PROFILE_ID_HEADER, ProfileSession,
+                            profile_requested, profiling_enabled, find_profile)
+from core.uploads import (MAX_UPLOAD_BYTES, UploadRejected, reserve_upload, release_upload,
+                          spooled_stream_factory)
+from core.admission import (AdmissionRejected, api_key_header, endpoint_pool,
+                            get_admission_controller)
 
 
 # Configure upload and secured files directories
-BASE_DIR = Path(__file__).resolve().parent
-UPLOAD_FOLDER = os.path.join(BASE_DIR, 'temp_uploads')
-SECURED_FILES_FOLDER = os.path.join(BASE_DIR, 'secured_files')
+UPLOAD_FOLDER = settings.UPLOAD_FOLDER
+SECURED_FILES_FOLDER = settings.SECURED_FILES_FOLDER
 
 # Ensure both directories exist
-for folder in [UPLOAD_FOLDER, SECURED_FILES_FOLDER]:
-    if not os.path.exists(folder):
-        os.makedirs(folder)
+settings.ensure_folders()
+
+class SpooledRequest(Request):
+    """Spools uploads to memory up to UPLOAD_SPOOL_BYTES, then to a temp file"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return spooled_stream_factory(total_content_length, content_type, filename, content_length)
+
 
 app = Flask(__name__)
+app.request_class = SpooledRequest
 CORS(app, resources={
     r"/*": {
-        "origins": ["http://localhost:3000"],
+        "origins": settings.CORS_ORIGINS,
         "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type"]
+        "allow_headers": ["Content-Type", api_key_header()]
     }
 })
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['SECURED_FILES_FOLDER'] = SECURED_FILES_FOLDER
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    # Each request is a trace; clients may pass their own id to correlate logs
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.trace_span, g.trace_token = start_trace(f"{request.method} {endpoint}", request.headers.get(TRACE_HEADER))
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - g.get('request_start', time.perf_counter()),
+                                         endpoint=endpoint, method=request.method,
+                                         status=str(response.status_code))
+    if 'trace_span' in g:
+        response.headers[TRACE_HEADER] = g.trace_span.trace_id
+    return response
+
+
+# Upload endpoints wait for a slot in the interactive or batch pool, fairly per
+# client; full queues answer 429 with Retry-After before the body is read
+@app.before_request
+def admit_request():
+    controller = get_admission_controller()
+    pool = endpoint_pool(request.url_rule.rule) if request.url_rule else None
+    if controller is None or pool is None or request.method != 'POST':
+        return None
+    try:
+        ticket = controller.admit(pool, request.headers.get(api_key_header()), request.remote_addr)
+    except AdmissionRejected as e:
+        response = jsonify({'error': str(e)})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, e.status
+    g.admission = (controller, ticket)
+
+@app.teardown_request
+def release_admission(exc):
+    if 'admission' in g:
+        controller, ticket = g.pop('admission')
+        controller.release(ticket)
+
+
+# Upload budgets are checked from Content-Length before the body is read
+@app.before_request
+def reserve_upload_budget():
+    try:
+        g.upload_reserved = reserve_upload(request.content_length if request.method == 'POST' else 0)
+    except UploadRejected as e:
+        response = jsonify({'error': str(e)})
+        if e.retry_after:
+            response.headers['Retry-After'] = str(e.retry_after)
+        return response, e.status
+
+@app.teardown_request
+def release_upload_budget(exc):
+    release_upload(g.pop('upload_reserved', 0))
+
+@app.teardown_request
+def finish_request_trace(exc):
+    if 'trace_span' in g:
+        finish_span(g.pop('trace_span'), g.pop('trace_token'))
+
+
+# Opt-in profiling (PROFILING=1): X-Profile: 1 or ?profile=1 profiles one request
+@app.before_request
+def start_profile():
+    if profile_requested(request.headers.get(PROFILE_HEADER) or request.args.get(PROFILE_PARAM)):
+        g.profile = ProfileSession(g.trace_span.name, g.trace_span.trace_id).start()
+
+@app.after_request
+def finish_profile(response):
+    if 'profile' in g:
+        session = g.pop('profile')
+        session.finish(response.status_code)
+        response.headers[PROFILE_ID_HEADER] = session.profile_id
+    return response
+
+@app.teardown_request
+def abandon_profile(exc):
+    # Requests that never reached after_request still release tracemalloc
+    if 'profile' in g:
+        g.pop('profile').finish()
+
 
 # csv routes
 @app.route("/getcsvheader", methods=['POST'])
@@ -39,6 +145,10 @@ def get_csv_header_route():
 def mask_csv_route():
     return mask_obfuscate_csv()
 
+@app.route("/maskobfcsv/batch", methods=['POST'])
+def mask_csv_batch_route():
+    return mask_obfuscate_csv_batch()
+
 
 # pdf routes
 @app.route("/getpdfheader", methods=['POST'])
@@ -49,6 +159,10 @@ def get_pdf_header_route():
 def mask_pdf_route():
     return maskpdf()
 
+@app.route("/maskobfpdf/batch", methods=['POST'])
+def mask_pdf_batch_route():
+    return maskpdf_batch()
+
 # encryption routes
 @app.route("/encryptfile", methods=['POST'])
 def encrypt_file_route():
@@ -58,38 +172,87 @@ def encrypt_file_route():
 def decrypt_file_route():
     return decrypt_route()
 
+@app.route("/listarchive", methods=['POST'])
+def list_archive_file_route():
+    return list_archive_route()
+
+
+# masking policy routes
+@app.route("/policies", methods=['GET'])
+def list_policies_route():
+    return list_policies()
+
+@app.route("/policies", methods=['POST'])
+def register_policy_route():
+    return register_policy()
+
+@app.route("/policies/<name>", methods=['GET'])
+def get_policy_route(name):
+    return get_policy(name)
+
+
+# background job routes
+@app.route("/jobs/<job_id>", methods=['GET'])
+def job_status_route(job_id):
+    return job_status(job_id)
+
+@app.route("/jobs/<job_id>/cancel", methods=['POST'])
+def cancel_job_route(job_id):
+    return cancel_job(job_id)
+
+@app.route("/jobs/<job_id>/result", methods=['GET'])
+def job_result_route(job_id):
+    return job_result(job_id)
+
+
+# Prometheus metrics
+@app.route("/metrics", methods=['GET'])
+def metrics_route():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+# Recent spans in the Chrome trace event format (chrome://tracing, Perfetto)
+@app.route("/traces", methods=['GET'])
+def traces_route():
+    if not trace_export_enabled():
+        return jsonify({'error': 'Trace export is disabled'}), 404
+    return jsonify(export_chrome_trace(request.args.get('traceId')))
+
+
+# Profile artifacts: the JSON summary, or the merged cProfile stats for pstats/snakeviz
+@app.route("/profiles/<profile_id>", methods=['GET'])
+def profile_summary_route(profile_id):
+    path = find_profile(profile_id) if profiling_enabled() else None
+    if path is None:
+        return jsonify({'error': 'Profile not found'}), 404
+    return send_file(path, mimetype='application/json', max_age=0)
+
+@app.route("/profiles/<profile_id>/pstats", methods=['GET'])
+def profile_stats_route(profile_id):
+    path = find_profile(profile_id, 'pstats') if profiling_enabled() else None
+    if path is None:
+        return jsonify({'error': 'Profile not found'}), 404
+    return send_file(path, as_attachment=True, download_name=f'{profile_id}.prof', max_age=0)
+
 
 # File Download route
 @app.route("/api/files/download/<filename>", methods=['GET'])
 def download_file(filename):
-    try:
-        file_path = os.path.join(app.config['SECURED_FILES_FOLDER'], filename)
-        
-        # First check if file exists
-        if not os.path.exists(file_path):
-            return jsonify({'error': 'File not found'}), 404
-
-        # Send file to client
-        response = send_from_directory(
-            app.config['SECURED_FILES_FOLDER'],
-            filename,
-            as_attachment=True
-        )
-        
-        # Delete the file after sending
-        @response.call_on_close
-        def on_close():
-            try:
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                    print(f"File {filename} has been removed after download")
-            except Exception as e:
-                print(f"Error removing file {filename}: {str(e)}")
-                
-        return response
-    except Exception as e:
-        return jsonify({'error': str(e)}), 404
+    file_path = result_path(filename)
+    if file_path is None:
+        return jsonify({'error': 'File not found'}), 404
+
+    # Results stay until the sweeper expires them, so interrupted downloads can
+    # resume with Range requests; ETag/Last-Modified answer conditional requests
+    return send_file(file_path, as_attachment=True, conditional=True, etag=True, max_age=0)
 
 
 if __name__ == "__main__":
+    # Pick up jobs that were queued or running when the server last stopped
+    get_job_manager()
+    start_sweeper()
+    # Optionally load the LLM backend (e.g. the local model) before the first request
+    if os.getenv("LLM_WARMUP", "").lower() in ("1", "true", "yes"):
+        from obfuscate.llmclient import get_client
+        threading.Thread(target=get_client().backend.warmup, daemon=True).start()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,26 @@
+import os
+from pathlib import Path
+from dotenv import load_dotenv
+
+# Environment settings are read lazily by each subsystem; .env only fills in unset ones
+load_dotenv(".env")
+
+# Folder configuration shared by the Flask and ASGI servers
+BASE_DIR = Path(__file__).resolve().parent
+UPLOAD_FOLDER = os.path.join(BASE_DIR, 'temp_uploads')
+SECURED_FILES_FOLDER = os.path.join(BASE_DIR, 'secured_files')
+JOBS_FOLDER = os.path.join(BASE_DIR, 'jobs')
+PROFILES_FOLDER = os.path.join(BASE_DIR, 'profiles')
+POLICIES_FOLDER = os.path.join(BASE_DIR, 'policies')
+# Masked outputs go to the client's public folder unless a request sets outputPath
+MASK_OUTPUT_FOLDER = os.path.join(BASE_DIR.parent, 'client', 'public')
+
+# Origins allowed to call the API from a browser
+CORS_ORIGINS = ["http://localhost:3000"]
+
+
+def ensure_folders():
+    """Creates the upload and secured files folders if they are missing"""
+    for folder in [UPLOAD_FOLDER, SECURED_FILES_FOLDER]:
+        if not os.path.exists(folder):
+            os.makedirs(folder)
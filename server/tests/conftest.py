@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The server modules import each other from the server folder (e.g. `import settings`)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
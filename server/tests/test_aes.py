@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+from aes import aes
+from aes.aes import SALT_SIZE, decrypt_file, encrypt_file
+from aes.archive import ARCHIVE_MAGIC, ARCHIVE_VERSION, FOOTER, list_archive
+
+
+@pytest.mark.parametrize('content', [b'name,email\n' * 50000, os.urandom(300000)])
+@pytest.mark.parametrize('compress', [False, True])
+def test_encrypt_file_round_trip(tmp_path, content, compress):
+    source = tmp_path / 'data.csv'
+    source.write_bytes(content)
+    encrypted = encrypt_file(str(source), 'password', str(tmp_path / 'secured'), compress=compress)
+    decrypted = decrypt_file(encrypted, 'password', str(tmp_path / 'plain'))
+    assert open(decrypted, 'rb').read() == content
+
+
+def test_failed_encryption_leaves_no_partial_output(tmp_path, monkeypatch):
+    source = tmp_path / 'data.csv'
+    source.write_bytes(b'x' * (aes.CHUNK_SIZE * 3))
+
+    def cancelled(done, total=None, unit=None):
+        if done > aes.CHUNK_SIZE:
+            raise RuntimeError("cancelled")
+
+    monkeypatch.setattr(aes, 'report_progress', cancelled)
+    with pytest.raises(RuntimeError):
+        encrypt_file(str(source), 'password', str(tmp_path / 'secured'))
+    assert os.listdir(tmp_path / 'secured') == []
+
+
+def test_failure_before_writing_keeps_the_previous_output(tmp_path, monkeypatch):
+    source = tmp_path / 'data.csv'
+    source.write_bytes(b'name,email\n' * 1000)
+    encrypted = encrypt_file(str(source), 'password', str(tmp_path / 'secured'))
+
+    def broken(sample):
+        raise OSError("read failed")
+
+    monkeypatch.setattr(aes, 'is_compressible', broken)
+    with pytest.raises(OSError):
+        encrypt_file(str(source), 'password', str(tmp_path / 'secured'), compress=True)
+    assert decrypt_file(encrypted, 'password', str(tmp_path / 'plain'))
+
+
+@pytest.mark.parametrize('content', [
+    b'',
+    ARCHIVE_MAGIC[:2],
+    ARCHIVE_MAGIC,
+    ARCHIVE_MAGIC + bytes([ARCHIVE_VERSION]) + b'salt',
+    # A whole header, but no room left for the footer
+    ARCHIVE_MAGIC + bytes([ARCHIVE_VERSION]) + b'\0' * (SALT_SIZE + FOOTER.size - 1),
+])
+def test_short_input_is_not_an_archive(tmp_path, content):
+    path = tmp_path / 'short.obsa'
+    path.write_bytes(content)
+    with pytest.raises(ValueError, match='Not an encrypted archive'):
+        list_archive(str(path), 'password')
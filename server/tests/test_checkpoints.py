@@ -0,0 +1,70 @@
+import io
+import asyncio
+
+import pytest
+
+from core import checkpoints
+from core.checkpoints import CheckpointStore, scan_rows
+from obfuscate.csvhandler import maskobfcsv_incremental_async
+
+HEADERS = [{'name': 'Email', 'mode': 'mask'}]
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = CheckpointStore(str(tmp_path / 'checkpoints.db'))
+    monkeypatch.setattr(checkpoints, '_store', store)
+    yield store
+    store.close()
+
+
+def rows(start, end):
+    return ''.join(f'N{i},user{i}@example.com\n' for i in range(start, end))
+
+
+def mask(tmp_path, file_name, content, source_id='feed'):
+    config = {'fileName': file_name, 'headers': HEADERS, 'outputPath': str(tmp_path / 'out')}
+    return asyncio.run(maskobfcsv_incremental_async(config, content, source_id))
+
+
+def test_drops_under_new_names_append_to_the_first_output(tmp_path, store):
+    day1 = 'Name,Email\n' + rows(0, 100)
+    output, summary = mask(tmp_path, 'day1.csv', day1)
+    assert summary['mode'] == 'full' and summary['rowCount'] == 100
+
+    day2 = day1 + rows(100, 105)
+    appended, summary = mask(tmp_path, 'day2.csv', day2)
+    assert appended == output
+    assert summary['mode'] == 'append' and summary['rowsAppended'] == 5 and summary['rowCount'] == 105
+
+    _, summary = mask(tmp_path, 'day3.csv', day2)
+    assert summary['mode'] == 'unchanged' and summary['rowsAppended'] == 0
+
+    lines = open(output, encoding='utf-8').read().splitlines()
+    assert lines[0] == 'Name,Email'
+    assert len(lines) == 106
+    assert lines[-1] == 'N104,' + '#' * len('user104@example.com')
+    assert not (tmp_path / 'out' / 'day2-output.csv').exists()
+
+
+def test_edited_prefix_runs_in_full(tmp_path, store):
+    mask(tmp_path, 'day1.csv', 'Name,Email\n' + rows(0, 10))
+    _, summary = mask(tmp_path, 'day2.csv', 'Name,Email\n' + rows(1, 12))
+    assert summary['mode'] == 'full' and summary['reason'] == 'processed prefix changed'
+
+
+def test_unterminated_last_row_waits_for_its_newline(tmp_path, store):
+    content = 'Name,Email\n' + rows(0, 10)
+    _, summary = mask(tmp_path, 'feed.csv', content)
+    _, summary = mask(tmp_path, 'feed.csv', content + 'N10,partial@exam')
+    assert summary['mode'] == 'unchanged'
+    _, summary = mask(tmp_path, 'feed.csv', content + 'N10,partial@example.com\n')
+    assert summary['mode'] == 'append' and summary['rowsAppended'] == 1
+
+
+def test_scan_rows_hashes_the_prefix_on_row_ends():
+    data = b'a,b\n1,2\n3,4\n5,'
+    scan = scan_rows(io.BytesIO(data), offset=8)
+    assert scan['end'] == 12 and scan['size'] == len(data) and scan['lines'] == 3
+    assert scan['prefixHash'] == scan_rows(io.BytesIO(data[:8]))['hash']
+    assert scan_rows(io.BytesIO(data), offset=6)['prefixHash'] is None
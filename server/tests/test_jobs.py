@@ -0,0 +1,104 @@
+import time
+import asyncio
+import threading
+
+import pytest
+from werkzeug.datastructures import MultiDict
+
+from core import jobs
+from core.jobs import JobManager, register_job_kind, report_progress, CANCELLED, QUEUED, RUNNING, SUCCEEDED
+
+started = threading.Event()
+release = threading.Event()
+
+
+async def spin(form, files):
+    # Reports progress until cancelled; gives up after a few seconds
+    started.set()
+    deadline = time.monotonic() + 5
+    done = 0
+    while time.monotonic() < deadline:
+        done += 1
+        report_progress(done, unit='rows')
+        await asyncio.sleep(0.01)
+    return {'done': done}, 200
+
+
+async def wait(form, files):
+    release.wait(5)
+    return {}, 200
+
+
+@pytest.fixture
+def managers(tmp_path, monkeypatch):
+    """Two managers on one folder, as two prefork workers would be"""
+    started.clear()
+    release.clear()
+    register_job_kind('test-spin', spin)
+    register_job_kind('test-wait', wait)
+    owner = JobManager(str(tmp_path), workers=1)
+    other = JobManager(str(tmp_path), workers=1)
+    yield owner, other
+    release.set()
+    for manager in (owner, other):
+        manager._executor.shutdown(wait=True)
+    jobs._job_kinds.pop('test-spin', None)
+    jobs._job_kinds.pop('test-wait', None)
+
+
+def wait_for_status(manager, job_id, status):
+    deadline = time.monotonic() + 5
+    while manager.get(job_id)['status'] != status:
+        assert time.monotonic() < deadline, manager.get(job_id)
+        time.sleep(0.01)
+
+
+def test_cancel_reaches_a_job_running_in_another_process(managers):
+    owner, other = managers
+    job_id = owner.submit('test-spin', MultiDict(), MultiDict())
+    assert started.wait(5)
+    wait_for_status(other, job_id, RUNNING)
+
+    job = other.cancel(job_id)
+    assert job['status'] == RUNNING
+    assert job['cancelRequested'] is True
+
+    wait_for_status(owner, job_id, CANCELLED)
+    assert other.get(job_id)['status'] == CANCELLED
+
+
+def test_cancel_of_a_queued_job_from_another_process(managers):
+    owner, other = managers
+    # The single worker is busy, so the second job stays queued
+    owner.submit('test-wait', MultiDict(), MultiDict())
+    job_id = owner.submit('test-spin', MultiDict(), MultiDict())
+    assert owner.get(job_id)['status'] == QUEUED
+
+    assert other.cancel(job_id)['status'] == CANCELLED
+    release.set()
+    owner._executor.shutdown(wait=True)
+    assert owner.get(job_id)['status'] == CANCELLED
+    assert not started.is_set()
+
+
+def test_cancel_controller_reports_pending_and_finished(managers, monkeypatch):
+    from controller import jobs_controller
+
+    owner, other = managers
+    monkeypatch.setattr(jobs_controller, 'get_job_manager', lambda: other)
+    job_id = owner.submit('test-spin', MultiDict(), MultiDict())
+    assert started.wait(5)
+    wait_for_status(other, job_id, RUNNING)
+
+    payload, status = asyncio.run(jobs_controller.cancel_job_async(job_id))
+    assert (status, payload['status']) == (202, 'cancelPending')
+
+    wait_for_status(owner, job_id, CANCELLED)
+    payload, status = asyncio.run(jobs_controller.cancel_job_async(job_id))
+    assert (status, payload['status']) == (200, CANCELLED)
+
+    done_id = owner.submit('test-wait', MultiDict(), MultiDict())
+    release.set()
+    wait_for_status(owner, done_id, SUCCEEDED)
+    payload, status = asyncio.run(jobs_controller.cancel_job_async(done_id))
+    assert status == 409
@@ -0,0 +1,32 @@
+import os
+import time
+
+from obfuscate.llmcache import ResponseCache, cache_key
+
+
+def test_expired_entries_are_evicted_even_when_read(tmp_path):
+    cache = ResponseCache(directory=str(tmp_path), memory_entries=0, ttl=0.3)
+    key = cache_key('model', 'system', 'content')
+    cache.put(key, 'answer')
+    time.sleep(0.2)
+    # A read makes the entry recently used but must not extend its life
+    assert cache.get(key) == 'answer'
+    time.sleep(0.2)
+    cache.evict()
+    assert not os.path.exists(cache._path(key))
+
+
+def test_size_eviction_drops_least_recently_read_first(tmp_path):
+    cache = ResponseCache(directory=str(tmp_path), memory_entries=0, ttl=0, max_disk_bytes=10 ** 9)
+    keys = [cache_key('model', 'system', str(i)) for i in range(3)]
+    for i, key in enumerate(keys):
+        cache.put(key, 'x' * 100)
+        os.utime(cache._path(key), (1000 + i, 1000 + i))
+    # Reading the oldest entry makes it the most recently used
+    assert cache.get(keys[0]) is not None
+    created = os.stat(cache._path(keys[0])).st_mtime
+
+    cache.max_disk_bytes = os.path.getsize(cache._path(keys[0])) * 2.5
+    cache.evict()
+    assert [os.path.exists(cache._path(key)) for key in keys] == [True, False, True]
+    assert os.stat(cache._path(keys[0])).st_mtime == created
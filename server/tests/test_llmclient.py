@@ -0,0 +1,246 @@
+import json
+import time
+import asyncio
+import threading
+
+import pytest
+
+from obfuscate import llmclient
+from obfuscate.llmclient import FakeBackend, LLMBackend, LLMClient, RateLimiter, TokenBucket
+
+
+class FlakyBackend(LLMBackend):
+    """Fails the first `failures` calls with error, then answers"""
+
+    name = "flaky"
+    remote = False
+
+    def __init__(self, failures, error=ConnectionError):
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+
+    def generate(self, prompt):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error("backend unavailable")
+        return "ok"
+
+
+class SlowBackend(LLMBackend):
+    """Sleeps `delays[n]` seconds on its n-th call (the last delay repeats) and tracks concurrency"""
+
+    name = "slow"
+    remote = False
+
+    def __init__(self, *delays):
+        self.delays = delays
+        self.calls = 0
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def generate(self, prompt):
+        with self._lock:
+            delay = self.delays[min(self.calls, len(self.delays) - 1)]
+            self.calls += 1
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            time.sleep(delay)
+            return prompt
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Records the delays the client and limiter sleep for instead of sleeping"""
+    recorded = []
+
+    async def fake_sleep(delay, result=None):
+        recorded.append(delay)
+        return result
+
+    monkeypatch.setattr(llmclient.asyncio, 'sleep', fake_sleep)
+    return recorded
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_fake_backend_replaces_values_deterministically():
+    client = LLMClient(FakeBackend(), max_retries=0)
+    try:
+        first = run(client.generate("Obfuscate these.\nInput data: Alice,555-0100"))
+        second = run(client.generate("Obfuscate these.\nInput data: Alice,555-0100"))
+    finally:
+        client.shutdown()
+    assert first == second
+    values = json.loads(first)['changed_names']
+    assert len(values) == 2
+    assert values[0] != 'Alice' and values[0].isalpha()
+    assert values[1][3] == '-' and values[1].replace('-', '').isdigit()
+
+
+def test_fake_backend_stream_matches_generate():
+    client = LLMClient(FakeBackend(), max_retries=0)
+
+    async def collect():
+        return ''.join([chunk async for chunk in client.stream("Input data: a,b,c")])
+
+    try:
+        assert run(collect()) == FakeBackend().generate("Input data: a,b,c")
+    finally:
+        client.shutdown()
+
+
+def test_retries_with_jittered_exponential_backoff(sleeps):
+    backend = FlakyBackend(failures=3)
+    client = LLMClient(backend, max_retries=4)
+    try:
+        assert run(client.generate("prompt")) == "ok"
+    finally:
+        client.shutdown()
+    assert backend.calls == 4
+    assert len(sleeps) == 3
+    for attempt, delay in enumerate(sleeps):
+        ceiling = min(llmclient.BACKOFF_MAX, llmclient.BACKOFF_BASE * 2 ** attempt)
+        assert ceiling * 0.5 <= delay <= ceiling
+
+
+def test_backoff_is_jittered(sleeps, monkeypatch):
+    monkeypatch.setattr(llmclient.random, 'uniform', lambda low, high: low)
+    client = LLMClient(FlakyBackend(failures=2), max_retries=2)
+    try:
+        run(client.generate("prompt"))
+    finally:
+        client.shutdown()
+    assert sleeps == [llmclient.BACKOFF_BASE * 0.5, llmclient.BACKOFF_BASE * 2 * 0.5]
+
+
+def test_gives_up_after_max_retries(sleeps):
+    backend = FlakyBackend(failures=10)
+    client = LLMClient(backend, max_retries=2)
+    try:
+        with pytest.raises(ConnectionError):
+            run(client.generate("prompt"))
+    finally:
+        client.shutdown()
+    assert backend.calls == 3
+
+
+def test_non_retryable_errors_are_raised_at_once(sleeps):
+    class StrictBackend(FlakyBackend):
+        def is_retryable(self, error):
+            return False
+
+    backend = StrictBackend(failures=1, error=ValueError)
+    client = LLMClient(backend, max_retries=4)
+    try:
+        with pytest.raises(ValueError):
+            run(client.generate("prompt"))
+    finally:
+        client.shutdown()
+    assert backend.calls == 1
+    assert sleeps == []
+
+
+def test_per_call_timeout():
+    client = LLMClient(SlowBackend(1.0), timeout=0.05, max_retries=0)
+    start = time.perf_counter()
+    try:
+        with pytest.raises(TimeoutError):
+            run(client.generate("prompt"))
+    finally:
+        client.shutdown()
+    assert time.perf_counter() - start < 0.5
+
+
+def test_timed_out_call_is_retried(monkeypatch):
+    monkeypatch.setattr(llmclient, 'BACKOFF_BASE', 0.01)
+    backend = SlowBackend(0.5, 0.0)
+    client = LLMClient(backend, timeout=0.1, max_retries=1)
+    try:
+        assert run(client.generate("prompt")) == "prompt"
+    finally:
+        client.shutdown()
+    assert backend.calls == 2
+
+
+def test_token_bucket_throttles_past_its_capacity(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(llmclient.time, 'monotonic', lambda: now[0])
+    bucket = TokenBucket(per_minute=60)
+    assert all(bucket.reserve() == 0.0 for _ in range(60))
+    assert bucket.reserve() == pytest.approx(1.0)
+    assert bucket.reserve() == pytest.approx(2.0)
+    # The balance is repaid at one token per second
+    now[0] += 3.0
+    assert bucket.reserve() == 0.0
+
+
+def test_token_bucket_caps_oversized_reservations(monkeypatch):
+    monkeypatch.setattr(llmclient.time, 'monotonic', lambda: 0.0)
+    bucket = TokenBucket(per_minute=600)
+    assert bucket.reserve(10000) == 0.0
+    assert bucket.reserve(10) == pytest.approx(1.0)
+
+
+def test_rate_limiter_waits_for_the_tighter_budget(sleeps, monkeypatch):
+    monkeypatch.setattr(llmclient.time, 'monotonic', lambda: 0.0)
+    limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=600)
+    run(limiter.acquire(600))
+    assert sleeps == []
+    run(limiter.acquire(60))
+    assert sleeps == [pytest.approx(6.0)]
+
+
+def test_disabled_rate_limiter_never_waits(sleeps):
+    limiter = RateLimiter(0, 0)
+    for _ in range(1000):
+        run(limiter.acquire(10000))
+    assert sleeps == []
+
+
+def test_client_rate_limits_calls(sleeps, monkeypatch):
+    monkeypatch.setattr(llmclient.time, 'monotonic', lambda: 0.0)
+    client = LLMClient(FakeBackend(), requests_per_minute=2, max_retries=0)
+    try:
+        for _ in range(3):
+            run(client.generate("Input data: x"))
+    finally:
+        client.shutdown()
+    assert sleeps == [pytest.approx(30.0)]
+
+
+def test_executor_bounds_concurrent_backend_calls():
+    backend = SlowBackend(0.05)
+    client = LLMClient(backend, max_concurrency=2, max_retries=0)
+
+    async def burst():
+        return await asyncio.gather(*(client.generate(str(i)) for i in range(8)))
+
+    try:
+        assert run(burst()) == [str(i) for i in range(8)]
+    finally:
+        client.shutdown()
+    assert backend.calls == 8
+    assert backend.peak == 2
+
+
+def test_executor_bound_holds_across_event_loops():
+    backend = SlowBackend(0.05)
+    client = LLMClient(backend, max_concurrency=3, max_retries=0)
+    threads = [threading.Thread(target=lambda: run(client.generate("x"))) for _ in range(9)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        client.shutdown()
+    assert backend.calls == 9
+    assert backend.peak == 3
@@ -0,0 +1,62 @@
+import io
+import asyncio
+
+import pytest
+from werkzeug.datastructures import FileStorage, MultiDict
+
+fitz = pytest.importorskip('fitz')
+
+from controller import pdfhandler_controller
+from core.resultcache import ResultCache
+from obfuscate import llmclient
+from obfuscate.llmclient import FakeBackend, LLMClient
+from obfuscate.pdfhandler import predictpdfheaders_async
+
+HEADERS = '[{"name": "Email", "mode": "mask"}]'
+
+
+def make_pdf(text):
+    doc = fitz.open()
+    doc.new_page().insert_text((72, 72), text)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = ResultCache(index_path=str(tmp_path / 'index.json'))
+    monkeypatch.setattr(pdfhandler_controller, 'get_result_cache', lambda: cache)
+    monkeypatch.setattr(pdfhandler_controller, 'backend_version', lambda: 'fake:fake')
+    # The header scan asks the model which fields the text holds
+    monkeypatch.setenv('LLM_CACHE', '0')
+    client = LLMClient(FakeBackend(), max_retries=0)
+    monkeypatch.setattr(llmclient, '_client', client)
+    yield cache
+    client.shutdown()
+
+
+def mask(tmp_path, pdf):
+    form = MultiDict({'headers': HEADERS, 'outputPath': str(tmp_path / 'out')})
+    files = MultiDict({'file': FileStorage(stream=io.BytesIO(pdf), filename='report.pdf')})
+    payload, status = asyncio.run(pdfhandler_controller.maskpdf_async(form, files))
+    assert status == 200, payload
+    return payload
+
+
+def test_changed_header_scan_misses_the_cache(tmp_path, cache):
+    report = make_pdf("Contact alice@example.com for details")
+    other = make_pdf("Contact bob@example.org for details")
+
+    asyncio.run(predictpdfheaders_async(report))
+    first = mask(tmp_path, report)
+    assert first['cacheHit'] is False
+    assert mask(tmp_path, report)['cacheHit'] is True
+    doc = fitz.open(first['output'])
+    assert 'alice@example.com' not in doc[0].get_text()
+    doc.close()
+
+    # Values left by a scan of another document must not hit the output cached above
+    asyncio.run(predictpdfheaders_async(other))
+    assert mask(tmp_path, report)['cacheHit'] is False
+    assert mask(tmp_path, report)['cacheHit'] is True
@@ -0,0 +1,53 @@
+import asyncio
+
+import pytest
+
+fitz = pytest.importorskip('fitz')
+
+from obfuscate import pdfhandler
+
+
+def make_pdf(text):
+    doc = fitz.open()
+    doc.new_page().insert_text((72, 72), text)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+@pytest.fixture
+def opened(monkeypatch):
+    """Documents opened by the handler"""
+    docs = []
+
+    def open_pdf(stream):
+        doc, pages = real_open(stream)
+        docs.append(doc)
+        return doc, pages
+
+    real_open = pdfhandler.open_pdf
+    monkeypatch.setattr(pdfhandler, 'open_pdf', open_pdf)
+    return docs
+
+
+def test_failed_mask_closes_its_document(opened, monkeypatch, tmp_path):
+    def broken(*args):
+        raise RuntimeError("redaction failed")
+
+    monkeypatch.setattr(pdfhandler, 'apply_replacements', broken)
+    config = {'fileName': 'a.pdf', 'headers': [{'name': 'Email', 'mode': 'mask'}], 'outputPath': str(tmp_path),
+              'fieldValues': {'Email': ['alice@example.com']}}
+    with memoryview(make_pdf("alice@example.com")) as view:
+        assert asyncio.run(pdfhandler.maskobfpdf_async(config, view)) == "redaction failed"
+        assert len(opened) == 1 and opened[0].is_closed
+
+
+def test_failed_batch_closes_its_documents(opened, monkeypatch, tmp_path):
+    def broken(*args):
+        raise RuntimeError("redaction failed")
+
+    monkeypatch.setattr(pdfhandler, 'apply_value_replacements', broken)
+    config = {'headers': [{'name': 'Email', 'mode': 'mask'}], 'outputPath': str(tmp_path)}
+    with pytest.raises(RuntimeError):
+        asyncio.run(pdfhandler.maskobfpdf_batch_async(config, [('a.pdf', make_pdf("alice@example.com"))]))
+    assert len(opened) == 1 and opened[0].is_closed
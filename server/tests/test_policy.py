@@ -0,0 +1,81 @@
+import json
+
+import pytest
+
+from obfuscate import policy as policies
+from obfuscate.policy import PolicyConflict, PolicyError, PolicyRegistry, cached_policy, compile_policy
+
+
+@pytest.mark.parametrize('pattern', [
+    r'(a+)+$',
+    r'(?:\w+\s?)*x',
+    r'(a|aa)*b',
+    r'(\w+)\1',
+    r'x' * (policies.PATTERN_MAX_LENGTH + 1),
+])
+def test_template_patterns_that_backtrack_are_rejected(pattern):
+    with pytest.raises(PolicyError):
+        compile_policy([{'name': 'Code', 'mode': 'mask', 'pattern': pattern}], allow_patterns=True)
+
+
+@pytest.mark.parametrize('pattern', [
+    r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}',
+    r'\bEMP-\d{6}\b',
+    r'(?:Mr|Mrs|Ms)\.\s+[A-Z][a-z]+',
+    r'(?i)e-?mail.*',
+])
+def test_template_patterns_of_plain_shapes_compile(pattern):
+    policy = compile_policy([{'name': 'Code', 'mode': 'mask', 'pattern': pattern}], allow_patterns=True)
+    assert policy.fields[0].recognizer is not None
+
+
+def test_ad_hoc_headers_cannot_carry_patterns():
+    with pytest.raises(PolicyError):
+        cached_policy([{'name': 'Email', 'mode': 'mask', 'match': '(?i)e-?mail.*'}])
+    with pytest.raises(PolicyError):
+        cached_policy(json.dumps([{'name': 'Email', 'mode': 'mask', 'pattern': r'\S+@\S+'}]))
+
+
+def test_template_fields_match_columns_and_find_values():
+    policy = compile_policy([
+        {'name': 'Email', 'mode': 'mask', 'match': '(?i)(work )?e-?mail'},
+        {'name': 'Employee', 'mode': 'mask', 'pattern': r'\bEMP-\d{6}\b'},
+    ], allow_patterns=True)
+    resolved = policy.resolve(['Name', 'Email', 'Work E-mail', 'Employee'])
+    assert [(column, field.name) for column, field in resolved] == [
+        ('Email', 'Email'), ('Work E-mail', 'Email'), ('Employee', 'Employee')]
+    assert policy.find_values("ids EMP-123456 and EMP-654321")['Employee'] == ['EMP-123456', 'EMP-654321']
+
+
+def test_replacing_a_template_needs_the_token(tmp_path, monkeypatch):
+    registry = PolicyRegistry(folder=str(tmp_path))
+    fields = [{'name': 'Email', 'mode': 'mask'}]
+    assert registry.register('hr', fields).version == 1
+
+    monkeypatch.delenv('POLICY_TOKEN', raising=False)
+    with pytest.raises(PolicyConflict):
+        registry.register('hr', fields, token='anything')
+
+    monkeypatch.setenv('POLICY_TOKEN', 's3cret')
+    with pytest.raises(PolicyConflict):
+        registry.register('hr', fields, token='wrong')
+    assert registry.register('hr', fields, token='s3cret').version == 2
+    assert registry.get('hr').version == 2
+
+
+def test_registry_skips_stored_templates_that_no_longer_validate(tmp_path):
+    (tmp_path / 'old.json').write_text(json.dumps(
+        {'name': 'old', 'version': 1, 'fields': [{'name': 'X', 'mode': 'mask', 'pattern': '(a+)+$'}]}))
+    registry = PolicyRegistry(folder=str(tmp_path))
+    registry.register('new', [{'name': 'Email', 'mode': 'mask'}])
+    assert [policy.name for policy in registry.list()] == ['new']
+
+
+def test_template_patterns_are_time_limited(monkeypatch):
+    pytest.importorskip('regex')
+    # Let a catastrophic pattern past the shape check to reach the time limit
+    monkeypatch.setattr(policies, '_check_nodes', lambda nodes, repeated=False: None)
+    monkeypatch.setenv('POLICY_PATTERN_TIMEOUT', '0.1')
+    field = policies.CompiledField('Code', 'mask', pattern=r'(x+x+)+y')
+    with pytest.raises(PolicyError):
+        field.find('x' * 5000)
@@ -0,0 +1,48 @@
+import os
+import json
+
+import pytest
+
+import settings
+from core.profiling import ProfileSession, find_profile
+
+
+@pytest.fixture(autouse=True)
+def profiles_folder(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'PROFILES_FOLDER', str(tmp_path))
+    return tmp_path
+
+
+def test_a_sole_session_records_its_own_peak():
+    session = ProfileSession('sole').start()
+    block = bytearray(4 * 1024 * 1024)
+    del block
+    summary = session.finish(200)
+    assert summary['tracemallocShared'] is False
+    assert summary['tracemallocPeakBytes'] >= 4 * 1024 * 1024
+
+
+def test_overlapping_sessions_are_marked_shared():
+    first = ProfileSession('first').start()
+    second = ProfileSession('second').start()
+    block = bytearray(4 * 1024 * 1024)
+    del block
+    first_summary = first.finish(200)
+    # Still shared after the other session left: its peak covered both
+    second_summary = second.finish(200)
+    for summary in (first_summary, second_summary):
+        assert summary['tracemallocShared'] is True
+        assert summary['tracemallocPeakBytes'] is None
+
+    third = ProfileSession('third').start()
+    assert third.finish(200)['tracemallocShared'] is False
+
+
+def test_artifacts_are_named_by_the_server_not_the_trace_id(profiles_folder):
+    session = ProfileSession('named', trace_id='../client-chosen').start()
+    summary = session.finish(200)
+    assert summary['traceId'] == '../client-chosen'
+    assert summary['profileId'] == session.profile_id != '../client-chosen'
+    assert sorted(os.listdir(profiles_folder)) == [f'{session.profile_id}.json', f'{session.profile_id}.prof']
+    with open(find_profile(session.profile_id), encoding='utf-8') as f:
+        assert json.load(f)['profileId'] == session.profile_id